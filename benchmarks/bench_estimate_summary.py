@@ -0,0 +1,63 @@
+"""Microbenchmark for Summarizer.estimate_summary.
+
+Builds a large text from tests/assets/count.txt and compares estimating its
+summary, which only encodes samples of the text, with counting all of its
+tokens as the summarize command used to do before scheduling a summary.
+
+Run with: python -m benchmarks.bench_estimate_summary
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from bot.modules.openai_conversation import OpenAIConversation, get_tokenizer
+from bot.modules.summarizer import Summarizer, SummaryMode
+
+TEXT_PATH = Path("tests/assets/count.txt")
+
+
+def build_text(size: int) -> str:
+    text = TEXT_PATH.read_text()
+    return (text * (size // len(text) + 1))[:size]
+
+
+def timed(function, repeat: int) -> tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    text = build_text(int(args.megabytes * 1_000_000))
+    summarizer = Summarizer()
+    get_tokenizer()  # Load the encoding outside the timed sections
+
+    full_seconds, token_count = timed(
+        lambda: OpenAIConversation().get_text_token_length(text), args.repeat
+    )
+    print(f"{'full encode':32} {full_seconds * 1000:10.2f} ms  {token_count} tokens")
+    for mode in SummaryMode:
+        seconds, estimate = timed(
+            lambda: summarizer.estimate_summary(text, mode=mode), args.repeat
+        )
+        sampled = OpenAIConversation().estimate_text_token_length(text)
+        error = abs(sampled - token_count) / token_count
+        print(
+            f"{'estimate_summary (' + mode.value + ')':32} {seconds * 1000:10.2f} ms  "
+            f"{estimate.api_calls} calls, ${estimate.cost:.2f}, "
+            f"{estimate.seconds / 60:.1f} min, token error {error:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
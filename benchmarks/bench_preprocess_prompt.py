@@ -0,0 +1,88 @@
+"""Microbenchmark for OpenAIConversation.preprocess_prompt.
+
+Builds a long chat history from tests/assets/count.txt and measures how long
+it takes to trim it to the model limit. The quadratic reference re-encodes the
+remaining history after every removed message, as the recursive implementation
+used to do.
+
+Run with: python -m benchmarks.bench_preprocess_prompt
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from bot.modules.openai_conversation import (
+    Message,
+    OpenAIConversation,
+    Role,
+    get_tokenizer,
+)
+
+TEXT_PATH = Path("tests/assets/count.txt")
+
+
+def build_history(message_count: int, message_chars: int) -> list[Message]:
+    text = TEXT_PATH.read_text()
+    roles = [Role.USER, Role.ASSISTANT]
+    history = [Message(role=Role.SYSTEM, content="You are a helpful assistant.")]
+    for i in range(message_count):
+        start = (i * message_chars) % (len(text) - message_chars)
+        content = text[start : start + message_chars]
+        history.append(Message(role=roles[i % 2], content=content))
+    return history
+
+
+def quadratic_reference(prompt: list[Message], limit: int) -> list[Message]:
+    tokenizer = get_tokenizer()
+    while True:
+        total = sum(len(tokenizer.encode(message.content)) for message in prompt)
+        if total < limit or len(prompt) <= 2:
+            return prompt
+        prompt = prompt[0:1] + prompt[2:]
+
+
+def timed(function, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--message-chars", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    conversation = OpenAIConversation()
+    limit = conversation.get_limit(1000)
+    get_tokenizer()  # Load the encoding outside the timed sections
+
+    def reference():
+        quadratic_reference(build_history(args.messages, args.message_chars), limit)
+
+    def cold():
+        conversation.preprocess_prompt(build_history(args.messages, args.message_chars))
+
+    warm_history = build_history(args.messages, args.message_chars)
+
+    def warm():
+        conversation.preprocess_prompt(warm_history)
+
+    results = {
+        "quadratic reference": timed(reference, args.repeat),
+        "preprocess_prompt (cold)": timed(cold, args.repeat),
+        "preprocess_prompt (memoized)": timed(warm, args.repeat),
+    }
+    baseline = results["quadratic reference"]
+    for name, seconds in results.items():
+        print(f"{name:32} {seconds * 1000:10.2f} ms  {baseline / seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
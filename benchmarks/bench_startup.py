@@ -0,0 +1,137 @@
+"""Start up benchmark for the bot entry point.
+
+Builds the app with all its handlers in fresh interpreters, as main does
+before it starts polling, and reports the median time it takes together
+with the import time of every package, from python -X importtime. With
+--prewarm the time to prewarm the heavy modules and the tokenizer is
+measured as well, and its imports are included. Results are written to a
+JSON file and compared with a baseline file from a previous run when one
+is given.
+
+Run with: python -m benchmarks.bench_startup --output startup-results.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from bot.main import build_application, prewarm
+build_application("123:fake")
+timings = {"startup": time.perf_counter() - start}
+if "--prewarm" in sys.argv:
+    start = time.perf_counter()
+    prewarm()
+    timings["prewarm"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def parse_import_times(stderr: str) -> dict[str, int]:
+    """Adds up the self import time in microseconds of each top level package."""
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return packages
+
+
+def run_once(prewarm: bool) -> tuple[dict, dict[str, int]]:
+    command = [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT]
+    if prewarm:
+        command.append("--prewarm")
+    process = subprocess.run(
+        command,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    return json.loads(process.stdout.splitlines()[-1]), parse_import_times(
+        process.stderr
+    )
+
+
+def run(runs: int, prewarm: bool) -> dict:
+    timings, imports = [], defaultdict(list)
+    for _ in range(runs):
+        timing, packages = run_once(prewarm)
+        timings.append(timing)
+        for name, microseconds in packages.items():
+            imports[name].append(microseconds)
+    result = {
+        "startup_ms": statistics.median(t["startup"] for t in timings) * 1000,
+        "imports_ms": {
+            name: statistics.median(values + [0] * (runs - len(values))) / 1000
+            for name, values in sorted(
+                imports.items(), key=lambda item: -statistics.median(item[1])
+            )
+        },
+    }
+    if prewarm:
+        result["prewarm_ms"] = statistics.median(t["prewarm"] for t in timings) * 1000
+    return result
+
+
+def print_results(result: dict, baseline: Optional[dict], top: int) -> None:
+    def change(key: str, value: float, previous: Optional[dict]) -> str:
+        if not previous or not previous.get(key):
+            return ""
+        return f"  {value / previous[key] - 1:+.1%} vs baseline"
+
+    print(
+        f"{'startup':24} {result['startup_ms']:10.2f} ms"
+        + change("startup_ms", result["startup_ms"], baseline)
+    )
+    if "prewarm_ms" in result:
+        print(
+            f"{'prewarm':24} {result['prewarm_ms']:10.2f} ms"
+            + change("prewarm_ms", result["prewarm_ms"], baseline)
+        )
+    previous_imports = baseline["imports_ms"] if baseline else None
+    for name, milliseconds in list(result["imports_ms"].items())[:top]:
+        print(
+            f"  import {name:17} {milliseconds:10.2f} ms"
+            + change(name, milliseconds, previous_imports)
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="startup-results.json")
+    parser.add_argument("--baseline", help="Results of a previous run to compare")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Packages to print")
+    parser.add_argument("--prewarm", action="store_true")
+    args = parser.parse_args()
+
+    result = run(args.runs, args.prewarm)
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+    print_results(result, baseline, args.top)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runs": args.runs,
+        },
+        "results": result,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
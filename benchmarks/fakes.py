@@ -0,0 +1,284 @@
+"""Offline stand-ins for the services the bot talks to.
+
+Used by the tests and the benchmark suite to run the bot without network
+access: a tokenizer, an OpenAI chat completions server, a Telegram Bot API
+request backend and builders for PDFs and Telegram updates.
+"""
+import asyncio
+import json
+import random
+import socket
+import time
+from typing import Optional
+
+from aiohttp import web
+from telegram.request import BaseRequest, RequestData
+
+from bot.utilities.http_session import close_http_session
+
+
+class FakeTokenizer:
+    """Offline stand-in for a tiktoken encoding, one token every 4 characters."""
+
+    CHARS_PER_TOKEN = 4
+
+    def encode(self, text: str) -> list[str]:
+        size = self.CHARS_PER_TOKEN
+        return [text[i : i + size] for i in range(0, len(text), size)]
+
+    def decode(self, tokens: list[str]) -> str:
+        return "".join(tokens)
+
+
+class FakeOpenAIServer:
+    """Local HTTP stand-in for the OpenAI chat completions endpoint."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        stream_chunk_delay: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.stream_chunk_delay = stream_chunk_delay
+        # Share of requests answered with a 500 error, chosen at random
+        self.error_rate = error_rate
+        self.errors = 0
+        self._random = random.Random(seed)
+        self.requests: list[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Statuses to answer the next requests with before succeeding again
+        self.failures: list[int] = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _completion_content(self) -> str:
+        return "Subject: Fake\nKey points:\n- Point " + str(len(self.requests))
+
+    async def _stream_completion(
+        self, request: web.Request, payload: dict, content: str
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i, word in enumerate(content.split(" ")):
+            delta = {"content": word if i == 0 else " " + word}
+            await self._write_event(response, payload, delta, None)
+            await asyncio.sleep(self.stream_chunk_delay)
+        await self._write_event(response, payload, {}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def _write_event(
+        self,
+        response: web.StreamResponse,
+        payload: dict,
+        delta: dict,
+        finish_reason: str | None,
+    ) -> None:
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+    async def _chat_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append(payload)
+        status = self.failures.pop(0) if self.failures else None
+        if status is None and self._random.random() < self.error_rate:
+            status = 500
+        if status is not None:
+            self.errors += 1
+            error = {"error": {"message": "Fake failure", "type": "fake"}}
+            return web.json_response(error, status=status, headers={"Retry-After": "0"})
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            content = self._completion_content()
+            if payload.get("stream"):
+                return await self._stream_completion(request, payload, content)
+        finally:
+            self.in_flight -= 1
+        body = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+        }
+        return web.Response(text=json.dumps(body), content_type="application/json")
+
+    async def __aenter__(self) -> "FakeOpenAIServer":
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.SockSite(self._runner, self._socket).start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await close_http_session()
+        await self._runner.cleanup()
+
+
+def build_pdf(pages_text: list[str]) -> bytes:
+    """Builds a minimal PDF with one line of text on every page."""
+    page_count = len(pages_text)
+    font_id = 3 + 2 * page_count
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids ["
+        + b" ".join(f"{3 + 2 * i} 0 R".encode() for i in range(page_count))
+        + f"] /Count {page_count} >>".encode(),
+    ]
+    for i, text in enumerate(pages_text):
+        content = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        objects.append(
+            f"<< /Length {len(content)} >>\nstream\n".encode()
+            + content
+            + b"\nendstream"
+        )
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+    return pdf
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls locally, recording the messages the bot sends.
+
+    Files to download are registered in files by their path.
+    """
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+
+    def __init__(self) -> None:
+        self.files: dict[str, bytes] = {}
+        # (time, method, parameters) of every call
+        self.calls: list[tuple[float, str, dict]] = []
+        self._message_ids = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, parameters: dict) -> dict:
+        message_id = parameters.get("message_id")
+        if message_id is None:
+            self._message_ids += 1
+            message_id = self._message_ids
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": parameters.get("chat_id", 0), "type": "private"},
+            "from": self.BOT_USER,
+            "text": parameters.get("text", ""),
+        }
+
+    def _answer(self, method: str, parameters: dict):
+        if method == "getMe":
+            return self.BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(parameters)
+        if method == "getFile":
+            file_id = parameters["file_id"]
+            return {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files[file_id]),
+                "file_path": file_id,
+            }
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        *args,
+        **kwargs,
+    ) -> tuple[int, bytes]:
+        if "/file/bot" in url:
+            return 200, self.files[url.rsplit("/", 1)[-1]]
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls.append((time.perf_counter(), endpoint, parameters))
+        result = self._answer(endpoint, parameters)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_message_update(
+    update_id: int,
+    user_id: int,
+    username: str,
+    text: Optional[str] = None,
+    document: Optional[dict] = None,
+) -> dict:
+    """Builds the JSON of a private message update, with a text or a document."""
+    user = {"id": user_id, "is_bot": False, "first_name": username}
+    user["username"] = username
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": user,
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            command_length = len(text.split()[0])
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": command_length}
+            ]
+    if document is not None:
+        message["document"] = document
+    return {"update_id": update_id, "message": message}
+
+
+def make_pdf_document(file_id: str, size: int) -> dict:
+    return {
+        "file_id": file_id,
+        "file_unique_id": file_id,
+        "file_name": f"{file_id}.pdf",
+        "mime_type": "application/pdf",
+        "file_size": size,
+    }
@@ -0,0 +1,300 @@
+"""Offline benchmark suite for the hot paths of the bot.
+
+Runs preprocess_prompt, extract_text_from_pdf, the map-reduce Summarizer and
+the /summarize conversation handler end to end against a local fake OpenAI
+server and synthetic Telegram updates. Throughput, p50/p99 latency and peak
+traced memory of every case are written to a JSON file. When a baseline file
+from a previous run is given, the changes against it are printed as well.
+
+Run with: python -m benchmarks.suite --output benchmark-results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import openai
+import toml
+from telegram import Update
+from telegram.ext import Application
+
+from benchmarks.fakes import (
+    FakeOpenAIServer,
+    FakeTelegramRequest,
+    FakeTokenizer,
+    build_pdf,
+    make_message_update,
+    make_pdf_document,
+)
+from bot.modules.openai_conversation import (
+    Message,
+    OpenAIConversation,
+    Role,
+    get_tokenizer,
+)
+from bot.modules.summarizer import Summarizer, SummaryMode
+from bot.utilities.pdf_reader import extract_text_from_pdf
+from bot.utilities.worker_pool import shutdown_worker_pool
+
+TEXT_PATH = Path("tests/assets/count.txt")
+
+
+@dataclass
+class CaseResult:
+    name: str
+    seconds: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    peak_memory: int = 0
+    extra: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(value: float) -> float:
+            index = min(len(latencies) - 1, int(len(latencies) * value / 100))
+            return latencies[index] * 1000
+
+        return {
+            "operations": len(latencies),
+            "throughput_per_second": len(latencies) / self.seconds,
+            "p50_ms": percentile(50),
+            "p99_ms": percentile(99),
+            "mean_ms": statistics.fmean(latencies) * 1000,
+            "peak_memory_mb": self.peak_memory / 1_000_000,
+            **self.extra,
+        }
+
+
+class Timer:
+    """Records the latency of operations and the peak memory of a case."""
+
+    def __init__(self, name: str) -> None:
+        self.result = CaseResult(name)
+
+    def __enter__(self) -> "Timer":
+        tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.result.seconds = time.perf_counter() - self._start
+        self.result.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def measure(self, function: Callable[[], object]) -> object:
+        start = time.perf_counter()
+        result = function()
+        self.result.latencies.append(time.perf_counter() - start)
+        return result
+
+    async def ameasure(self, function: Callable[[], Awaitable[object]]) -> object:
+        start = time.perf_counter()
+        result = await function()
+        self.result.latencies.append(time.perf_counter() - start)
+        return result
+
+
+def read_text(size: int, offset: int = 0) -> str:
+    text = TEXT_PATH.read_text()
+    text = text * (size // len(text) + 2)
+    return text[offset : offset + size]
+
+
+def bench_preprocess_prompt(iterations: int) -> CaseResult:
+    text = read_text(200 * 400)
+    roles = [Role.USER, Role.ASSISTANT]
+
+    def build_prompt() -> list[Message]:
+        prompt = [Message(role=Role.SYSTEM, content="You are a helpful assistant.")]
+        for i in range(200):
+            content = text[i * 400 : (i + 1) * 400]
+            prompt.append(Message(role=roles[i % 2], content=content))
+        return prompt
+
+    conversation = OpenAIConversation()
+    with Timer("preprocess_prompt") as timer:
+        for _ in range(iterations):
+            prompt = build_prompt()
+            timer.measure(lambda: conversation.preprocess_prompt(prompt))
+    return timer.result
+
+
+def bench_extract_text_from_pdf(iterations: int, pages: int) -> CaseResult:
+    pdf_bytes = build_pdf([f"Line of text in page {i}" for i in range(pages)])
+    with Timer("extract_text_from_pdf") as timer:
+        for _ in range(iterations):
+            timer.measure(lambda: extract_text_from_pdf(pdf_bytes))
+    timer.result.extra["pages"] = pages
+    return timer.result
+
+
+async def bench_summarizer(
+    server: FakeOpenAIServer, summaries: int, text_chars: int
+) -> CaseResult:
+    summarizer = Summarizer(max_concurrency=8)
+
+    async def summarize(i: int) -> str:
+        text = read_text(text_chars, offset=i * 1000)
+        return await summarizer.agenerate_summary(text, mode=SummaryMode.MAP_REDUCE)
+
+    requests_before = len(server.requests)
+    with Timer("summarizer_map_reduce") as timer:
+        await asyncio.gather(
+            *[timer.ameasure(lambda i=i: summarize(i)) for i in range(summaries)]
+        )
+    timer.result.extra["api_requests"] = len(server.requests) - requests_before
+    return timer.result
+
+
+async def bench_summarize_handler(
+    server: FakeOpenAIServer, users: int, text_chars: int, pdf_pages: int
+) -> CaseResult:
+    # Whitelist the synthetic users in a separate access file
+    access_file = os.path.join(tempfile.mkdtemp(), "access.toml")
+    usernames = [f"bench_user_{i}" for i in range(1, users + 1)]
+    Path(access_file).write_text(toml.dumps({"admins": [], "whitelist": usernames}))
+    os.environ["ACCESS_FILE"] = access_file
+    from bot.commands import sumarize
+
+    request = FakeTelegramRequest()
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .concurrent_updates(True)
+        .build()
+    )
+    app.add_handler(sumarize.summarize_conversation_handler)
+    pdf_bytes = build_pdf([f"Line of text in page {i}" for i in range(pdf_pages)])
+
+    async def user_session(user_id: int) -> None:
+        username = f"bench_user_{user_id}"
+        command = make_message_update(user_id * 10, user_id, username, "/summarize")
+        await app.process_update(Update.de_json(command, app.bot))
+        if user_id % 2:
+            file_id = f"document_{user_id}"
+            request.files[file_id] = pdf_bytes
+            document = make_pdf_document(file_id, len(pdf_bytes))
+            content = make_message_update(
+                user_id * 10 + 1, user_id, username, document=document
+            )
+        else:
+            text = read_text(text_chars, offset=user_id * 1000)
+            content = make_message_update(user_id * 10 + 1, user_id, username, text)
+        await app.process_update(Update.de_json(content, app.bot))
+
+    await app.initialize()
+    await app.start()
+    requests_before = len(server.requests)
+    try:
+        with Timer("summarize_handler") as timer:
+            await asyncio.gather(
+                *[
+                    timer.ameasure(lambda i=i: user_session(i))
+                    for i in range(1, users + 1)
+                ]
+            )
+    finally:
+        await app.stop()
+        await app.shutdown()
+    timer.result.extra["api_requests"] = len(server.requests) - requests_before
+    timer.result.extra["telegram_calls"] = len(request.calls)
+    return timer.result
+
+
+async def run_online_cases(args: argparse.Namespace) -> list[CaseResult]:
+    server = FakeOpenAIServer(latency=args.latency, error_rate=args.error_rate)
+    openai.api_base = server.api_base
+    openai.api_key = "sk-fake"
+    async with server:
+        results = [
+            await bench_summarizer(server, args.summaries, args.text_chars),
+            await bench_summarize_handler(
+                server, args.users, args.text_chars, args.pdf_pages
+            ),
+        ]
+    for result in results:
+        result.extra["api_errors"] = server.errors
+    return results
+
+
+def print_results(results: dict, baseline: Optional[dict]) -> None:
+    for name, result in results.items():
+        line = (
+            f"{name:24} {result['throughput_per_second']:10.2f}/s "
+            f"p50 {result['p50_ms']:10.2f} ms  p99 {result['p99_ms']:10.2f} ms  "
+            f"peak {result['peak_memory_mb']:8.2f} MB"
+        )
+        if baseline and name in baseline:
+            previous = baseline[name]
+            change = result["p50_ms"] / previous["p50_ms"] - 1
+            line += f"  p50 {change:+.1%} vs baseline"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Results of a previous run to compare")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--pdf-pages", type=int, default=50)
+    parser.add_argument("--summaries", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--text-chars", type=int, default=40_000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--fake-tokenizer",
+        action="store_true",
+        help="Count 4 characters per token instead of loading the tiktoken encoding",
+    )
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    if args.fake_tokenizer:
+        tokenizer = FakeTokenizer()
+        OpenAIConversation._get_tokenizer = lambda self: tokenizer
+    else:
+        get_tokenizer()  # Load the encoding outside the timed sections
+
+    try:
+        results = [
+            bench_preprocess_prompt(args.iterations),
+            bench_extract_text_from_pdf(args.iterations, args.pdf_pages),
+            *asyncio.run(run_online_cases(args)),
+        ]
+    finally:
+        shutdown_worker_pool()
+    results = {result.name: result.to_dict() for result in results}
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+    print_results(results, baseline)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_tokenizer": args.fake_tokenizer,
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
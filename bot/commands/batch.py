@@ -0,0 +1,328 @@
+import asyncio
+import io
+import json
+import zipfile
+from dataclasses import asdict, dataclass
+from pathlib import PurePosixPath
+
+from decouple import config
+from telegram import Bot, Message, Update
+from telegram.error import TelegramError
+from telegram.ext import CommandHandler, ContextTypes, ConversationHandler
+from telegram.ext import MessageHandler, filters
+
+from bot.commands.sumarize import (
+    PDF_BYTES_PER_TOKEN,
+    SUMMARY_MODE,
+    CostBudget,
+    cancel_command,
+    download_telegram_file,
+    shared_state,
+    summarize_url,
+    summary_generator,
+    summary_pdf_generator,
+    timeout_callback,
+)
+from bot.modules.model_router import get_model_router
+from bot.modules.summarizer import Summarizer
+from bot.utilities.access import restricted
+from bot.utilities.logging import get_logger
+from bot.utilities.metrics import measured
+from bot.utilities.progressive_message import ProgressiveMessage
+from bot.utilities.shared_state import SharedConversationHandler
+from bot.utilities.url_validator import is_valid_url
+from bot.utilities.web_fetcher import html_to_text
+from bot.utilities.worker_pool import WorkerError, get_worker_pool
+
+TIMEOUT_SECONDS = 600
+MAX_BATCH_DOCUMENTS = config("MAX_BATCH_DOCUMENTS", default=20, cast=int)
+# Uncompressed size of the documents read from a zip file
+MAX_ZIP_BYTES = config("MAX_ZIP_BYTES", default=50 * 2**20, cast=int)
+# Estimated cost in USD the summaries of a batch, digest included, can add up to
+BATCH_MAX_COST = config("BATCH_MAX_COST", default=2.0, cast=float)
+# Telegram downloads running at once for a batch
+DOWNLOAD_CONCURRENCY = 4
+TEXT_EXTENSIONS = (".txt", ".md")
+HTML_EXTENSIONS = (".html", ".htm")
+DOCUMENT_EXTENSIONS = (".pdf",) + TEXT_EXTENSIONS + HTML_EXTENSIONS
+
+COLLECTING = 0
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class BatchItem:
+    # "pdf" and "zip" items are Telegram file ids, "url" items URLs
+    kind: str
+    source: str
+    name: str
+    # file_unique_id of Telegram files, which identifies the same file
+    # forwarded by different users
+    unique_id: str = ""
+    # Bytes of Telegram files, the size of URLs is unknown until fetched
+    size: int = 0
+
+
+@dataclass
+class CollectedBatch:
+    items: list[BatchItem]
+    media_group_id: str | None = None
+
+
+def _get_batch_key(update: Update) -> str:
+    return f"batch:{update.effective_chat.id}:{update.effective_user.id}"
+
+
+def load_batch(update: Update) -> CollectedBatch:
+    value = shared_state.get(_get_batch_key(update))
+    if value is None:
+        return CollectedBatch(items=[])
+    batch = json.loads(value)
+    items = [BatchItem(**item) for item in batch["items"]]
+    return CollectedBatch(items, batch["media_group_id"])
+
+
+def save_batch(update: Update, batch: CollectedBatch) -> None:
+    # Kept in the shared state, so any replica can add to the batch or run it
+    shared_state.set(
+        _get_batch_key(update), json.dumps(asdict(batch)), ttl=2 * TIMEOUT_SECONDS
+    )
+
+
+def read_zip_documents(
+    zip_bytes: bytes, max_documents: int, max_bytes: int
+) -> list[tuple[str, bytes]]:
+    """Returns the name and content of the supported documents in a zip file.
+
+    Sizes are checked before anything is decompressed, so zip bombs are
+    refused without inflating them.
+    """
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as archive:
+        entries = [
+            entry
+            for entry in sorted(archive.infolist(), key=lambda entry: entry.filename)
+            if not entry.is_dir()
+            and not entry.filename.startswith("__MACOSX/")
+            and entry.filename.lower().endswith(DOCUMENT_EXTENSIONS)
+        ]
+        if len(entries) > max_documents:
+            raise ValueError(f"it has more than {max_documents} documents")
+        if sum(entry.file_size for entry in entries) > max_bytes:
+            raise ValueError(f"its documents are larger than {max_bytes} bytes")
+        return [
+            (PurePosixPath(entry.filename).name, archive.read(entry))
+            for entry in entries
+        ]
+
+
+def estimate_batch_cost(items: list[BatchItem]) -> float:
+    """Estimates the cost of summarizing the files of a batch from their sizes.
+
+    URLs are left out, their summaries are checked against the budget of the
+    batch once they have been fetched.
+    """
+    summarizer = Summarizer(router=get_model_router())
+    return sum(
+        summarizer.estimate_summary_from_tokens(
+            item.size // PDF_BYTES_PER_TOKEN, mode=SUMMARY_MODE
+        ).cost
+        for item in items
+        if item.size
+    )
+
+
+@restricted()
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Starts collecting documents and URLs to summarize in one job."""
+    logger.info(
+        f"User {update.effective_user.username} with id {update.effective_user.id} started a batch"
+    )
+    save_batch(update, CollectedBatch(items=[]))
+    await update.message.reply_text(
+        "Send me PDFs, an album of PDFs, zip files or URLs, one per line. "
+        "Then send /done to summarize each of them, or /digest to also get "
+        "a combined digest."
+    )
+    return COLLECTING
+
+
+async def add_to_batch(
+    update: Update, items: list[BatchItem], media_group_id: str | None = None
+) -> int:
+    batch = load_batch(update)
+    if len(batch.items) + len(items) > MAX_BATCH_DOCUMENTS:
+        await update.message.reply_text(
+            f"A batch can have at most {MAX_BATCH_DOCUMENTS} items, send /done "
+            f"to summarize the {len(batch.items)} already added."
+        )
+        return COLLECTING
+    # Albums arrive as one message per document, only the first is answered
+    first_in_group = media_group_id is None or media_group_id != batch.media_group_id
+    batch.items += items
+    batch.media_group_id = media_group_id
+    save_batch(update, batch)
+    if first_in_group:
+        await update.message.reply_text(
+            "Added to the batch, send more or /done to summarize it."
+        )
+    return COLLECTING
+
+
+async def batch_document_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    document = update.message.document
+    name = document.file_name or document.file_unique_id
+    kind = "pdf" if document.mime_type == "application/pdf" else "zip"
+    item = BatchItem(
+        kind=kind,
+        source=document.file_id,
+        name=name,
+        unique_id=document.file_unique_id,
+        size=document.file_size or 0,
+    )
+    return await add_to_batch(update, [item], update.message.media_group_id)
+
+
+async def batch_urls_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    lines = [line.strip() for line in update.message.text.splitlines()]
+    urls = [line for line in lines if line]
+    if not urls or not all(is_valid_url(url) for url in urls):
+        await update.message.reply_text("Please send URLs only, one per line.")
+        return COLLECTING
+    items = [BatchItem(kind="url", source=url, name=url) for url in urls]
+    return await add_to_batch(update, items)
+
+
+async def summarize_batch(
+    items: list[BatchItem],
+    message: Message,
+    bot: Bot,
+    user_id: str,
+    budget: CostBudget | None = None,
+) -> list[tuple[str, str | None]]:
+    """Summarizes every item, replying to message with a summary for each one.
+
+    Every item goes through its download, extraction and summary on its own,
+    so the stages of different documents overlap. Downloads are limited to
+    DOWNLOAD_CONCURRENCY, extraction by the worker pool and summaries by the
+    summary scheduler. Each summary takes its estimated cost from budget, and
+    those that do not fit in what is left are refused.
+    """
+    downloads = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    async def start_progress(name: str) -> ProgressiveMessage:
+        reply = await message.reply_text(f"{name}\nWaiting...")
+        return ProgressiveMessage(reply, prefix=f"{name}\n")
+
+    async def summarize_document(name: str, data: bytes) -> tuple[str, str | None]:
+        progress = await start_progress(name)
+        try:
+            if name.lower().endswith(".pdf"):
+                return name, await summary_pdf_generator(
+                    data, progress, user_id, budget
+                )
+            text = data.decode(errors="replace")
+            if name.lower().endswith(HTML_EXTENSIONS):
+                text = await get_worker_pool().run(html_to_text, text)
+            return name, await summary_generator(text, progress, user_id, budget=budget)
+        except Exception:
+            # A failed document must not take the rest of the batch down
+            logger.exception(f"Error summarizing batch document {name}")
+            await progress.finish("Could not summarize this document.")
+            return name, None
+
+    async def summarize_item(item: BatchItem) -> list[tuple[str, str | None]]:
+        if item.kind == "url":
+            progress = await start_progress(item.name)
+            try:
+                summary = await summarize_url(item.source, progress, user_id, budget)
+            except Exception:
+                logger.exception(f"Error summarizing batch URL {item.name}")
+                await progress.finish("Could not summarize this URL.")
+                return [(item.name, None)]
+            return [(item.name, summary)]
+        try:
+            async with downloads:
+                data = await download_telegram_file(
+                    bot, item.source, item.unique_id or item.source
+                )
+            if item.kind == "zip":
+                documents = await get_worker_pool().run(
+                    read_zip_documents, data, MAX_BATCH_DOCUMENTS, MAX_ZIP_BYTES
+                )
+            else:
+                documents = [(item.name, data)]
+        except (TelegramError, WorkerError, zipfile.BadZipFile, ValueError) as e:
+            logger.info(f"Error reading batch item {item.name}: {e}")
+            await message.reply_text(f"Could not read {item.name}: {e}")
+            return [(item.name, None)]
+        return await asyncio.gather(
+            *[summarize_document(name, data) for name, data in documents]
+        )
+
+    results = await asyncio.gather(*[summarize_item(item) for item in items])
+    return [summary for item_summaries in results for summary in item_summaries]
+
+
+@measured("batch")
+async def batch_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Summarizes the collected batch, adding a digest if asked with /digest."""
+    batch = load_batch(update)
+    shared_state.delete(_get_batch_key(update))
+    if not batch.items:
+        await update.message.reply_text("The batch is empty, nothing to summarize.")
+        return ConversationHandler.END
+
+    cost = estimate_batch_cost(batch.items)
+    logger.info(f"Batch of {len(batch.items)} items estimated at ${cost:.2f}")
+    if cost > BATCH_MAX_COST:
+        await update.message.reply_text(
+            f"This batch is too large to summarize, it would cost about "
+            f"${cost:.2f}, over the ${BATCH_MAX_COST:.2f} limit."
+        )
+        return ConversationHandler.END
+
+    user_id = str(update.effective_user.id)
+    budget = CostBudget(BATCH_MAX_COST)
+    await update.message.reply_text(f"Summarizing {len(batch.items)} items...")
+    summaries = await summarize_batch(
+        batch.items, update.message, context.bot, user_id, budget
+    )
+
+    summaries = [(name, summary) for name, summary in summaries if summary]
+    if update.message.text.startswith("/digest") and len(summaries) > 1:
+        message = await update.message.reply_text("Digest\nWriting digest...")
+        progress = ProgressiveMessage(message, prefix="Digest\n")
+        digest_text = "\n\n".join(f"{name}:\n{summary}" for name, summary in summaries)
+        try:
+            await summary_generator(digest_text, progress, user_id, budget=budget)
+        except Exception:
+            logger.exception("Error writing the digest of a batch")
+            await progress.finish("Could not write the digest.")
+    return ConversationHandler.END
+
+
+batch_conversation_handler = SharedConversationHandler(
+    entry_points=[CommandHandler("batch", batch_command)],
+    states={
+        COLLECTING: [
+            MessageHandler(
+                filters.Document.PDF
+                | filters.Document.ZIP
+                | filters.Document.FileExtension("zip"),
+                batch_document_handler,
+            ),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, batch_urls_handler),
+            CommandHandler(["done", "digest"], batch_done_command),
+        ],
+        ConversationHandler.TIMEOUT: [
+            MessageHandler(filters.TEXT | filters.COMMAND, timeout_callback)
+        ],
+    },
+    fallbacks=[CommandHandler("cancel", cancel_command)],
+    conversation_timeout=TIMEOUT_SECONDS,
+    name="batch_conversation_handler",
+    state=shared_state,
+)
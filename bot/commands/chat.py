@@ -0,0 +1,114 @@
+from decouple import config
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes, ConversationHandler
+from telegram.ext import MessageHandler, filters
+
+from bot.commands.sumarize import cancel_command, shared_state
+from bot.modules.conversation_store import (
+    ConversationStore,
+    MemoryConversationStore,
+    SqliteConversationStore,
+)
+from bot.modules.model_router import get_model_router
+from bot.modules.rolling_summary import RollingSummaryConversation
+from bot.utilities.access import restricted
+from bot.utilities.logging import get_logger
+from bot.utilities.metrics import measured
+from bot.utilities.progressive_message import ProgressiveMessage
+from bot.utilities.shared_state import SharedConversationHandler
+
+TIMEOUT_SECONDS = 3600
+# Histories are kept in memory unless a sqlite file is given
+CHAT_HISTORY_PATH = config("CHAT_HISTORY_PATH", default=None)
+# Tokens of history past which the oldest turns are summarized, and tokens of
+# the newest turns kept as they are
+CHAT_SUMMARY_THRESHOLD = config("CHAT_SUMMARY_THRESHOLD", default=2000, cast=int)
+CHAT_RECENT_TOKENS = config("CHAT_RECENT_TOKENS", default=1000, cast=int)
+SYSTEM_PROMPT = "You are a helpful assistant chatting with a user on Telegram."
+
+CHATTING = 0
+
+logger = get_logger(__name__)
+
+
+def get_chat_store() -> ConversationStore:
+    if CHAT_HISTORY_PATH:
+        return SqliteConversationStore(CHAT_HISTORY_PATH)
+    return MemoryConversationStore()
+
+
+chat_store = get_chat_store()
+
+
+def get_conversation(update: Update) -> RollingSummaryConversation:
+    return RollingSummaryConversation(
+        system_prompt=SYSTEM_PROMPT,
+        store=chat_store,
+        chat_id=f"{update.effective_chat.id}:{update.effective_user.id}",
+        summary_threshold=CHAT_SUMMARY_THRESHOLD,
+        recent_tokens=CHAT_RECENT_TOKENS,
+        router=get_model_router(),
+    )
+
+
+@restricted()
+async def chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Starts or resumes a chat, which remembers the earlier messages."""
+    logger.info(
+        f"User {update.effective_user.username} with id {update.effective_user.id} started a chat"
+    )
+    await update.message.reply_text(
+        "Chat mode, send me your messages. Send /reset to forget the "
+        "conversation or /cancel to leave the chat mode."
+    )
+    return CHATTING
+
+
+@measured("chat")
+async def chat_message_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    message = await update.message.reply_text("...")
+    progress = ProgressiveMessage(message)
+    try:
+        stream = await get_conversation(update).astream_completion(update.message.text)
+        async for _ in stream:
+            await progress.update(stream.content)
+    except Exception:
+        logger.exception("Error answering a chat message")
+        await progress.finish("Could not answer, please try again.")
+        return CHATTING
+    await progress.finish(stream.content)
+    return CHATTING
+
+
+async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Forgets the messages and the summary of the chat."""
+    get_conversation(update).clear_history()
+    await update.message.reply_text("Conversation forgotten, let's start over.")
+    return CHATTING
+
+
+async def chat_timeout_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    await update.message.reply_text("Chat mode timed out, send /chat to go on.")
+    return ConversationHandler.END
+
+
+chat_conversation_handler = SharedConversationHandler(
+    entry_points=[CommandHandler("chat", chat_command)],
+    states={
+        CHATTING: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, chat_message_handler),
+            CommandHandler("reset", reset_command),
+        ],
+        ConversationHandler.TIMEOUT: [
+            MessageHandler(filters.TEXT | filters.COMMAND, chat_timeout_callback)
+        ],
+    },
+    fallbacks=[CommandHandler("cancel", cancel_command)],
+    conversation_timeout=TIMEOUT_SECONDS,
+    name="chat_conversation_handler",
+    state=shared_state,
+)
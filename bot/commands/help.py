@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pathlib import Path
 
 from telegram import Update
@@ -10,8 +11,13 @@ logger = get_logger(__name__)
 # Load the help text from bot/assets/help_text.md
 
 HELP_TEXT_FILENAME = Path("bot/config/help_text.md")
-with open(HELP_TEXT_FILENAME, "r") as f:
-    help_text = f.read()
+
+
+@lru_cache(maxsize=None)
+def get_help_text() -> str:
+    """Reads the help text the first time it is asked for."""
+    with open(HELP_TEXT_FILENAME, "r") as f:
+        return f.read()
 
 
 async def help_commnad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -19,7 +25,7 @@ async def help_commnad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     logger.info(
         f"User {update.effective_user.username} with id {update.effective_user.id} requested help"
     )
-    await update.message.reply_markdown(help_text)
+    await update.message.reply_markdown(get_help_text())
 
 
 help_commnad_handler = CommandHandler("help", help_commnad)
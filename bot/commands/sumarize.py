@@ -1,23 +1,86 @@
-from telegram import Update
+from typing import AsyncIterator, Optional
+
+from telegram import Bot, Document, Update
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters
-from bot.utilities.access import restricted, AccessManager
+from bot.utilities.access import restricted
+from bot.utilities.lazy import lazy_import
 
-from bot.utilities.logging import get_logger
+from bot.utilities.logging import get_logger, span
+from bot.utilities.metrics import measured
 from bot.utilities.url_validator import is_valid_url
-from bot.utilities.pdf_reader import extract_text_from_pdf
-from bot.modules.summarizer import Summarizer
-import asyncio
+from bot.utilities.pdf_reader import aiter_pdf_pages
+from bot.utilities.progressive_message import ProgressiveMessage
+from bot.utilities.shared_state import (
+    SharedConversationHandler,
+    SharedTasks,
+    get_shared_state,
+)
+from bot.utilities.summary_cache import SummaryCache
+from bot.utilities.single_flight import SingleFlight
+from bot.utilities.web_fetcher import (
+    FetchError,
+    FetchedContent,
+    aextract_text,
+    fetch_url,
+)
+from bot.utilities.worker_pool import WorkerError, WorkerPoolFullError
+from bot.modules.model_router import get_model_router
+from bot.modules.scheduler import SummaryScheduler
+from bot.modules.summarizer import Summarizer, SummaryMode, TextSource
+import hashlib
+from decouple import config
 
 TIMEOUT_SECONDS = 120
+SUMMARY_TEMPERATURE = 0.2
+# Long texts are summarized in concurrent chunks by default, "recursive" to
+# summarize them one part at a time as before
+SUMMARY_MODE = SummaryMode(config("SUMMARY_MODE", default="map_reduce"))
+
+SUMMARY_CACHE_PATH = config("SUMMARY_CACHE_PATH", default=None)
+SUMMARY_CACHE_TTL_SECONDS = config(
+    "SUMMARY_CACHE_TTL_SECONDS", default=7 * 24 * 3600, cast=int
+)
+SUMMARY_CACHE_MAX_ENTRIES = config("SUMMARY_CACHE_MAX_ENTRIES", default=256, cast=int)
+
+MAX_CONCURRENT_SUMMARIES = config("MAX_CONCURRENT_SUMMARIES", default=4, cast=int)
+OPENAI_TOKENS_PER_MINUTE = config("OPENAI_TOKENS_PER_MINUTE", default=90000, cast=int)
+OPENAI_REQUESTS_PER_MINUTE = config(
+    "OPENAI_REQUESTS_PER_MINUTE", default=3500, cast=int
+)
+# Rough size of the text in a PDF, used before its pages have been extracted
+PDF_BYTES_PER_TOKEN = 20
+# Estimated cost in USD above which summaries are announced or refused
+SUMMARY_WARN_COST = config("SUMMARY_WARN_COST", default=0.1, cast=float)
+SUMMARY_MAX_COST = config("SUMMARY_MAX_COST", default=1.0, cast=float)
 
 TEXT_TO_SUMMARIZE = 0
 
 logger = get_logger(__name__)
-access_manager = AccessManager.from_toml()
+PyPDF2 = lazy_import("PyPDF2")
+summary_cache = SummaryCache(
+    max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+    ttl_seconds=SUMMARY_CACHE_TTL_SECONDS,
+    db_path=SUMMARY_CACHE_PATH or None,
+)
+# Completed parts of a summary, so sending the same content after a failure
+# resumes it instead of starting over
+completion_checkpoints = SummaryCache(max_entries=2048, ttl_seconds=3600)
+# Conversations and running summaries, shared with the other replicas
+shared_state = get_shared_state()
+shared_summaries = SharedTasks(shared_state)
+# Concurrent requests for the same Telegram file or URL share its download
+file_downloads = SingleFlight()
+url_downloads = SingleFlight()
+summary_scheduler = SummaryScheduler(
+    max_concurrent_jobs=MAX_CONCURRENT_SUMMARIES,
+    tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+    requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+)
 
 
-@restricted(access_manager)
+@restricted()
 async def sumarize_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Takes in a text, URL, or file and returns a summary of the text."""
     logger.info(
@@ -48,13 +111,260 @@ async def timeout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return ConversationHandler.END
 
 
-async def summary_generator(text: str) -> str:
-    """Generates a summary of the text"""
-    summarizer = Summarizer()
-    summary = summarizer.generate_summary(text, temperature=0.2)
+class CostBudget:
+    """USD that a group of summaries can spend between them."""
+
+    def __init__(self, max_cost: float) -> None:
+        self.remaining = max_cost
+
+    def reserve(self, cost: float) -> bool:
+        """Takes cost from the budget, False if not enough is left."""
+        if cost > self.remaining:
+            return False
+        self.remaining -= cost
+        return True
+
+
+async def summary_generator(
+    text: TextSource,
+    progress: ProgressiveMessage,
+    user_id: str,
+    content_id: str | None = None,
+    estimated_tokens: int | None = None,
+    budget: CostBudget | None = None,
+) -> str | None:
+    """Generates a summary of the text, streaming it into the progress message.
+
+    Texts given as an iterator of pages need a content_id to be cached and an
+    estimated_tokens count to be estimated. Returns None if the summary would
+    cost more than SUMMARY_MAX_COST or than what is left of the budget.
+    """
+    summarizer = Summarizer(
+        checkpoints=completion_checkpoints, router=get_model_router()
+    )
+    cache_key = summarizer.get_cache_key(
+        content_id or text, temperature=SUMMARY_TEMPERATURE, mode=SUMMARY_MODE
+    )
+    if (summary := summary_cache.get(cache_key)) is not None:
+        logger.info(f"Summary cache hit, hit rate {summary_cache.stats.hit_rate:.0%}")
+        await progress.finish(summary)
+        return summary
+
+    async def generate() -> str:
+        summary = ""
+        async for summary in summarizer.astream_summary(
+            text, temperature=SUMMARY_TEMPERATURE, mode=SUMMARY_MODE
+        ):
+            await progress.update(summary)
+        return summary
+
+    async def show_position(position: int) -> None:
+        await progress.show(f"Waiting for other summaries, position {position}...")
+
+    if estimated_tokens is None:
+        estimate = summarizer.estimate_summary(text, mode=SUMMARY_MODE)
+    else:
+        estimate = summarizer.estimate_summary_from_tokens(
+            estimated_tokens, mode=SUMMARY_MODE
+        )
+    logger.info(f"Summary estimate: {estimate}")
+    if estimate.cost > SUMMARY_MAX_COST:
+        await progress.finish(
+            f"This content is too large to summarize, it would take about "
+            f"{estimate.api_calls} requests and cost ${estimate.cost:.2f}, "
+            f"over the ${SUMMARY_MAX_COST:.2f} limit."
+        )
+        return None
+    if budget is not None and not budget.reserve(estimate.cost):
+        await progress.finish(
+            f"Not summarized, it would cost ${estimate.cost:.2f}, over the "
+            f"${budget.remaining:.2f} left of the budget."
+        )
+        return None
+    if estimate.cost > SUMMARY_WARN_COST:
+        await progress.show(
+            f"This is a large summary, it will take about {estimate.api_calls} "
+            f"requests, ${estimate.cost:.2f} and {estimate.seconds / 60:.0f} minutes..."
+        )
+
+    async def schedule() -> str:
+        return await summary_scheduler.submit(
+            user_id,
+            generate,
+            tokens=estimate.prompt_tokens + estimate.completion_tokens,
+            requests=estimate.api_calls,
+            on_position=show_position,
+        )
+
+    async def show_waiting() -> None:
+        await progress.show("Already summarizing this content, waiting for it...")
+
+    # Identical requests, in this or other replicas, wait for a single summary
+    summary = await shared_summaries.run(cache_key, schedule, on_wait=show_waiting)
+    await progress.finish(summary)
+    summary_cache.set(cache_key, summary)
     return summary
 
 
+class DownloadError(Exception):
+    """A Telegram file could not be downloaded while it was being summarized."""
+
+
+def get_pdf_content_id(pdf_bytes: bytes) -> str:
+    return "pdf:" + hashlib.sha256(pdf_bytes).hexdigest()
+
+
+async def download_telegram_file(bot: Bot, file_id: str, file_unique_id: str) -> bytes:
+    """Downloads a file, once for all the concurrent requests of the same file.
+
+    file_unique_id is the same for a file forwarded by different users.
+    """
+
+    async def download() -> bytes:
+        with span("download", file=file_unique_id) as fields:
+            file = await bot.get_file(file_id)
+            content = bytes(await file.download_as_bytearray())
+            fields["bytes"] = len(content)
+        return content
+
+    return await file_downloads.run(file_unique_id, download)
+
+
+async def summary_pdf_generator(
+    pdf_bytes: bytes,
+    progress: ProgressiveMessage,
+    user_id: str,
+    budget: CostBudget | None = None,
+) -> str | None:
+    """Generates a summary of a PDF while its pages are still being extracted"""
+    return await summarize_pdf_pages(
+        aiter_pdf_pages(pdf_bytes),
+        get_pdf_content_id(pdf_bytes),
+        len(pdf_bytes),
+        progress,
+        user_id,
+        budget,
+    )
+
+
+async def summary_document_generator(
+    bot: Bot, document: Document, progress: ProgressiveMessage, user_id: str
+) -> str | None:
+    """Generates a summary of a PDF sent to Telegram, downloading it if needed.
+
+    The content of every file_unique_id is remembered, so a file that was
+    summarized or is being summarized is not downloaded again.
+    """
+    file_key = f"file:{document.file_unique_id}"
+
+    async def download() -> bytes:
+        return await download_telegram_file(
+            bot, document.file_id, document.file_unique_id
+        )
+
+    async def download_pages() -> AsyncIterator[str]:
+        try:
+            pdf_bytes = await download()
+        except TelegramError as e:
+            # Other Telegram errors of the summary are not download errors
+            raise DownloadError(str(e)) from e
+        async for page in aiter_pdf_pages(pdf_bytes):
+            yield page
+
+    if (content_id := shared_state.get(file_key)) is not None:
+        # Only read if the summary is neither cached nor running
+        pages, pdf_size = download_pages(), document.file_size or 0
+    else:
+        try:
+            pdf_bytes = await download()
+        except TelegramError as e:
+            logger.info(f"Error downloading PDF: {e}")
+            await progress.finish("Error downloading PDF, it might be too large!")
+            return None
+        content_id = get_pdf_content_id(pdf_bytes)
+        shared_state.set(file_key, content_id, ttl=SUMMARY_CACHE_TTL_SECONDS)
+        pages, pdf_size = aiter_pdf_pages(pdf_bytes), len(pdf_bytes)
+    return await summarize_pdf_pages(pages, content_id, pdf_size, progress, user_id)
+
+
+async def summarize_pdf_pages(
+    pages: AsyncIterator[str],
+    content_id: str,
+    pdf_size: int,
+    progress: ProgressiveMessage,
+    user_id: str,
+    budget: CostBudget | None = None,
+) -> str | None:
+    try:
+        return await summary_generator(
+            pages,
+            progress,
+            user_id,
+            content_id,
+            estimated_tokens=pdf_size // PDF_BYTES_PER_TOKEN,
+            budget=budget,
+        )
+    except DownloadError as e:
+        logger.info(f"Error downloading PDF: {e}")
+        await progress.finish("Error downloading PDF, it might be too large!")
+    except PyPDF2.errors.PdfReadError:
+        logger.info(f"Error reading text from PDF")
+        await progress.finish("Error reading PDF, it might be damaged!")
+    except WorkerPoolFullError:
+        logger.warning("Worker pool full, refusing a PDF")
+        await progress.finish(
+            "Too many documents are being processed, try again later."
+        )
+    except WorkerError as e:
+        logger.warning(f"Error processing PDF: {e}")
+        await progress.finish("Error reading PDF, it might be too large or damaged!")
+    return None
+
+
+async def fetch_url_text(url: str) -> tuple[FetchedContent, Optional[str]]:
+    """Downloads a URL and extracts its text, unless it is a PDF."""
+    with span("download", url=url) as fields:
+        content = await fetch_url(url)
+        fields["bytes"] = len(content.body)
+    if content.is_pdf:
+        return content, None
+    with span("extract", url=url):
+        return content, await aextract_text(content)
+
+
+async def summarize_url(
+    url: str,
+    progress: ProgressiveMessage,
+    user_id: str,
+    budget: CostBudget | None = None,
+) -> str | None:
+    """Downloads a URL and summarizes it as a PDF or as a web page"""
+    logger.info(f"Downloading text from {url}")
+    try:
+        content, text = await url_downloads.run(url, lambda: fetch_url_text(url))
+        if content.is_pdf:
+            await progress.show("Generating summary of PDF...")
+            return await summary_pdf_generator(content.body, progress, user_id, budget)
+    except (FetchError, WorkerError) as e:
+        logger.info(f"Error getting text from {url}: {e}")
+        await progress.finish(f"Error getting text from {url}: {e}")
+        return None
+
+    await progress.show("Generating summary...")
+    return await summary_generator(text, progress, user_id, budget=budget)
+
+
+async def summary_url_generator(update: Update, url: str) -> None:
+    message = await update.message.reply_text(f"Downloading text from {url}...")
+    progress = ProgressiveMessage(message)
+    try:
+        await summarize_url(url, progress, str(update.effective_user.id))
+    except Exception:
+        logger.exception(f"Error summarizing {url}")
+        await progress.finish("Could not summarize this URL, please try again.")
+
+
+@measured("summarize")
 async def summary_text_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -63,49 +373,41 @@ async def summary_text_handler(
 
     # If the user sends a URL, download the text from the URL
     if is_valid_url(text_from_user):
-        url = text_from_user
-        logger.info(f"Downloading text from {url}")
-        # Send reply saying we're downloading the text
-        await update.message.reply_text(f"Downloading text from {text_from_user}...")
-        # After a few seconds, reply that this is not implemented yet
-        await asyncio.sleep(2)
-        await update.message.reply_text("This is not implemented yet, sorry!")
+        await summary_url_generator(update, text_from_user)
         return ConversationHandler.END
 
-    summary_promise = summary_generator(text_from_user)
-    await update.message.reply_text(f"Generating summary...")
-    summary = await summary_promise
-    await update.message.reply_text(summary)
+    message = await update.message.reply_text(f"Generating summary...")
+    progress = ProgressiveMessage(message)
+    try:
+        await summary_generator(text_from_user, progress, str(update.effective_user.id))
+    except Exception:
+        logger.exception("Error summarizing a text")
+        await progress.finish("Could not summarize this text, please try again.")
     return ConversationHandler.END
 
 
+@measured("summarize")
 async def summary_pdf_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
-    """Handles text responses"""
+    """Handles PDF responses"""
+    logger.info(f"Generating summary of PDF")
+    message = await update.message.reply_text(f"Generating summary...")
+    progress = ProgressiveMessage(message)
     try:
-        document = update.message.document
-        logger.info(f"Getting text from PDF")
-        await update.message.reply_text(f"Downloading PDF...")
-        file = await document.get_file()
-        file_path = await file.download_to_drive("temp.pdf")
-        text_from_file = extract_text_from_pdf(file_path)
-        # delete file
-        file_path.unlink()
-    except:
-        logger.info(f"Error getting text from PDF")
-        await update.message.reply_text("Error downloading PDF, it might be too large!")
-        return ConversationHandler.END
-
-    summary_promise = summary_generator(text_from_file)
-    await update.message.reply_text(f"Generating summary...")
-    logger.info(f"Generating summary")
-    summary = await summary_promise
-    await update.message.reply_text(summary)
+        await summary_document_generator(
+            context.bot,
+            update.message.document,
+            progress,
+            str(update.effective_user.id),
+        )
+    except Exception:
+        logger.exception("Error summarizing a PDF")
+        await progress.finish("Could not summarize this PDF, please try again.")
     return ConversationHandler.END
 
 
-summarize_conversation_handler = ConversationHandler(
+summarize_conversation_handler = SharedConversationHandler(
     entry_points=[CommandHandler("summarize", sumarize_command)],
     states={
         TEXT_TO_SUMMARIZE: [
@@ -119,4 +421,5 @@ summarize_conversation_handler = ConversationHandler(
     fallbacks=[CommandHandler("cancel", cancel_command)],
     conversation_timeout=TIMEOUT_SECONDS,
     name="summarize_conversation_handler",
+    state=shared_state,
 )
@@ -0,0 +1,50 @@
+from telegram import Update
+from telegram.ext import CommandHandler, ContextTypes
+
+from bot.utilities.access import restricted
+from bot.utilities.logging import get_logger
+from bot.utilities.metrics import Histogram, UsageTotals, metrics
+from bot.utilities.progressive_message import split_message
+
+logger = get_logger(__name__)
+
+USAGE_GROUPS = {"user": 0, "model": 1, "command": 2}
+
+
+def format_usage(title: str, usage: dict[str, UsageTotals]) -> list[str]:
+    lines = [f"By {title}:"]
+    for name, totals in sorted(usage.items(), key=lambda item: -item[1].cost):
+        lines.append(
+            f"{name}: {totals.requests} requests, {totals.prompt_tokens} prompt + "
+            f"{totals.completion_tokens} completion tokens, ${totals.cost:.4f}"
+        )
+    return lines
+
+
+def format_latency(title: str, histograms: dict[str, Histogram]) -> list[str]:
+    lines = [f"{title} latency:"]
+    for name, histogram in sorted(histograms.items()):
+        p50, p95 = histogram.get_quantile(0.5), histogram.get_quantile(0.95)
+        lines.append(f"{name}: p50 <= {p50}s, p95 <= {p95}s ({histogram.count} calls)")
+    return lines
+
+
+def get_usage_report() -> str:
+    lines = []
+    for title, group_by in USAGE_GROUPS.items():
+        lines += format_usage(title, metrics.get_usage(group_by)) + [""]
+    lines += format_latency("API", metrics.get_api_latency()) + [""]
+    lines += format_latency("Handler", metrics.get_handler_latency())
+    return "\n".join(lines)
+
+
+@restricted(only_admin=True)
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sends the token usage, costs and latencies since the bot started."""
+    logger.info(f"User {update.effective_user.username} requested the usage report")
+    # A row per user, model and command can outgrow a single message
+    for part in split_message(get_usage_report()):
+        await update.message.reply_text(part)
+
+
+usage_command_handler = CommandHandler("usage", usage_command)
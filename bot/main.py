@@ -1,33 +1,111 @@
+import asyncio
+import importlib
+import time
+
+from decouple import config
 from telegram import Bot
 from telegram.ext import Application
 
-from bot.commands.help import help_commnad_handler
-from bot.commands.sumarize import summarize_conversation_handler
+from bot.modules.openai_conversation import get_tokenizer
+from bot.utilities.http_session import close_http_session
+from bot.utilities.lazy import import_object
 from bot.utilities.logging import get_logger
+from bot.utilities.metrics import start_metrics_server
 from bot.utilities.token import get_bot_token
-from bot.utilities.access import AccessManager
+from bot.utilities.webhook import get_bot_mode, get_webhook_config, serve_webhook
+from bot.utilities.worker_pool import shutdown_worker_pool
+from bot.utilities.access import get_access_manager
+
 
+METRICS_HOST = config("METRICS_HOST", default="127.0.0.1")
+# The metrics endpoint is disabled when the port is 0
+METRICS_PORT = config("METRICS_PORT", default=9090, cast=int)
+# Import the heavy modules and load the tokenizer in the background once the
+# bot has started, instead of on the first request
+PREWARM = config("PREWARM", default=True, cast=bool)
+PREWARM_MODULES = ("openai", "tiktoken", "PyPDF2", "bs4", "aiohttp.web")
+
+# Handlers of the app, as "module:attribute". The command modules are imported
+# when the app is built, so importing this module does not pay for them
+HANDLERS = (
+    "bot.commands.help:help_commnad_handler",
+    "bot.commands.sumarize:summarize_conversation_handler",
+    "bot.commands.batch:batch_conversation_handler",
+    "bot.commands.chat:chat_conversation_handler",
+    "bot.commands.usage:usage_command_handler",
+)
 
 logger = get_logger(__name__)
 
 
+def prewarm() -> None:
+    """Imports the heavy modules and loads the tokenizer ahead of the first request."""
+    start = time.perf_counter()
+    try:
+        for name in PREWARM_MODULES:
+            importlib.import_module(name)
+        get_tokenizer()
+    except Exception as e:
+        # They are loaded again when needed, so this only costs a slower request
+        logger.warning(f"Error prewarming: {e}")
+        return
+    logger.info(f"Prewarmed in {time.perf_counter() - start:.2f}s")
+
+
+async def post_init(app: Application) -> None:
+    if PREWARM:
+        app.bot_data["prewarm"] = asyncio.get_running_loop().run_in_executor(
+            None, prewarm
+        )
+    if METRICS_PORT:
+        app.bot_data["metrics_runner"] = await start_metrics_server(
+            METRICS_HOST, METRICS_PORT
+        )
+
+
+async def post_shutdown(app: Application) -> None:
+    if (metrics_runner := app.bot_data.get("metrics_runner")) is not None:
+        await metrics_runner.cleanup()
+    get_access_manager().flush()
+    await close_http_session()
+    shutdown_worker_pool()
+
+
+def build_application(bot_token: str) -> Application:
+    """Creates the app with the handlers in HANDLERS, ready to be started."""
+    bot = Bot(token=bot_token)
+    app = (
+        Application.builder()
+        .bot(bot)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    for handler in HANDLERS:
+        app.add_handler(import_object(handler))
+    return app
+
+
 def main():
     bot_token = get_bot_token()
     logger.info("Bot token loaded")
 
-    access_manager = AccessManager.from_toml()
-
-    # Create the bot and pass it to the app
-    bot = Bot(token=bot_token)
-    app = Application.builder().bot(bot).concurrent_updates(True).build()
+    access_manager = get_access_manager()
+    logger.info(
+        f"Access lists loaded, {len(access_manager.admins)} admins and "
+        f"{len(access_manager.whitelist)} whitelisted users"
+    )
 
-    # Add handlers to the app
-    app.add_handler(help_commnad_handler)
-    app.add_handler(summarize_conversation_handler)
+    app = build_application(bot_token)
 
     # Start the bot
     logger.info("Bot started, press Ctrl+C to stop it")
-    app.run_polling()
+    if get_bot_mode() == "webhook":
+        asyncio.run(serve_webhook(app, get_webhook_config()))
+    else:
+        app.run_polling()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,305 @@
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable, Iterable, Optional, Protocol, Sequence
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_IDLE_SECONDS = 24 * 3600
+
+
+class Tokenizer(Protocol):
+    def encode(self, text: str) -> list:
+        ...
+
+
+class Role(Enum):
+    SYSTEM: str = "system"
+    USER: str = "user"
+    ASSISTANT: str = "assistant"
+
+
+@dataclass(slots=True)
+class Message:
+    role: Role
+    content: str
+    _token_length: Optional[int] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def to_dict(self) -> dict[str, str]:
+        return {"role": self.role.value, "content": self.content}
+
+    def get_token_length(self, tokenizer: Tokenizer) -> int:
+        """Returns the number of tokens in the content, encoding it only once."""
+        if self._token_length is None:
+            self._token_length = len(tokenizer.encode(self.content))
+        return self._token_length
+
+
+class HistoryView(Sequence[Message]):
+    """Read-only view of the first messages of a chat history.
+
+    Histories only grow by appending, so a view keeps showing the messages it
+    was created with while the chat goes on, without copying them.
+    """
+
+    __slots__ = ("_messages", "_length")
+
+    def __init__(self, messages: list[Message], length: Optional[int] = None):
+        self._messages = messages
+        self._length = len(messages) if length is None else length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._messages[: self._length][index]
+        if not -self._length <= index < self._length:
+            raise IndexError("history index out of range")
+        return self._messages[index % self._length]
+
+    def __repr__(self) -> str:
+        return f"HistoryView({list(self)!r})"
+
+
+class ConversationStore(ABC):
+    """Chat histories of many conversations, keyed by chat id."""
+
+    @abstractmethod
+    def get_history(self, chat_id: str) -> HistoryView:
+        pass
+
+    @abstractmethod
+    def append(self, chat_id: str, messages: Iterable[Message]) -> None:
+        pass
+
+    @abstractmethod
+    def replace_oldest(
+        self, chat_id: str, count: int, messages: Iterable[Message]
+    ) -> None:
+        """Replaces the oldest count messages of a history with messages."""
+
+    @abstractmethod
+    def clear(self, chat_id: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryConversationStore(ConversationStore):
+    """Keeps the histories in memory, evicting chats that are idle or too many.
+
+    Chats idle for idle_seconds are dropped, as are the least recently used
+    ones past max_chats. Histories keep their last max_messages messages.
+    """
+
+    def __init__(
+        self,
+        max_chats: int = 1000,
+        max_messages: int = 100,
+        idle_seconds: Optional[float] = DEFAULT_IDLE_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._max_chats = max_chats
+        self._max_messages = max_messages
+        self._idle_seconds = idle_seconds
+        self._clock = clock
+        # Chat id to (last access time, messages), oldest access first
+        self._chats: OrderedDict[str, tuple[float, list[Message]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: str) -> bool:
+        return chat_id in self._chats
+
+    def _evict(self) -> None:
+        now = self._clock()
+        while self._chats:
+            chat_id, (accessed_at, _) = next(iter(self._chats.items()))
+            idle = self._idle_seconds is not None and (
+                now - accessed_at > self._idle_seconds
+            )
+            if not idle and len(self._chats) <= self._max_chats:
+                break
+            del self._chats[chat_id]
+
+    def _touch(self, chat_id: str) -> Optional[list[Message]]:
+        entry = self._chats.pop(chat_id, None)
+        if entry is None:
+            return None
+        self._chats[chat_id] = (self._clock(), entry[1])
+        return entry[1]
+
+    def _load(self, chat_id: str) -> list[Message]:
+        return []
+
+    def _get_messages(self, chat_id: str) -> list[Message]:
+        messages = self._touch(chat_id)
+        if messages is None:
+            messages = self._load(chat_id)
+            self._chats[chat_id] = (self._clock(), messages)
+            self._evict()
+        return messages
+
+    def get_history(self, chat_id: str) -> HistoryView:
+        return HistoryView(self._get_messages(chat_id))
+
+    def append(self, chat_id: str, messages: Iterable[Message]) -> None:
+        history = self._get_messages(chat_id)
+        history.extend(messages)
+        if len(history) > self._max_messages:
+            # Views keep the old list, so the trimmed history is a new one
+            history = history[-self._max_messages :]
+            self._chats[chat_id] = (self._clock(), history)
+
+    def replace_oldest(
+        self, chat_id: str, count: int, messages: Iterable[Message]
+    ) -> None:
+        history = self._get_messages(chat_id)
+        self._chats[chat_id] = (self._clock(), list(messages) + history[count:])
+
+    def clear(self, chat_id: str) -> None:
+        self._chats.pop(chat_id, None)
+
+
+class SqliteConversationStore(MemoryConversationStore):
+    """Memory store backed by a sqlite file, so histories survive restarts.
+
+    Recently used chats are kept in memory and every appended message is
+    written to disk with its token count. Chats evicted from memory are
+    loaded again from disk. Chats idle for disk_idle_seconds are deleted from
+    disk when the store is opened.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_chats: int = 1000,
+        max_messages: int = 100,
+        idle_seconds: Optional[float] = 3600,
+        disk_idle_seconds: float = 30 * DEFAULT_IDLE_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__(max_chats, max_messages, idle_seconds, clock)
+        self._disk_idle_seconds = disk_idle_seconds
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "chat_id TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, "
+            "content TEXT NOT NULL, token_length INTEGER, "
+            "PRIMARY KEY (chat_id, position));"
+            "CREATE TABLE IF NOT EXISTS chats ("
+            "chat_id TEXT PRIMARY KEY, accessed_at REAL NOT NULL);"
+        )
+        self._delete_idle_chats()
+
+    def _delete_idle_chats(self) -> None:
+        threshold = self._clock() - self._disk_idle_seconds
+        with self._db:
+            idle = "SELECT chat_id FROM chats WHERE accessed_at < ?"
+            self._db.execute(
+                f"DELETE FROM messages WHERE chat_id IN ({idle})", (threshold,)
+            )
+            deleted = self._db.execute(
+                "DELETE FROM chats WHERE accessed_at < ?", (threshold,)
+            ).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} idle conversations")
+
+    def _load(self, chat_id: str) -> list[Message]:
+        rows = self._db.execute(
+            "SELECT role, content, token_length FROM messages WHERE chat_id = ? "
+            "ORDER BY position DESC LIMIT ?",
+            (chat_id, self._max_messages),
+        ).fetchall()
+        messages = []
+        for role, content, token_length in reversed(rows):
+            message = Message(role=Role(role), content=content)
+            message._token_length = token_length
+            messages.append(message)
+        return messages
+
+    def append(self, chat_id: str, messages: Iterable[Message]) -> None:
+        messages = list(messages)
+        with self._db:
+            next_position = self._db.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE chat_id = ?",
+                (chat_id,),
+            ).fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        chat_id,
+                        next_position + i,
+                        m.role.value,
+                        m.content,
+                        m._token_length,
+                    )
+                    for i, m in enumerate(messages)
+                ],
+            )
+            self._db.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND position < ?",
+                (chat_id, next_position + len(messages) - self._max_messages),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO chats VALUES (?, ?)", (chat_id, self._clock())
+            )
+        super().append(chat_id, messages)
+
+    def replace_oldest(
+        self, chat_id: str, count: int, messages: Iterable[Message]
+    ) -> None:
+        messages = list(messages)
+        with self._db:
+            first_kept = self._db.execute(
+                "SELECT position FROM messages WHERE chat_id = ? "
+                "ORDER BY position LIMIT 1 OFFSET ?",
+                (chat_id, count),
+            ).fetchone()
+            if first_kept is None:
+                first_kept = self._db.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM messages "
+                    "WHERE chat_id = ?",
+                    (chat_id,),
+                ).fetchone()
+            first_kept = first_kept[0]
+            self._db.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND position < ?",
+                (chat_id, first_kept),
+            )
+            # The new messages go right before the first one kept, positions
+            # may become negative
+            self._db.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        chat_id,
+                        first_kept - len(messages) + i,
+                        m.role.value,
+                        m.content,
+                        m._token_length,
+                    )
+                    for i, m in enumerate(messages)
+                ],
+            )
+        super().replace_oldest(chat_id, count, messages)
+
+    def clear(self, chat_id: str) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._db.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+        super().clear(chat_id)
+
+    def close(self) -> None:
+        self._db.close()
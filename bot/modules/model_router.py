@@ -0,0 +1,205 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import toml
+from decouple import config
+
+from bot.modules.openai_conversation import OpenAIChatModel
+from bot.modules.scheduler import RateLimiter
+from bot.utilities.logging import get_logger
+from bot.utilities.metrics import metrics
+from bot.utilities.resilience import LatencyTracker
+
+# Limits and prices of the models, also used to price the metered usage
+MODELS_FILE = config("MODELS_FILE", default="bot/config/models.toml")
+# Requests are routed across the models of MODELS_FILE when enabled, otherwise
+# every conversation keeps the model it was created with
+MODEL_ROUTING = config("MODEL_ROUTING", default=False, cast=bool)
+# Latency in seconds the routed models should keep at MODEL_LATENCY_PERCENTILE,
+# and most USD a request should cost, no limit if empty
+MODEL_LATENCY_SLO = config(
+    "MODEL_LATENCY_SLO",
+    default="",
+    cast=lambda value: float(value) if value else None,
+)
+MODEL_LATENCY_PERCENTILE = config("MODEL_LATENCY_PERCENTILE", default=95, cast=float)
+MODEL_MAX_REQUEST_COST = config(
+    "MODEL_MAX_REQUEST_COST",
+    default="",
+    cast=lambda value: float(value) if value else None,
+)
+
+logger = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Limits and prices of a model, prices in USD per 1000 tokens."""
+
+    model: OpenAIChatModel
+    token_limit: int
+    prompt_price: float
+    completion_price: float
+    tokens_per_minute: int
+    requests_per_minute: int
+
+    def get_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (
+            prompt_tokens * self.prompt_price
+            + completion_tokens * self.completion_price
+        ) / 1000
+
+
+def load_model_specs(toml_file: str = MODELS_FILE) -> list[ModelSpec]:
+    """Reads the model table, raising ValueError for unknown models."""
+    return [
+        ModelSpec(model=OpenAIChatModel(name), **values)
+        for name, values in toml.load(toml_file).items()
+    ]
+
+
+@dataclass(frozen=True)
+class RoutePolicy:
+    """What a request should stay within, None for no limit.
+
+    latency_slo is compared with the latency_percentile of the recent
+    completions of each model.
+    """
+
+    latency_slo: Optional[float] = None
+    latency_percentile: float = 95
+    max_cost: Optional[float] = None
+
+
+class _ModelState:
+    def __init__(self, spec: ModelSpec, clock: Callable[[], float]) -> None:
+        self.tokens = RateLimiter(spec.tokens_per_minute, clock)
+        self.requests = RateLimiter(spec.requests_per_minute, clock)
+        self.latencies = LatencyTracker()
+
+    def get_wait_time(self, tokens: int) -> float:
+        return max(self.tokens.get_wait_time(tokens), self.requests.get_wait_time(1))
+
+
+class ModelRouter:
+    """Picks the models to try for each request.
+
+    Only the models whose context fits the prompt and the completion are
+    candidates. Those that keep the policy come first, then those with rate
+    limit headroom left, then the cheapest. Models that break the policy are
+    still used, last, so a request is never refused because of it. A prompt
+    that fits no model gets the largest one, to be cut to its limit.
+
+    Every decision is counted in the metrics with the reason of the first
+    choice: "policy" when it keeps the policy and has headroom, "throttled"
+    when no model that keeps it has headroom, "relaxed" when none keeps it
+    and "too_long" when the prompt fits no model.
+    """
+
+    def __init__(
+        self,
+        specs: list[ModelSpec],
+        policy: RoutePolicy = RoutePolicy(),
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not specs:
+            raise ValueError("The router needs at least one model")
+        self._specs = {spec.model: spec for spec in specs}
+        self._states = {spec.model: _ModelState(spec, clock) for spec in specs}
+        self._policy = policy
+
+    @classmethod
+    def from_toml(cls, toml_file: str = MODELS_FILE, **kwargs) -> "ModelRouter":
+        return cls(load_model_specs(toml_file), **kwargs)
+
+    def get_spec(self, model: OpenAIChatModel) -> ModelSpec:
+        return self._specs[model]
+
+    def get_specs(self) -> list[ModelSpec]:
+        return list(self._specs.values())
+
+    def _keeps_policy(
+        self, spec: ModelSpec, prompt_tokens: int, completion_tokens: int
+    ) -> bool:
+        policy = self._policy
+        cost = spec.get_cost(prompt_tokens, completion_tokens)
+        if policy.max_cost is not None and cost > policy.max_cost:
+            return False
+        if policy.latency_slo is None:
+            return True
+        latency = self._states[spec.model].latencies.get_percentile(
+            policy.latency_percentile
+        )
+        return latency is None or latency <= policy.latency_slo
+
+    def route(self, prompt_tokens: int, completion_tokens: int) -> list[ModelSpec]:
+        """Models to try for a request, in order."""
+        tokens = prompt_tokens + completion_tokens
+        candidates = [
+            spec for spec in self._specs.values() if tokens <= spec.token_limit
+        ]
+        if not candidates:
+            largest = max(self._specs.values(), key=lambda spec: spec.token_limit)
+            self._record(largest, "too_long")
+            return [largest]
+
+        def rank(spec: ModelSpec) -> tuple:
+            wait_time = self._states[spec.model].get_wait_time(tokens)
+            return (
+                not self._keeps_policy(spec, prompt_tokens, completion_tokens),
+                wait_time,
+                spec.get_cost(prompt_tokens, completion_tokens),
+            )
+
+        ranks = {spec.model: rank(spec) for spec in candidates}
+        candidates.sort(key=lambda spec: ranks[spec.model])
+        breaks_policy, wait_time, _ = ranks[candidates[0].model]
+        if breaks_policy:
+            reason = "relaxed"
+        elif wait_time > 0:
+            reason = "throttled"
+        else:
+            reason = "policy"
+        self._record(candidates[0], reason)
+        return candidates
+
+    def _record(self, spec: ModelSpec, reason: str) -> None:
+        logger.debug("Routed request to %s (%s)", spec.model.value, reason)
+        metrics.record_route(spec.model.value, reason)
+
+    def record_fallback(self, spec: ModelSpec) -> None:
+        self._record(spec, "fallback")
+
+    def acquire(self, model: OpenAIChatModel, tokens: int) -> None:
+        """Takes a request of tokens from the headroom of model."""
+        state = self._states[model]
+        state.tokens.consume(tokens)
+        state.requests.consume(1)
+
+    def throttle(self, model: OpenAIChatModel) -> None:
+        """Uses up the token headroom of a model after it hit its rate limit."""
+        self._states[model].tokens.consume(self._specs[model].tokens_per_minute)
+
+    def record_latency(self, model: OpenAIChatModel, seconds: float) -> None:
+        self._states[model].latencies.record(seconds)
+
+
+_model_router: Optional[ModelRouter] = None
+
+
+def get_model_router() -> Optional[ModelRouter]:
+    """The router shared by the commands, None unless MODEL_ROUTING is enabled."""
+    global _model_router
+    if not MODEL_ROUTING:
+        return None
+    if _model_router is None:
+        _model_router = ModelRouter.from_toml(
+            MODELS_FILE,
+            policy=RoutePolicy(
+                latency_slo=MODEL_LATENCY_SLO,
+                latency_percentile=MODEL_LATENCY_PERCENTILE,
+                max_cost=MODEL_MAX_REQUEST_COST,
+            ),
+        )
+    return _model_router
@@ -1,49 +1,138 @@
-from dataclasses import dataclass
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional
+from functools import lru_cache
+from itertools import accumulate
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
 
-import openai
-import tiktoken
 from decouple import config
 
-from bot.utilities.logging import get_logger
+from bot.modules.conversation_store import (
+    ConversationStore,
+    HistoryView,
+    MemoryConversationStore,
+    Message,
+    Role,
+)
+from bot.utilities.chunker import split_into_chunks
+from bot.utilities.http_session import get_http_session
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger, span
+from bot.utilities.metrics import metrics
+from bot.utilities.resilience import CircuitOpenError, ResilientCaller, RetryPolicy
+from bot.utilities.summary_cache import SummaryCache
+
+if TYPE_CHECKING:
+    from bot.modules.model_router import ModelRouter, ModelSpec
 
 OPENAI_API_KEY = config("OPENAI_API_KEY", default=None)
-
-openai.api_key = OPENAI_API_KEY
+OPENAI_TIMEOUT_SECONDS = config("OPENAI_TIMEOUT_SECONDS", default=60, cast=float)
+OPENAI_MAX_ATTEMPTS = config("OPENAI_MAX_ATTEMPTS", default=5, cast=int)
+# Attempts on each routed model before falling back to the next one
+OPENAI_ROUTED_MAX_ATTEMPTS = config("OPENAI_ROUTED_MAX_ATTEMPTS", default=2, cast=int)
+# Latency percentile after which a duplicate request is sent, disabled if empty
+OPENAI_HEDGE_PERCENTILE = config(
+    "OPENAI_HEDGE_PERCENTILE",
+    default="",
+    cast=lambda value: float(value) if value else None,
+)
 
 logger = get_logger(__name__)
 
 
+def _configure_openai(module) -> None:
+    # Keeps a key set before the import, like the one openai reads from the env
+    if module.api_key is None:
+        module.api_key = OPENAI_API_KEY
+
+
+# Only imported when a request is made, they take a large part of the start up
+openai = lazy_import("openai", on_import=_configure_openai)
+tiktoken = lazy_import("tiktoken")
+
+
 TOKENIZER = "cl100k_base"
 
 
+@lru_cache(maxsize=None)
+def get_tokenizer(name: str = TOKENIZER) -> tiktoken.Encoding:
+    """Returns the process-wide tiktoken encoding, loading it only once."""
+    return tiktoken.get_encoding(name)
+
+
+# Names in openai.error, only looked up once an error has to be checked
+RETRYABLE_ERRORS = (
+    "RateLimitError",
+    "Timeout",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "TryAgain",
+)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Rate limits, timeouts, connection problems and server errors are transient."""
+    retryable = tuple(getattr(openai.error, name) for name in RETRYABLE_ERRORS)
+    if isinstance(error, retryable):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is None or error.http_status >= 500
+    return False
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def make_openai_caller(max_attempts: int = OPENAI_MAX_ATTEMPTS) -> ResilientCaller:
+    return ResilientCaller(
+        is_retryable=is_retryable_error,
+        get_retry_after=get_retry_after,
+        policy=RetryPolicy(max_attempts=max_attempts),
+        hedge_percentile=OPENAI_HEDGE_PERCENTILE,
+    )
+
+
+openai_caller = make_openai_caller()
+# Callers of the routed models, with a circuit breaker each so a failing model
+# does not stop the requests that fall back to the others
+_model_callers: dict[str, ResilientCaller] = {}
+
+
+def get_model_caller(model: str) -> ResilientCaller:
+    if model not in _model_callers:
+        _model_callers[model] = make_openai_caller(OPENAI_ROUTED_MAX_ATTEMPTS)
+    return _model_callers[model]
+
+
+def make_completion_key(request: dict) -> str:
+    """Key of a completion request, used to checkpoint its response."""
+    payload = [request["model"], request["messages"], request["temperature"]]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
 class OpenAIChatModel(Enum):
     GPT_3_5 = "gpt-3.5-turbo"
+    GPT_3_5_16K = "gpt-3.5-turbo-16k"
     GPT_4 = "gpt-4"
 
 
 TOKEN_LIMITS = {
     OpenAIChatModel.GPT_3_5: 4000,
+    OpenAIChatModel.GPT_3_5_16K: 16000,
     OpenAIChatModel.GPT_4: 8000,
 }
 
 
-class Role(Enum):
-    SYSTEM: str = "system"
-    USER: str = "user"
-    ASSISTANT: str = "assistant"
-
-
-@dataclass
-class Message:
-    role: Role
-    content: str
-
-    def to_dict(self) -> dict[str, str]:
-        return {"role": self.role.value, "content": self.content}
-
-
 @dataclass
 class Usage:
     prompt_tokens: int
@@ -64,12 +153,88 @@ class OpenAIChatResponse:
     finish_reason: str
     model: str
     usage: Usage
-    history: list[Message]
+    history: HistoryView
     prompt: str
     cut_prompt: str
     content: str
 
 
+class OpenAIChatStream:
+    """Async iterator over the content deltas of a streamed completion.
+
+    The accumulated content is available in `content` as the stream advances.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[dict],
+        prompt: str,
+        cut_prompt: str,
+        on_finish: Callable[["OpenAIChatStream"], None],
+    ) -> None:
+        self.prompt = prompt
+        self.cut_prompt = cut_prompt
+        self.content = ""
+        self.model: Optional[str] = None
+        self.finish_reason: Optional[str] = None
+        self._chunks = chunks
+        self._on_finish = on_finish
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for chunk in self._chunks:
+            self.model = chunk["model"]
+            choice = chunk["choices"][0]
+            self.finish_reason = choice.get("finish_reason") or self.finish_reason
+            delta = choice["delta"].get("content")
+            if delta:
+                self.content += delta
+                yield delta
+        self._on_finish(self)
+
+    def to_response(self) -> dict:
+        """The finished stream in the shape of a non streamed response."""
+        return {
+            "created": int(time.time()),
+            "model": self.model,
+            "usage": None,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": self.finish_reason,
+                    "message": {"role": Role.ASSISTANT.value, "content": self.content},
+                }
+            ],
+        }
+
+
+async def _replay_stream(response: dict) -> AsyncIterator[dict]:
+    """Yields a stored response as a single streamed chunk."""
+    choice = response["choices"][0]
+    yield {
+        "model": response["model"],
+        "choices": [
+            {
+                "delta": {"content": choice["message"]["content"]},
+                "finish_reason": choice["finish_reason"],
+            }
+        ],
+    }
+
+
+@dataclass
+class RequestRoute:
+    """Model a request is made with and the routed models left to fall back to.
+
+    Each request has its own, so concurrent requests of a conversation do not
+    change each other's model.
+    """
+
+    model: OpenAIChatModel
+    fallbacks: list[ModelSpec] = field(default_factory=list)
+    # Prompt and completion tokens taken from the headroom of the model
+    tokens: int = 0
+
+
 @dataclass(frozen=True)
 class ConversationStatus:
     id: str
@@ -85,20 +250,49 @@ class OpenAIConversation:
         self,
         model: OpenAIChatModel = OpenAIChatModel.GPT_3_5,
         system_prompt: str | None = None,
+        caller: Optional[ResilientCaller] = None,
+        checkpoints: Optional[SummaryCache] = None,
+        store: Optional[ConversationStore] = None,
+        chat_id: str = "default",
+        router: Optional[ModelRouter] = None,
     ):
+        """caller retries the API calls, openai_caller is shared by default.
+
+        When checkpoints is given, completed responses are stored in it by
+        request, so repeating a request after a failure reuses them. The
+        history is kept in store under chat_id, by default in a store of its
+        own that is lost with the conversation.
+
+        With a router, the model of every request is picked by the router
+        instead, and a request that fails after its retries falls back to the
+        next model it picked. Each model then has a caller of its own, unless
+        caller is given. allow_model_upgrade has no effect.
+        """
         self.model = model
-        self._chat_history: list[Message] = []
+        if store is None:
+            store = MemoryConversationStore(max_chats=1, idle_seconds=None)
+        self._store = store
+        self._chat_id = chat_id
         self._system_prompt = system_prompt or ""
-        # TODO: Register total API usage and costs
-
-    def _add_message(self, role: Role, content: str) -> None:
-        self._chat_history.append(Message(role=role, content=content))
+        self._caller = caller or openai_caller
+        self._caller_per_model = router is not None and caller is None
+        self._checkpoints = checkpoints
+        self._router = router
+
+    def _add_turn(
+        self, user_message: str, prompt: list[Message], cut_prompt: str, answer: str
+    ) -> None:
+        # The prompt message already has its token count, unless it was cut
+        question = prompt[-1] if not cut_prompt else Message(Role.USER, user_message)
+        self._store.append(
+            self._chat_id, [question, Message(role=Role.ASSISTANT, content=answer)]
+        )
 
     def _get_system_prompt_message(self) -> Message:
         return Message(role=Role.SYSTEM, content=self._system_prompt)
 
     def _get_tokenizer(self) -> tiktoken.Encoding:
-        return tiktoken.get_encoding(TOKENIZER)
+        return get_tokenizer()
 
     def _compose_response(
         self, response: dict, prompt: str, cut_prompt: str
@@ -109,7 +303,7 @@ class OpenAIConversation:
             finish_reason=choice["finish_reason"],
             model=response["model"],
             usage=response["usage"],
-            history=self._chat_history.copy(),
+            history=self._store.get_history(self._chat_id),
             prompt=prompt,
             cut_prompt=cut_prompt,
             content=choice["message"]["content"],
@@ -122,8 +316,38 @@ class OpenAIConversation:
             tokenizer = self._get_tokenizer()
         return len(tokenizer.encode(text))
 
-    def get_limit(self, margin: int) -> int:
-        return TOKEN_LIMITS[self.model] - margin
+    async def aget_text_token_length(self, text: str) -> int:
+        """Counts the tokens of a text in a thread, off the event loop.
+
+        tiktoken releases the GIL while encoding, so a thread is enough and
+        avoids copying the text to a worker process.
+        """
+        with span("tokenize", chars=len(text)) as fields:
+            fields["tokens"] = await asyncio.to_thread(self.get_text_token_length, text)
+        return fields["tokens"]
+
+    def estimate_text_token_length(
+        self, text: str, samples: int = 8, sample_chars: int = 2000
+    ) -> int:
+        """Estimates the tokens of a long text from evenly spaced samples of it.
+
+        Texts shorter than the samples together are encoded in full.
+        """
+        if len(text) <= samples * sample_chars:
+            return self.get_text_token_length(text)
+        tokenizer = self._get_tokenizer()
+        step = (len(text) - sample_chars) // (samples - 1)
+        sampled_tokens = sum(
+            len(tokenizer.encode(text[start : start + sample_chars]))
+            for start in range(0, step * samples, step)
+        )
+        return round(len(text) * sampled_tokens / (samples * sample_chars))
+
+    def get_limit(self, margin: int, model: Optional[OpenAIChatModel] = None) -> int:
+        model = model or self.model
+        if self._router is not None:
+            return self._router.get_spec(model).token_limit - margin
+        return TOKEN_LIMITS[model] - margin
 
     def preprocess_prompt(
         self,
@@ -133,7 +357,15 @@ class OpenAIConversation:
         allow_message_truncation: bool = True,
         tokenizer: Optional[tiktoken.Encoding] = None,
         token_margin: int = 1000,
+        model: Optional[OpenAIChatModel] = None,
+        user_message_tokens: Optional[int] = None,
     ) -> tuple[list[Message], str]:
+        """Fits the prompt in the limit of model, the conversation model by default.
+
+        user_message_tokens is the length of the newest message, when it has
+        already been counted for the same content.
+        """
+        model = model or self.model
         if tokenizer is None:
             tokenizer = self._get_tokenizer()
         assert len(prompt) > 0, "The prompt must not be empty in order to preprocess it"
@@ -146,65 +378,64 @@ class OpenAIConversation:
                 "The prompt must contain at least 2 messages: system and user"
             )
 
-        total_prompt_limit = self.get_limit(token_margin)
-        prompt_tokens = [
-            self.get_text_token_length(message.content, tokenizer) for message in prompt
-        ]
-        total_prompt_length = sum(prompt_tokens)
-        logger.info(f"Prompt length: {total_prompt_length} tokens")
-
+        # The newest message is encoded unless its length is given, the rest
+        # of the counts are memoized per message
+        with span("tokenize", messages=len(prompt)) as fields:
+            user_message = prompt[-1]
+            if user_message_tokens is None:
+                user_message_tokens = len(tokenizer.encode(user_message.content))
+            user_message._token_length = user_message_tokens
+            prompt_tokens = [message.get_token_length(tokenizer) for message in prompt]
+            total_prompt_length = sum(prompt_tokens)
+            fields["tokens"] = total_prompt_length
+
+        total_prompt_limit = self.get_limit(token_margin, model)
         system_prompt_length = prompt_tokens[0]
         if system_prompt_length > total_prompt_limit:
             raise ValueError(
                 f"The system prompt is too long, it must be less than {total_prompt_limit} tokens"
             )
-        if total_prompt_length >= total_prompt_limit:
-            if allow_model_upgrade and self.model == OpenAIChatModel.GPT_3_5:
-                self.model = OpenAIChatModel.GPT_4
-                logger.info("Upgrading model to GPT-4 to fit larger prompt")
-                return self.preprocess_prompt(
-                    prompt=prompt,
-                    allow_model_upgrade=False,
-                    allow_message_removal=allow_message_removal,
-                    allow_message_truncation=allow_message_truncation,
-                    tokenizer=tokenizer,
-                    token_margin=token_margin,
-                )
-
-            if len(prompt) > 2 and allow_message_removal:
-                # Elimitate the oldest message except the system prompt until the prompt fits
-                prompt = prompt[0:1] + prompt[2:]
-                logger.warning(
-                    "The prompt is too long, reducing the chat history to fit the limit"
-                )
-                return self.preprocess_prompt(
-                    prompt=prompt,
-                    allow_model_upgrade=False,
-                    allow_message_removal=allow_message_removal,
-                    allow_message_truncation=allow_message_truncation,
-                    tokenizer=tokenizer,
-                    token_margin=token_margin,
-                )
-
-            if len(prompt) == 2 and allow_message_truncation:
-                # Reduce the user message until the prompt fits
-                logger.warning(
-                    "The prompt is too long, reducing the user message to fit the limit"
-                )
-                user_message = prompt[-1]
-                user_limit = total_prompt_limit - system_prompt_length
-                user_content = tokenizer.decode(
-                    tokenizer.encode(user_message.content)[:user_limit]
-                )
-                cut_content = user_message.content[len(user_content) :]
-                user_message = Message(role=user_message.role, content=user_content)
-                return [prompt[0], user_message], cut_content
-
-            raise ValueError(
-                f"The prompt is too long, it must be less than {total_prompt_limit} tokens"
+        if total_prompt_length < total_prompt_limit:
+            return prompt, ""
+
+        if allow_model_upgrade and model == OpenAIChatModel.GPT_3_5:
+            model = self.model = OpenAIChatModel.GPT_4
+            logger.info("Upgrading model to GPT-4 to fit larger prompt")
+            total_prompt_limit = self.get_limit(token_margin, model)
+            if total_prompt_length < total_prompt_limit:
+                return prompt, ""
+
+        if len(prompt) > 2 and allow_message_removal:
+            # Eliminate the oldest messages except the system prompt and the new
+            # message, finding the cut point from the prefix sums in a single pass
+            logger.warning(
+                "The prompt is too long, reducing the chat history to fit the limit"
             )
-
-        return prompt, ""
+            removable_lengths = accumulate(prompt_tokens[1:-1], initial=0)
+            for removed_count, removed_length in enumerate(removable_lengths):
+                if total_prompt_length - removed_length < total_prompt_limit:
+                    break
+            prompt = prompt[0:1] + prompt[1 + removed_count :]
+            total_prompt_length -= removed_length
+            if total_prompt_length < total_prompt_limit:
+                return prompt, ""
+
+        if len(prompt) == 2 and allow_message_truncation:
+            # Reduce the user message until the prompt fits
+            logger.warning(
+                "The prompt is too long, reducing the user message to fit the limit"
+            )
+            user_limit = total_prompt_limit - system_prompt_length
+            first_chunk = split_into_chunks(
+                user_message.content, tokenizer, user_limit
+            )[0]
+            cut_content = user_message.content[first_chunk.end :]
+            user_message = Message(role=user_message.role, content=first_chunk.text)
+            return [prompt[0], user_message], cut_content
+
+        raise ValueError(
+            f"The prompt is too long, it must be less than {total_prompt_limit} tokens"
+        )
 
     def get_system_prompt(self) -> str:
         return self._system_prompt
@@ -213,7 +444,188 @@ class OpenAIConversation:
         self._system_prompt = system_prompt
 
     def get_chat_history(self) -> list[Message]:
-        return [self._get_system_prompt_message()] + self._chat_history
+        return [
+            self._get_system_prompt_message(),
+            *self._store.get_history(self._chat_id),
+        ]
+
+    def clear_history(self) -> None:
+        self._store.clear(self._chat_id)
+
+    def _prepare_completion_prompt(
+        self,
+        user_message: str,
+        allow_model_upgrade: bool,
+        allow_message_removal: bool,
+        allow_message_truncation: bool,
+        system_prompt: str | None,
+        token_margin: int,
+    ) -> tuple[list[Message], str, RequestRoute]:
+        if system_prompt is not None:
+            self.set_system_prompt(system_prompt)
+
+        history = self.get_chat_history()
+        new_message = Message(role=Role.USER, content=user_message)
+        conversation_base_prompt = history + [new_message]
+        if self._router is None:
+            prompt, cut_prompt = self.preprocess_prompt(
+                conversation_base_prompt,
+                allow_model_upgrade,
+                allow_message_removal,
+                allow_message_truncation,
+                token_margin=token_margin,
+            )
+            return prompt, cut_prompt, RequestRoute(self.model)
+
+        route = self._route(conversation_base_prompt, token_margin)
+        prompt, cut_prompt = self.preprocess_prompt(
+            conversation_base_prompt,
+            False,
+            allow_message_removal,
+            allow_message_truncation,
+            token_margin=token_margin,
+            model=route.model,
+            # Counted while routing
+            user_message_tokens=new_message.get_token_length(self._get_tokenizer()),
+        )
+        return prompt, cut_prompt, route
+
+    def _route(self, prompt: list[Message], completion_tokens: int) -> RequestRoute:
+        tokenizer = self._get_tokenizer()
+        prompt_tokens = sum(message.get_token_length(tokenizer) for message in prompt)
+        specs = self._router.route(prompt_tokens, completion_tokens)
+        return RequestRoute(
+            specs[0].model, specs[1:], prompt_tokens + completion_tokens
+        )
+
+    def _get_caller(self, model: OpenAIChatModel) -> ResilientCaller:
+        if self._caller_per_model:
+            return get_model_caller(model.value)
+        return self._caller
+
+    def _start_call(self, route: RequestRoute) -> float:
+        if self._router is not None:
+            self._router.acquire(route.model, route.tokens)
+        return time.perf_counter()
+
+    def _finish_call(self, route: RequestRoute, start: float) -> None:
+        if self._router is not None:
+            self._router.record_latency(route.model, time.perf_counter() - start)
+
+    def _fail_call(self, route: RequestRoute, start: float, error: Exception) -> None:
+        # Slow failures and timeouts count against the latency of the model,
+        # calls refused by an open circuit were never made
+        if not isinstance(error, CircuitOpenError):
+            self._finish_call(route, start)
+
+    def _fall_back(
+        self, request: dict, route: RequestRoute, error: Exception
+    ) -> Optional[dict]:
+        """Returns the request for the next routed model, None if there is none.
+
+        Only errors that another model may not have fall back, like rate
+        limits or server errors.
+        """
+        retryable = is_retryable_error(error) or isinstance(error, CircuitOpenError)
+        if not route.fallbacks or not retryable:
+            return None
+        if isinstance(error, openai.error.RateLimitError):
+            self._router.throttle(route.model)
+        spec = route.fallbacks.pop(0)
+        logger.warning(
+            "%s failed with %r, falling back to %s",
+            route.model.value,
+            error,
+            spec.model.value,
+        )
+        self._router.record_fallback(spec)
+        route.model = spec.model
+        return {**request, "model": spec.model.value}
+
+    def _call_sync(self, request: dict, route: RequestRoute) -> dict:
+        while True:
+            start = self._start_call(route)
+            try:
+                with span("api_call", model=route.model.value), metrics.time_api_call(
+                    route.model.value
+                ):
+                    response = self._get_caller(route.model).call_sync(
+                        lambda: openai.ChatCompletion.create(**request)
+                    )
+            except Exception as e:
+                self._fail_call(route, start, e)
+                if (request := self._fall_back(request, route, e)) is None:
+                    raise
+            else:
+                self._finish_call(route, start)
+                return response
+
+    async def _acall(self, request: dict, route: RequestRoute, **kwargs) -> Any:
+        """Awaits the request, falling back across the routed models.
+
+        kwargs are passed to the API call, stream=True returns the chunks.
+        """
+        openai.aiosession.set(get_http_session())
+        while True:
+            start = self._start_call(route)
+            try:
+                with span(
+                    "api_call",
+                    model=route.model.value,
+                    stream=kwargs.get("stream", False),
+                ), metrics.time_api_call(route.model.value):
+                    response = await self._get_caller(route.model).call(
+                        lambda: openai.ChatCompletion.acreate(**request, **kwargs),
+                        hedge=not kwargs.get("stream", False),
+                    )
+            except Exception as e:
+                self._fail_call(route, start, e)
+                if (request := self._fall_back(request, route, e)) is None:
+                    raise
+            else:
+                self._finish_call(route, start)
+                return response
+
+    def _get_request(
+        self, prompt: list[Message], temperature: float, model: OpenAIChatModel
+    ) -> dict:
+        return {
+            "model": model.value,
+            "messages": [message.to_dict() for message in prompt],
+            "temperature": temperature,
+            "request_timeout": OPENAI_TIMEOUT_SECONDS,
+        }
+
+    def _load_checkpoint(self, request: dict) -> Optional[dict]:
+        if self._checkpoints is None:
+            return None
+        response = self._checkpoints.get(make_completion_key(request))
+        if response is None:
+            return None
+        logger.info("Reusing checkpointed completion")
+        return json.loads(response)
+
+    def _save_checkpoint(self, request: dict, response: dict) -> None:
+        if self._checkpoints is not None:
+            self._checkpoints.set(make_completion_key(request), json.dumps(response))
+
+    def _record_usage(self, response: dict) -> None:
+        usage = response["usage"]
+        metrics.record_usage(
+            response["model"], usage["prompt_tokens"], usage["completion_tokens"]
+        )
+
+    def _register_completion(
+        self,
+        response: dict,
+        user_message: str,
+        prompt: list[Message],
+        cut_prompt: str,
+    ) -> OpenAIChatResponse:
+        chat_response = self._compose_response(response, user_message, cut_prompt)
+        # logger.info("Chat response: " + chat_response.content)
+        self._add_turn(user_message, prompt, cut_prompt, chat_response.content)
+        return chat_response
 
     def get_completion(
         self,
@@ -225,33 +637,115 @@ class OpenAIConversation:
         system_prompt: str | None = None,
         token_margin: int = 1000,
     ) -> OpenAIChatResponse:
-        if system_prompt is not None:
-            self.set_system_prompt(system_prompt)
+        logger.debug("Initiating completion process")
 
-        logger.info(f"Initiating completion process")
+        conversation_prompt, cut_prompt, route = self._prepare_completion_prompt(
+            user_message,
+            allow_model_upgrade,
+            allow_message_removal,
+            allow_message_truncation,
+            system_prompt,
+            token_margin,
+        )
 
-        history = self.get_chat_history()
-        new_message = Message(role=Role.USER, content=user_message)
-        conversation_base_prompt = history + [new_message]
+        request = self._get_request(conversation_prompt, temperature, route.model)
+        response = self._load_checkpoint(request)
+        if response is None:
+            response = self._call_sync(request, route)
+            self._record_usage(response)
+            self._save_checkpoint(request, response)
+        logger.debug("Completion process finished")
 
-        conversation_prompt, cut_prompt = self.preprocess_prompt(
-            conversation_base_prompt,
+        return self._register_completion(
+            response, user_message, conversation_prompt, cut_prompt
+        )
+
+    async def aget_completion(
+        self,
+        user_message: str,
+        temperature: float = 0.7,
+        allow_model_upgrade: bool = False,
+        allow_message_removal: bool = True,
+        allow_message_truncation: bool = True,
+        system_prompt: str | None = None,
+        token_margin: int = 1000,
+    ) -> OpenAIChatResponse:
+        """Async version of get_completion that does not block the event loop.
+
+        Requests go through the shared pooled HTTP session instead of opening a
+        new connection for every call.
+        """
+        logger.debug("Initiating async completion process")
+
+        conversation_prompt, cut_prompt, route = self._prepare_completion_prompt(
+            user_message,
             allow_model_upgrade,
             allow_message_removal,
             allow_message_truncation,
-            token_margin=token_margin,
+            system_prompt,
+            token_margin,
         )
 
-        response = openai.ChatCompletion.create(
-            model=self.model.value,
-            messages=[message.to_dict() for message in conversation_prompt],
-            temperature=temperature,
+        request = self._get_request(conversation_prompt, temperature, route.model)
+        response = self._load_checkpoint(request)
+        if response is None:
+            response = await self._acall(request, route)
+            self._record_usage(response)
+            self._save_checkpoint(request, response)
+        logger.debug("Async completion process finished")
+
+        return self._register_completion(
+            response, user_message, conversation_prompt, cut_prompt
         )
-        logger.info(f"Completion process finished")
 
-        chat_response = self._compose_response(response, user_message, cut_prompt)
-        # logger.info("Chat response: " + chat_response.content)
-        self._add_message(Role.USER, user_message)
-        self._add_message(Role.ASSISTANT, chat_response.content)
+    async def astream_completion(
+        self,
+        user_message: str,
+        temperature: float = 0.7,
+        allow_model_upgrade: bool = False,
+        allow_message_removal: bool = True,
+        allow_message_truncation: bool = True,
+        system_prompt: str | None = None,
+        token_margin: int = 1000,
+    ) -> OpenAIChatStream:
+        """Starts a streamed completion and returns it as soon as it begins.
 
-        return chat_response
+        The messages are added to the history once the stream is exhausted.
+        """
+        logger.debug("Initiating streamed completion process")
+
+        conversation_prompt, cut_prompt, route = self._prepare_completion_prompt(
+            user_message,
+            allow_model_upgrade,
+            allow_message_removal,
+            allow_message_truncation,
+            system_prompt,
+            token_margin,
+        )
+
+        request = self._get_request(conversation_prompt, temperature, route.model)
+        if (response := self._load_checkpoint(request)) is not None:
+            chunks = _replay_stream(response)
+        else:
+            # Only starting the stream is retried, a stream that breaks halfway
+            # fails, as its content has already been shown
+            chunks = await self._acall(request, route, stream=True)
+
+        def on_finish(stream: OpenAIChatStream) -> None:
+            logger.debug("Streamed completion process finished")
+            if response is None:
+                # Streamed responses carry no usage, so it is counted locally
+                tokenizer = self._get_tokenizer()
+                prompt_tokens = sum(
+                    message.get_token_length(tokenizer)
+                    for message in conversation_prompt
+                )
+                completion_tokens = self.get_text_token_length(stream.content)
+                model = stream.model or route.model.value
+                metrics.record_usage(model, prompt_tokens, completion_tokens)
+                self._save_checkpoint(request, stream.to_response())
+            self._add_turn(
+                user_message, conversation_prompt, cut_prompt, stream.content
+            )
+
+        return OpenAIChatStream(chunks, user_message, cut_prompt, on_finish)
@@ -0,0 +1,182 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+from bot.modules.conversation_store import Message, Role
+from bot.modules.openai_conversation import OpenAIChatModel, OpenAIConversation
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+SUMMARY_PREFIX = "Summary of the conversation so far:\n"
+
+
+@dataclass(frozen=True)
+class SummaryPlan:
+    """Oldest messages of a history to fold into its summary."""
+
+    previous_summary: Optional[str]
+    messages: list[Message]
+    # Messages replaced in the history, including the previous summary
+    count: int
+
+
+class RollingSummaryConversation(OpenAIConversation):
+    """Chat that keeps a rolling summary of its older turns.
+
+    Once the history passes summary_threshold tokens, its oldest turns are
+    summarized together with the previous summary, in the background, and
+    replaced by the new summary as a system message. The newest turns, up to
+    recent_tokens, are kept as they are. Prompts stay below the threshold
+    plus the summary and the new message, however long the chat gets.
+
+    Summaries are made in the background when there is a running event loop,
+    and before returning in synchronous completions.
+    """
+
+    SUMMARY_SYSTEM_PROMPT = (
+        "You keep a running summary of a conversation between a user and an assistant."
+    )
+    SUMMARY_PROMPT = """Update the summary of a conversation with the messages that followed it, in less than {words_limit} words. Keep the facts, names, decisions and open questions needed to go on with the conversation.
+
+The summary so far is:
+{previous_summary}
+
+The messages that followed are:
+{messages}
+"""
+
+    # Summaries running by store and chat, shared by the conversations of a chat
+    _summaries: dict[tuple[int, str], asyncio.Task] = {}
+
+    def __init__(
+        self,
+        *args,
+        summary_threshold: int = 2000,
+        recent_tokens: int = 1000,
+        summary_words: int = 300,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._summary_threshold = summary_threshold
+        self._recent_tokens = recent_tokens
+        self._summary_words = summary_words
+
+    def get_summary(self) -> Optional[str]:
+        history = self._store.get_history(self._chat_id)
+        if history and history[0].role == Role.SYSTEM:
+            return history[0].content.removeprefix(SUMMARY_PREFIX)
+        return None
+
+    def plan_summary(self) -> Optional[SummaryPlan]:
+        """Returns the turns to summarize, if the history is over the threshold.
+
+        The newest messages that fit in recent_tokens are kept, always at least
+        the last turn, and the kept messages start with a user message.
+        """
+        history = list(self._store.get_history(self._chat_id))
+        tokenizer = self._get_tokenizer()
+        lengths = [message.get_token_length(tokenizer) for message in history]
+        if sum(lengths) <= self._summary_threshold:
+            return None
+
+        first = 1 if history and history[0].role == Role.SYSTEM else 0
+        count, recent_length = len(history), 0
+        recent_limit = self._recent_tokens
+        while count > first and recent_length + lengths[count - 1] <= recent_limit:
+            count -= 1
+            recent_length += lengths[count]
+        count = min(count, len(history) - 2)
+        while count < len(history) and history[count].role != Role.USER:
+            count += 1
+        if count <= first or count >= len(history):
+            return None
+        previous_summary = self.get_summary() if first else None
+        return SummaryPlan(previous_summary, history[first:count], count)
+
+    def _get_summary_request(self, plan: SummaryPlan) -> str:
+        messages = "\n\n".join(
+            f"{message.role.value.capitalize()}: {message.content}"
+            for message in plan.messages
+        )
+        return self.SUMMARY_PROMPT.format(
+            words_limit=self._summary_words,
+            previous_summary=plan.previous_summary or "There is no summary yet.",
+            messages=messages,
+        )
+
+    def _get_summarizer(self) -> OpenAIConversation:
+        # A conversation of its own, so the summary requests leave no history
+        return OpenAIConversation(
+            model=OpenAIChatModel.GPT_3_5,
+            system_prompt=self.SUMMARY_SYSTEM_PROMPT,
+            caller=self._caller,
+        )
+
+    def _apply_summary(self, plan: SummaryPlan, summary: str) -> None:
+        history = self._store.get_history(self._chat_id)
+        # Turns added in the meantime are kept, but if the history was trimmed
+        # or cleared the summary no longer matches it
+        if len(history) < plan.count or history[plan.count - 1] != plan.messages[-1]:
+            logger.info("History changed while it was summarized, summary dropped")
+            return
+        message = Message(role=Role.SYSTEM, content=SUMMARY_PREFIX + summary)
+        message.get_token_length(self._get_tokenizer())
+        self._store.replace_oldest(self._chat_id, plan.count, [message])
+        logger.info(
+            f"Summarized {len(plan.messages)} messages of chat {self._chat_id} in "
+            f"{message._token_length} tokens"
+        )
+
+    async def asummarize(self, plan: SummaryPlan) -> None:
+        response = await self._get_summarizer().aget_completion(
+            self._get_summary_request(plan), temperature=0
+        )
+        self._apply_summary(plan, response.content)
+
+    def summarize(self, plan: SummaryPlan) -> None:
+        response = self._get_summarizer().get_completion(
+            self._get_summary_request(plan), temperature=0
+        )
+        self._apply_summary(plan, response.content)
+
+    def _get_summary_key(self) -> tuple[int, str]:
+        return id(self._store), self._chat_id
+
+    async def wait_for_summary(self) -> None:
+        """Waits for the summary running for this chat, if there is one."""
+        task = self._summaries.get(self._get_summary_key())
+        if task is not None:
+            await asyncio.wait([task])
+
+    def _start_summary(self) -> None:
+        key = self._get_summary_key()
+        if key in self._summaries:
+            return
+        plan = self.plan_summary()
+        if plan is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            try:
+                self.summarize(plan)
+            except Exception as e:
+                logger.warning(f"Error summarizing chat {self._chat_id}: {e}")
+            return
+
+        async def run() -> None:
+            try:
+                await self.asummarize(plan)
+            except Exception as e:
+                # The completion already succeeded, the turns are summarized
+                # again after the next one
+                logger.warning(f"Error summarizing chat {self._chat_id}: {e}")
+            finally:
+                del self._summaries[key]
+
+        self._summaries[key] = loop.create_task(run())
+
+    def _add_turn(self, *args, **kwargs) -> None:
+        super()._add_turn(*args, **kwargs)
+        self._start_summary()
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class RateLimiter:
+    """Token bucket refilled continuously up to a per-minute capacity."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float]) -> None:
+        self._capacity = per_minute
+        self._rate = per_minute / 60
+        self._clock = clock
+        self._available = per_minute
+        self._updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed = now - self._updated_at
+        self._available = min(self._capacity, self._available + elapsed * self._rate)
+        self._updated_at = now
+
+    def get_wait_time(self, amount: float) -> float:
+        """Seconds until amount can be consumed.
+
+        Amounts above the capacity only need a full bucket, so they can still run.
+        """
+        self._refill()
+        missing = min(amount, self._capacity) - self._available
+        return max(0.0, missing / self._rate)
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self._available -= min(amount, self._capacity)
+
+
+@dataclass(eq=False)
+class _Job:
+    user_id: str
+    tokens: int
+    requests: int
+    on_position: Optional[PositionCallback]
+    started: asyncio.Future
+    position: int = field(default=0)
+
+
+class SummaryScheduler:
+    """Runs summarization jobs with a global concurrency and API rate limit.
+
+    Every user has a FIFO queue and queues are served round robin, so a user
+    sending many documents cannot starve the rest. A job only starts when the
+    tokens and requests per minute budgets can cover its estimated cost.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_jobs: int = 4,
+        tokens_per_minute: int = 90000,
+        requests_per_minute: int = 3500,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        self._max_concurrent_jobs = max_concurrent_jobs
+        self._token_limiter = RateLimiter(tokens_per_minute, clock)
+        self._request_limiter = RateLimiter(requests_per_minute, clock)
+        self._sleep = sleep
+        self._queues: OrderedDict[str, deque[_Job]] = OrderedDict()
+        self._running = 0
+        self._wakeup: Optional[asyncio.Task] = None
+        self._callbacks: set[asyncio.Task] = set()
+
+    @property
+    def running_jobs(self) -> int:
+        return self._running
+
+    @property
+    def queued_jobs(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _get_dispatch_order(self) -> list[_Job]:
+        """Returns the queued jobs in the order they would be started."""
+        queues = [list(queue) for queue in self._queues.values()]
+        order = []
+        for turn in range(max((len(queue) for queue in queues), default=0)):
+            order += [queue[turn] for queue in queues if turn < len(queue)]
+        return order
+
+    def _notify_positions(self) -> None:
+        for position, job in enumerate(self._get_dispatch_order(), start=1):
+            if job.on_position is not None and job.position != position:
+                task = asyncio.create_task(job.on_position(position))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callbacks.discard)
+            job.position = position
+
+    async def _wake_after(self, seconds: float) -> None:
+        await self._sleep(seconds)
+        self._wakeup = None
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._running < self._max_concurrent_jobs and self._queues:
+            # The next user in the round robin is the first one of the queue dict
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue[0]
+            wait_time = max(
+                self._token_limiter.get_wait_time(job.tokens),
+                self._request_limiter.get_wait_time(job.requests),
+            )
+            if wait_time > 0:
+                if self._wakeup is None:
+                    logger.info(f"Rate limit reached, waiting {wait_time:.1f}s")
+                    self._wakeup = asyncio.create_task(self._wake_after(wait_time))
+                break
+
+            queue.popleft()
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            self._token_limiter.consume(job.tokens)
+            self._request_limiter.consume(job.requests)
+            self._running += 1
+            job.started.set_result(None)
+        self._notify_positions()
+
+    async def submit(
+        self,
+        user_id: str,
+        job: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        requests: int = 1,
+        on_position: Optional[PositionCallback] = None,
+    ) -> T:
+        """Queues a job and returns its result once it has been run.
+
+        on_position is awaited with the 1-based queue position of the job every
+        time it changes while the job is waiting.
+        """
+        queued_job = _Job(
+            user_id=str(user_id),
+            tokens=tokens,
+            requests=requests,
+            on_position=on_position,
+            started=asyncio.get_running_loop().create_future(),
+        )
+        self._queues.setdefault(queued_job.user_id, deque()).append(queued_job)
+        self._dispatch()
+        try:
+            await queued_job.started
+        except asyncio.CancelledError:
+            queue = self._queues.get(queued_job.user_id)
+            if queue is not None and queued_job in queue:
+                queue.remove(queued_job)
+                if not queue:
+                    del self._queues[queued_job.user_id]
+                self._notify_positions()
+            else:
+                self._running -= 1
+                self._dispatch()
+            raise
+
+        try:
+            return await job()
+        finally:
+            self._running -= 1
+            self._dispatch()
@@ -1,11 +1,38 @@
-from typing import Optional
+import asyncio
+from dataclasses import dataclass
+from enum import Enum
+from math import ceil
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Union
 
-from bot.modules.openai_conversation import OpenAIConversation
+from bot.modules.openai_conversation import OpenAIChatModel, OpenAIConversation
+from bot.utilities.chunker import split_into_chunks
 from bot.utilities.logging import get_logger
+from bot.utilities.metrics import get_cost
+from bot.utilities.summary_cache import SummaryCache, make_cache_key
+
+if TYPE_CHECKING:
+    from bot.modules.model_router import ModelRouter
 
 logger = get_logger(__name__)
 
 
+TextSource = Union[str, AsyncIterator[str]]
+
+
+class SummaryMode(Enum):
+    RECURSIVE = "recursive"
+    MAP_REDUCE = "map_reduce"
+
+
+@dataclass(frozen=True)
+class SummaryEstimate:
+    api_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    seconds: float
+
+
 class Summarizer:
     GPT_35_LIMIT = 4000
     GPT_4_LIMIT = 8000
@@ -34,13 +61,46 @@ Key points:
 The next part of text is: {text}
 """
 
+    REDUCE_PROMPT = """Combine the following partial summaries of consecutive parts of a text into a single executive summary in the following format{words_limit_text}:
+Subject: [theme]
+Key points:
+- [key point]
+- ...
+
+The partial summaries are:
+{summaries}
+"""
+
+    PROGRESS_TEXT = "Summarizing... {done}/{total} parts done"
+
+    # Rough figures used to estimate summaries before running them
+    PART_SUMMARY_TOKENS = 250
+    CHUNK_FILL = 0.9
+    SECONDS_PER_CALL = 2.0
+    COMPLETION_TOKENS_PER_SECOND = 40
+
     def __init__(
         self,
         allow_gpt4: bool = False,
         allow_recursion: bool = True,
+        max_concurrency: int = 4,
+        chunk_token_limit: int = 2500,
+        checkpoints: Optional[SummaryCache] = None,
+        chunk_overlap_tokens: int = 0,
+        router: Optional["ModelRouter"] = None,
     ) -> None:
+        """checkpoints stores the completed parts, so a failed summary can resume.
+
+        With a router, the model of every part is picked by it, see
+        OpenAIConversation.
+        """
         self._allow_gpt4 = allow_gpt4
         self._allow_recursion = allow_recursion
+        self._max_concurrency = max_concurrency
+        self._chunk_token_limit = chunk_token_limit
+        self._chunk_overlap_tokens = chunk_overlap_tokens
+        self._checkpoints = checkpoints
+        self._router = router
 
     def _get_user_message(
         self,
@@ -51,33 +111,205 @@ The next part of text is: {text}
         words_limit_text = self.WORDS_LIMIT_ADDENDUM.format(words_limit=words_limit)
         words_limit_text = "" if words_limit is None else words_limit_text
         if previous_summary is None:
-            logger.info("Generating standard summary prompt")
+            logger.debug("Generating standard summary prompt")
             return self.PROMPT.format(
                 words_limit_text=words_limit_text,
                 text=text,
             )
         else:
-            logger.info("Generating recursive summary prompt")
+            logger.debug("Generating recursive summary prompt")
             return self.RECURSIVE_PROMPT.format(
                 words_limit_text=words_limit_text,
                 text=text,
                 previous_summary=previous_summary,
             )
 
+    def _get_reduce_message(
+        self, summaries: list[str], words_limit: Optional[int] = None
+    ) -> str:
+        words_limit_text = self.WORDS_LIMIT_ADDENDUM.format(words_limit=words_limit)
+        words_limit_text = "" if words_limit is None else words_limit_text
+        return self.REDUCE_PROMPT.format(
+            words_limit_text=words_limit_text,
+            summaries="\n\n".join(summaries),
+        )
+
+    @property
+    def chunk_token_limit(self) -> int:
+        return self._chunk_token_limit
+
+    def get_cache_key(
+        self,
+        text: str,
+        words_limit: Optional[int] = None,
+        temperature: float = 0.7,
+        mode: SummaryMode = SummaryMode.RECURSIVE,
+    ) -> str:
+        model = ",".join(model.value for model in self._get_models())
+        prompts = [self.SYSTEM_PROMPT, self.PROMPT, mode.value]
+        if mode == SummaryMode.MAP_REDUCE:
+            prompts += [
+                self.REDUCE_PROMPT,
+                str(self._chunk_token_limit),
+                str(self._chunk_overlap_tokens),
+            ]
+        else:
+            prompts += [self.RECURSIVE_PROMPT, str(self._allow_recursion)]
+        return make_cache_key(text, model, "\n".join(prompts), words_limit, temperature)
+
+    def _get_models(self) -> list[OpenAIChatModel]:
+        """Models the parts of a summary can be completed with."""
+        if self._router is not None:
+            return [spec.model for spec in self._router.get_specs()]
+        if self._allow_gpt4:
+            return [OpenAIChatModel.GPT_3_5, OpenAIChatModel.GPT_4]
+        return [OpenAIChatModel.GPT_3_5]
+
+    def _get_conversation(self) -> OpenAIConversation:
+        return OpenAIConversation(
+            system_prompt=self.SYSTEM_PROMPT,
+            checkpoints=self._checkpoints,
+            router=self._router,
+        )
+
     def _process_summary(self, summary: str, cut_from: str) -> str:
         subject_index = summary.find(cut_from)
         if subject_index != -1:
             summary = summary[subject_index:]
         return summary
 
+    def _get_prompt_overhead(self, prompt: str) -> int:
+        empty_prompt = prompt.format(
+            words_limit_text="", text="", previous_summary="", summaries=""
+        )
+        conversation = OpenAIConversation()
+        return conversation.get_text_token_length(self.SYSTEM_PROMPT + empty_prompt)
+
+    def _get_call_seconds(self, completion_tokens: int) -> float:
+        return (
+            self.SECONDS_PER_CALL
+            + completion_tokens / self.COMPLETION_TOKENS_PER_SECOND
+        )
+
+    def _estimate(
+        self, api_calls: int, prompt_tokens: int, completion_tokens: int, seconds: float
+    ) -> SummaryEstimate:
+        # Priced with the most expensive model that could be used, so the
+        # cost limits hold whichever model the router picks
+        if self._router is not None:
+            costs = [
+                spec.get_cost(prompt_tokens, completion_tokens)
+                for spec in self._router.get_specs()
+            ]
+        else:
+            costs = [
+                get_cost(model.value, prompt_tokens, completion_tokens)
+                for model in self._get_models()
+            ]
+        return SummaryEstimate(
+            api_calls=api_calls,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=max(costs),
+            seconds=seconds,
+        )
+
+    def _estimate_recursive(
+        self, token_count: int, final_tokens: int, summary_tokens: int
+    ) -> SummaryEstimate:
+        overhead = self._get_prompt_overhead(self.RECURSIVE_PROMPT)
+        limit = OpenAIConversation().get_limit(1000)
+        api_calls = prompt_tokens = completion_tokens = 0
+        remaining = token_count
+        while True:
+            # The summary so far is part of every prompt, leaving less room
+            part = min(remaining, max(limit - overhead - summary_tokens, limit // 4))
+            api_calls += 1
+            prompt_tokens += min(overhead + summary_tokens + part, limit)
+            completion_tokens += final_tokens
+            summary_tokens += final_tokens
+            remaining -= part
+            if remaining <= 0 or not self._allow_recursion:
+                break
+        seconds = api_calls * self._get_call_seconds(final_tokens)
+        return self._estimate(api_calls, prompt_tokens, completion_tokens, seconds)
+
+    def _estimate_map_reduce(
+        self, token_count: int, final_tokens: int
+    ) -> SummaryEstimate:
+        chunk_tokens = self._chunk_token_limit * self.CHUNK_FILL
+        chunk_count = ceil(token_count / (chunk_tokens - self._chunk_overlap_tokens))
+        if chunk_count <= 1:
+            prompt_tokens = self._get_prompt_overhead(self.PROMPT) + token_count
+            seconds = self._get_call_seconds(final_tokens)
+            return self._estimate(1, prompt_tokens, final_tokens, seconds)
+
+        part_tokens = self.PART_SUMMARY_TOKENS
+        part_seconds = self._get_call_seconds(part_tokens)
+        api_calls = chunk_count
+        prompt_tokens = token_count + chunk_count * (
+            self._get_prompt_overhead(self.PROMPT) + self._chunk_overlap_tokens
+        )
+        completion_tokens = chunk_count * part_tokens
+        seconds = ceil(chunk_count / self._max_concurrency) * part_seconds
+
+        reduce_overhead = self._get_prompt_overhead(self.REDUCE_PROMPT)
+        group_size = max(2, self._chunk_token_limit // part_tokens)
+        summaries = chunk_count
+        while summaries > group_size:
+            groups = ceil(summaries / group_size)
+            api_calls += groups
+            prompt_tokens += summaries * part_tokens + groups * reduce_overhead
+            completion_tokens += groups * part_tokens
+            seconds += ceil(groups / self._max_concurrency) * part_seconds
+            summaries = groups
+
+        api_calls += 1
+        prompt_tokens += summaries * part_tokens + reduce_overhead
+        completion_tokens += final_tokens
+        seconds += self._get_call_seconds(final_tokens)
+        return self._estimate(api_calls, prompt_tokens, completion_tokens, seconds)
+
+    def estimate_summary_from_tokens(
+        self,
+        token_count: int,
+        words_limit: Optional[int] = None,
+        mode: SummaryMode = SummaryMode.RECURSIVE,
+        previous_summary_tokens: int = 0,
+    ) -> SummaryEstimate:
+        """Predicts the API calls, tokens, cost and time to summarize a text."""
+        final_tokens = self.PART_SUMMARY_TOKENS
+        if words_limit is not None:
+            final_tokens = words_limit * 4 // 3
+        if mode == SummaryMode.MAP_REDUCE:
+            return self._estimate_map_reduce(token_count, final_tokens)
+        return self._estimate_recursive(
+            token_count, final_tokens, previous_summary_tokens
+        )
+
     def estimate_summary(
         self,
         text: str,
         words_limit: Optional[int] = None,
         previous_summary: Optional[str] = None,
-    ) -> int:
-        # TODO
-        pass
+        mode: SummaryMode = SummaryMode.RECURSIVE,
+    ) -> SummaryEstimate:
+        """Estimates a summary from samples of the text, without encoding all of it."""
+        conversation = OpenAIConversation()
+        token_count = conversation.estimate_text_token_length(text)
+        summary_tokens = 0
+        if previous_summary:
+            summary_tokens = conversation.get_text_token_length(previous_summary)
+        return self.estimate_summary_from_tokens(
+            token_count, words_limit, mode, summary_tokens
+        )
+
+    def _merge_summary(self, content: str, previous_summary: Optional[str]) -> str:
+        if previous_summary:
+            # Add the new part of summary to the previous one
+            new_content = self._process_summary(content, cut_from="-")
+            return previous_summary + "\n" + new_content
+        return self._process_summary(content, cut_from="Subject:")
 
     def generate_summary(
         self,
@@ -86,7 +318,7 @@ The next part of text is: {text}
         temperature: float = 0.7,
         previous_summary: Optional[str] = None,
     ) -> str:
-        conversation = OpenAIConversation(system_prompt=self.SYSTEM_PROMPT)
+        conversation = self._get_conversation()
         user_message = self._get_user_message(text, words_limit, previous_summary)
         response = conversation.get_completion(
             user_message=user_message,
@@ -95,13 +327,7 @@ The next part of text is: {text}
             allow_message_removal=True,
             allow_message_truncation=True,
         )
-
-        if previous_summary:
-            # Add the new part of summary to the previous one
-            new_content = self._process_summary(response.content, cut_from="-")
-            summary = previous_summary + "\n" + new_content
-        else:
-            summary = self._process_summary(response.content, cut_from="Subject:")
+        summary = self._merge_summary(response.content, previous_summary)
 
         cut_prompt = response.cut_prompt
         if cut_prompt and self._allow_recursion:
@@ -115,6 +341,308 @@ The next part of text is: {text}
             )
         return summary
 
+    async def agenerate_summary(
+        self,
+        text: str,
+        words_limit: Optional[int] = None,
+        temperature: float = 0.7,
+        previous_summary: Optional[str] = None,
+        mode: SummaryMode = SummaryMode.RECURSIVE,
+    ) -> str:
+        """Async version of generate_summary, safe to await from bot handlers.
+
+        In MAP_REDUCE mode the text is split into chunks that are summarized
+        concurrently and then merged, instead of one sequential call per chunk.
+        """
+        if mode == SummaryMode.MAP_REDUCE:
+            return await self._amap_reduce_summary(text, words_limit, temperature)
+
+        conversation = self._get_conversation()
+        user_message = self._get_user_message(text, words_limit, previous_summary)
+        response = await conversation.aget_completion(
+            user_message=user_message,
+            temperature=temperature,
+            allow_model_upgrade=self._allow_gpt4,
+            allow_message_removal=True,
+            allow_message_truncation=True,
+        )
+        summary = self._merge_summary(response.content, previous_summary)
+
+        cut_prompt = response.cut_prompt
+        if cut_prompt and self._allow_recursion:
+            logger.info("Recursively generating more key points")
+            return await self.agenerate_summary(
+                cut_prompt,
+                words_limit,
+                temperature,
+                previous_summary=summary,
+            )
+        return summary
+
+    def _split_text(self, text: str) -> list[str]:
+        tokenizer = OpenAIConversation()._get_tokenizer()
+        chunks = split_into_chunks(
+            text, tokenizer, self._chunk_token_limit, self._chunk_overlap_tokens
+        )
+        return [chunk.text for chunk in chunks]
+
+    async def _achunks(self, text: TextSource) -> AsyncIterator[str]:
+        """Yields token-bounded chunks, as soon as enough pages have arrived."""
+        if isinstance(text, str):
+            for chunk in await asyncio.to_thread(self._split_text, text):
+                yield chunk
+            return
+
+        conversation = OpenAIConversation()
+        pages: list[str] = []
+        pages_tokens = 0
+        async for page in text:
+            page_tokens = await conversation.aget_text_token_length(page)
+            if pages and pages_tokens + page_tokens > self._chunk_token_limit:
+                yield "\n\n".join(pages)
+                pages, pages_tokens = [], 0
+            if page_tokens > self._chunk_token_limit:
+                *page_chunks, last_chunk = split_into_chunks(
+                    page,
+                    conversation._get_tokenizer(),
+                    self._chunk_token_limit,
+                    self._chunk_overlap_tokens,
+                )
+                for chunk in page_chunks:
+                    yield chunk.text
+                page, page_tokens = last_chunk.text, last_chunk.token_count
+            pages.append(page)
+            pages_tokens += page_tokens
+        if pages:
+            yield "\n\n".join(pages)
+
+    def _group_summaries(self, summaries: list[str]) -> list[list[str]]:
+        """Groups consecutive summaries so each group fits in one reduce prompt.
+
+        Every group holds at least two summaries (except a trailing leftover), so
+        each reduce level at least halves the number of summaries.
+        """
+        conversation = OpenAIConversation()
+        groups: list[list[str]] = []
+        group: list[str] = []
+        group_tokens = 0
+        for summary in summaries:
+            summary_tokens = conversation.get_text_token_length(summary)
+            if (
+                len(group) >= 2
+                and group_tokens + summary_tokens > self._chunk_token_limit
+            ):
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(summary)
+            group_tokens += summary_tokens
+        groups.append(group)
+        return groups
+
+    async def _acomplete(
+        self,
+        user_message: str,
+        temperature: float,
+        semaphore: asyncio.Semaphore,
+    ) -> str:
+        conversation = self._get_conversation()
+        async with semaphore:
+            response = await conversation.aget_completion(
+                user_message=user_message,
+                temperature=temperature,
+                allow_model_upgrade=self._allow_gpt4,
+                allow_message_removal=True,
+                allow_message_truncation=True,
+            )
+        if response.cut_prompt:
+            logger.warning("Map-reduce chunk did not fit the prompt and was cut")
+        return self._process_summary(response.content, cut_from="Subject:")
+
+    async def _areduce_group(
+        self,
+        group: list[str],
+        words_limit: Optional[int],
+        temperature: float,
+        semaphore: asyncio.Semaphore,
+    ) -> str:
+        if len(group) == 1:
+            return group[0]
+        user_message = self._get_reduce_message(group, words_limit)
+        return await self._acomplete(user_message, temperature, semaphore)
+
+    async def _areduce_to_last_group(
+        self,
+        summaries: list[str],
+        temperature: float,
+        semaphore: asyncio.Semaphore,
+    ) -> list[str]:
+        """Reduces the summaries level by level until they fit in one group."""
+        groups = self._group_summaries(summaries)
+        while len(groups) > 1:
+            logger.info(
+                "Reducing %d summaries in %d groups", len(summaries), len(groups)
+            )
+            summaries = await asyncio.gather(
+                *[
+                    self._areduce_group(group, None, temperature, semaphore)
+                    for group in groups
+                ]
+            )
+            groups = self._group_summaries(summaries)
+        return groups[0]
+
+    async def _amap_summaries(
+        self,
+        chunks: list[str],
+        remaining_chunks: AsyncIterator[str],
+        temperature: float,
+        semaphore: asyncio.Semaphore,
+        tasks: list[asyncio.Task],
+    ) -> AsyncIterator[str]:
+        """Summarizes every chunk as soon as it is available, yielding progress.
+
+        The summary tasks are appended to tasks in the order of the chunks.
+        """
+
+        def start(chunk: str) -> None:
+            user_message = self._get_user_message(chunk)
+            tasks.append(
+                asyncio.ensure_future(
+                    self._acomplete(user_message, temperature, semaphore)
+                )
+            )
+
+        for chunk in chunks:
+            start(chunk)
+        async for chunk in remaining_chunks:
+            start(chunk)
+            done = sum(task.done() for task in tasks)
+            yield self.PROGRESS_TEXT.format(done=done, total=len(tasks))
+        logger.info("Map-reduce summary over %d chunks", len(tasks))
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            await task
+            yield self.PROGRESS_TEXT.format(done=done, total=len(tasks))
+
+    async def _amap_reduce_summary(
+        self,
+        text: TextSource,
+        words_limit: Optional[int],
+        temperature: float,
+    ) -> str:
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        chunks = self._achunks(text)
+        first_chunk = await anext(chunks, "")
+        second_chunk = await anext(chunks, None)
+        if second_chunk is None:
+            user_message = self._get_user_message(first_chunk, words_limit)
+            return await self._acomplete(user_message, temperature, semaphore)
+
+        tasks: list[asyncio.Task] = []
+        try:
+            async for _ in self._amap_summaries(
+                [first_chunk, second_chunk], chunks, temperature, semaphore, tasks
+            ):
+                pass
+        finally:
+            for task in tasks:
+                task.cancel()
+        summaries = [task.result() for task in tasks]
+        group = await self._areduce_to_last_group(summaries, temperature, semaphore)
+        return await self._areduce_group(group, words_limit, temperature, semaphore)
+
+    async def _astream_completion(
+        self,
+        user_message: str,
+        temperature: float,
+        previous_summary: Optional[str] = None,
+    ) -> AsyncIterator[tuple[str, str]]:
+        """Yields (summary so far, cut prompt) pairs while the completion streams."""
+        conversation = self._get_conversation()
+        stream = await conversation.astream_completion(
+            user_message=user_message,
+            temperature=temperature,
+            allow_model_upgrade=self._allow_gpt4,
+            allow_message_removal=True,
+            allow_message_truncation=True,
+        )
+        async for _ in stream:
+            yield self._merge_summary(
+                stream.content, previous_summary
+            ), stream.cut_prompt
+
+    async def _astream_recursive_summary(
+        self,
+        text: TextSource,
+        words_limit: Optional[int],
+        temperature: float,
+    ) -> AsyncIterator[str]:
+        if not isinstance(text, str):
+            text = "\n\n".join([page async for page in text])
+        summary = None
+        while True:
+            user_message = self._get_user_message(text, words_limit, summary)
+            previous_summary, cut_prompt = summary, ""
+            async for summary, cut_prompt in self._astream_completion(
+                user_message, temperature, previous_summary
+            ):
+                yield summary
+            if not (cut_prompt and self._allow_recursion):
+                return
+            logger.info("Recursively generating more key points")
+            text = cut_prompt
+
+    async def _astream_map_reduce_summary(
+        self,
+        text: TextSource,
+        words_limit: Optional[int],
+        temperature: float,
+    ) -> AsyncIterator[str]:
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        chunks = self._achunks(text)
+        first_chunk = await anext(chunks, "")
+        second_chunk = await anext(chunks, None)
+        if second_chunk is None:
+            user_message = self._get_user_message(first_chunk, words_limit)
+        else:
+            tasks: list[asyncio.Task] = []
+            try:
+                async for progress in self._amap_summaries(
+                    [first_chunk, second_chunk], chunks, temperature, semaphore, tasks
+                ):
+                    yield progress
+            finally:
+                for task in tasks:
+                    task.cancel()
+            summaries = [task.result() for task in tasks]
+            group = await self._areduce_to_last_group(summaries, temperature, semaphore)
+            if len(group) == 1:
+                yield group[0]
+                return
+            user_message = self._get_reduce_message(group, words_limit)
+
+        async for summary, _ in self._astream_completion(user_message, temperature):
+            yield summary
+
+    def astream_summary(
+        self,
+        text: TextSource,
+        words_limit: Optional[int] = None,
+        temperature: float = 0.7,
+        mode: SummaryMode = SummaryMode.RECURSIVE,
+    ) -> AsyncIterator[str]:
+        """Yields successive snapshots of the summary while it is generated.
+
+        The first content arrives after one round trip in RECURSIVE mode, while
+        MAP_REDUCE yields progress messages until the final merge starts.
+        The last snapshot is the complete summary.
+
+        The text can also be an async iterator of pages. In MAP_REDUCE mode the
+        first chunks are summarized while later pages are still being read.
+        """
+        if mode == SummaryMode.MAP_REDUCE:
+            return self._astream_map_reduce_summary(text, words_limit, temperature)
+        return self._astream_recursive_summary(text, words_limit, temperature)
+
 
 if __name__ == "__main__":
     from bot.utilities.token import get_bot_token
@@ -1,73 +1,224 @@
+import asyncio
+import os
+import tempfile
+import time
 from dataclasses import dataclass
 from functools import wraps
-from telegram import Update
-from telegram.ext import CallbackContext
+from typing import Callable, Iterable, Optional
 
 import toml
+from decouple import config
+from telegram import Update
+from telegram.ext import CallbackContext
 
 from bot.utilities.logging import get_logger
 
 logger = get_logger(__name__)
 
 ACCESS_FILE = "bot/config/access.toml"
+# Seconds between checks of the access file for changes
+RELOAD_INTERVAL = 5.0
+# Seconds to wait for more changes before writing them to the access file
+WRITE_DELAY = 1.0
+
+
+def normalize_user(user: str | int) -> str:
+    """Key of a user id or username, which Telegram compares case-insensitively."""
+    return str(user).strip().removeprefix("@").lower()
 
 
 @dataclass
+class AccessIndex:
+    admins: set[str]
+    whitelist: set[str]
+
+    @classmethod
+    def from_lists(cls, admins: Iterable, whitelist: Iterable) -> "AccessIndex":
+        return cls(
+            set(map(normalize_user, admins)), set(map(normalize_user, whitelist))
+        )
+
+
 class AccessManager:
-    admins: list[str]
-    whitelist: list[str]
+    """Admins and whitelisted users, by user id or username.
+
+    Users are kept in sets, so checks and changes take constant time.
+    Changes are written to the toml file in batches, write_delay seconds
+    after the first one, atomically. The file is reloaded into a new index
+    when it changes, checking it at most every reload_interval seconds,
+    unless there are changes still to be written.
+    """
+
+    def __init__(
+        self,
+        admins: Iterable[str] = (),
+        whitelist: Iterable[str] = (),
+        toml_file: Optional[str] = None,
+        reload_interval: float = RELOAD_INTERVAL,
+        write_delay: float = WRITE_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._index = AccessIndex.from_lists(admins, whitelist)
+        self._toml_file = toml_file
+        self._reload_interval = reload_interval
+        self._write_delay = write_delay
+        self._clock = clock
+        self._checked_at = clock()
+        self._file_version = self._get_file_version()
+        self._dirty = False
+        self._write_scheduled = False
+
+    @classmethod
+    def from_toml(cls, toml_file: str = ACCESS_FILE, **kwargs) -> "AccessManager":
+        return cls(**toml.load(toml_file), toml_file=toml_file, **kwargs)
+
+    @property
+    def admins(self) -> frozenset[str]:
+        """A copy of the admins, to be changed only through add_admin and the like."""
+        return frozenset(self._index.admins)
+
+    @property
+    def whitelist(self) -> frozenset[str]:
+        return frozenset(self._index.whitelist)
+
+    def _get_file_version(self) -> Optional[tuple[int, int]]:
+        if self._toml_file is None:
+            return None
+        try:
+            stat = os.stat(self._toml_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self) -> None:
+        """Reads the toml file again if it changed since it was last read."""
+        self._checked_at = self._clock()
+        version = self._get_file_version()
+        if self._dirty or version is None or version == self._file_version:
+            return
+        try:
+            lists = toml.load(self._toml_file)
+            self._index = AccessIndex.from_lists(lists["admins"], lists["whitelist"])
+        except (toml.TomlDecodeError, KeyError, OSError) as e:
+            logger.warning(f"Keeping the current access lists, error reloading: {e}")
+            return
+        finally:
+            self._file_version = version
+        logger.info(
+            f"Reloaded access lists, {len(self.admins)} admins and "
+            f"{len(self.whitelist)} whitelisted users"
+        )
 
-    def from_toml(toml_file: str = ACCESS_FILE) -> "AccessManager":
-        return AccessManager(**toml.load(toml_file))
+    def _get_index(self) -> AccessIndex:
+        if self._clock() - self._checked_at >= self._reload_interval:
+            self.reload()
+        return self._index
 
-    def is_admin(self, user_id: str) -> bool:
-        return str(user_id) in self.admins
+    def is_admin(self, *users: str | int) -> bool:
+        """Whether any of the user ids or usernames given is an admin."""
+        admins = self._get_index().admins
+        return any(normalize_user(user) in admins for user in users if user)
 
-    def is_whitelisted(self, user_id: str) -> bool:
-        return str(user_id) in self.whitelist
+    def is_whitelisted(self, *users: str | int) -> bool:
+        whitelist = self._get_index().whitelist
+        return any(normalize_user(user) in whitelist for user in users if user)
 
-    def is_allowed(self, user_id: str) -> bool:
-        return self.is_admin(user_id) or self.is_whitelisted(user_id)
+    def is_allowed(self, *users: str | int) -> bool:
+        return self.is_admin(*users) or self.is_whitelisted(*users)
+
+    def _changed(self) -> None:
+        self._dirty = True
+        self._schedule_write()
 
     def add_admin(self, user_id: str) -> None:
-        if not self.is_admin(user_id):
-            self.admins.append(str(user_id))
+        self._index.admins.add(normalize_user(user_id))
+        self._changed()
         logger.info(f"Added user {user_id} as admin")
 
     def add_whitelisted_user(self, user_id: str) -> None:
-        if not self.is_whitelisted(user_id):
-            self.whitelist.append(str(user_id))
+        self._index.whitelist.add(normalize_user(user_id))
+        self._changed()
         logger.info(f"Added user {user_id} to whitelist")
 
     def remove_admin(self, user_id: str) -> None:
-        if self.is_admin(user_id):
-            self.admins.remove(str(user_id))
+        self._index.admins.discard(normalize_user(user_id))
+        self._changed()
         logger.info(f"Removed user {user_id} as admin")
 
     def remove_whitelisted_user(self, user_id: str) -> None:
-        if self.is_whitelisted(user_id):
-            self.whitelist.remove(str(user_id))
+        self._index.whitelist.discard(normalize_user(user_id))
+        self._changed()
         logger.info(f"Removed user {user_id} from whitelist")
 
+    def _schedule_write(self) -> None:
+        if self._toml_file is None or self._write_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._write_scheduled = True
+        loop.call_later(self._write_delay, self.flush)
+
+    def flush(self) -> None:
+        """Writes the pending changes to the toml file."""
+        self._write_scheduled = False
+        if not self._dirty or self._toml_file is None:
+            return
+        self.to_toml(self._toml_file)
+        self._dirty = False
+        self._file_version = self._get_file_version()
+        logger.info(f"Saved access lists to {self._toml_file}")
+
     def to_toml(self, toml_file: str = ACCESS_FILE) -> None:
-        toml.dump(
-            {
-                "admins": self.admins,
-                "whitelist": self.whitelist,
-            },
-            open(toml_file, "w"),
+        """Writes the lists to a temporary file and moves it over toml_file."""
+        index = self._index
+        content = toml.dumps(
+            {"admins": sorted(index.admins), "whitelist": sorted(index.whitelist)}
         )
+        directory = os.path.dirname(os.path.abspath(toml_file))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=directory, suffix=".tmp", delete=False
+        ) as file:
+            file.write(content)
+        if os.path.exists(toml_file):
+            os.chmod(file.name, os.stat(toml_file).st_mode)
+        os.replace(file.name, toml_file)
+
+
+_access_manager: AccessManager | None = None
+
+
+def get_access_manager() -> AccessManager:
+    """The access lists shared by all the handlers, from ACCESS_FILE."""
+    global _access_manager
+    if _access_manager is None:
+        _access_manager = AccessManager.from_toml(
+            config("ACCESS_FILE", default=ACCESS_FILE)
+        )
+    return _access_manager
+
+
+def restricted(
+    access_manager: Optional[AccessManager] = None, only_admin: bool = False
+):
+    """Lets only allowed users, or only admins, run the decorated handler.
 
+    Without an access_manager, the one from get_access_manager is used, read
+    when the first update arrives rather than when the handler is defined.
+    """
 
-def restricted(access_manager: AccessManager, only_admin: bool = False):
     def decorator(func):
         @wraps(func)
         async def wrapped(update: Update, context: CallbackContext, *args, **kwargs):
-            username = str(update.effective_user.username)
+            manager = access_manager or get_access_manager()
+            user = update.effective_user
+            username = str(user.username)
             if only_admin:
-                has_access = access_manager.is_admin(username)
+                has_access = manager.is_admin(user.id, user.username)
             else:
-                has_access = access_manager.is_allowed(username)
+                has_access = manager.is_allowed(user.id, user.username)
             if not has_access:
                 logger.info(f"Unauthorized access denied for {username}.")
                 await update.message.reply_text(
@@ -0,0 +1,160 @@
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from enum import IntEnum
+from itertools import accumulate
+from typing import Protocol
+
+
+class Tokenizer(Protocol):
+    def encode(self, text: str) -> list:
+        ...
+
+
+class Boundary(IntEnum):
+    """How good a place to split the text is, the higher the better."""
+
+    WORD = 0
+    SENTENCE = 1
+    LINE = 2
+    PARAGRAPH = 3
+    SECTION = 4
+
+
+BOUNDARY_PATTERN = re.compile(
+    r"(?P<page>\f\s*)|(?P<paragraph>\n[ \t]*\n\s*)|(?P<line>\n)"
+    r"|(?P<sentence>(?<=[.!?])[ \t]+)"
+)
+HEADING_PATTERN = re.compile(r"#{1,6} ")
+BOUNDARY_TYPES = {
+    "page": Boundary.SECTION,
+    "paragraph": Boundary.PARAGRAPH,
+    "line": Boundary.LINE,
+    "sentence": Boundary.SENTENCE,
+}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    text: str
+    start: int
+    end: int
+    token_count: int
+
+
+@dataclass(frozen=True)
+class _Segment:
+    text: str
+    token_count: int
+    # Quality of the boundary right after the segment
+    boundary: Boundary
+
+
+def _split_segments(text: str) -> list[tuple[str, Boundary]]:
+    """Splits a text after every page, paragraph, line and sentence break.
+
+    The separators stay in the segments, so joining them gives back the text.
+    """
+    segments = []
+    start = 0
+    for match in BOUNDARY_PATTERN.finditer(text):
+        boundary = BOUNDARY_TYPES[match.lastgroup]
+        if boundary >= Boundary.LINE and HEADING_PATTERN.match(text, match.end()):
+            boundary = Boundary.SECTION
+        segments.append((text[start : match.end()], boundary))
+        start = match.end()
+    if start < len(text):
+        segments.append((text[start:], Boundary.SECTION))
+    return segments
+
+
+def _split_oversized(
+    text: str, token_count: int, max_tokens: int, tokenizer: Tokenizer
+) -> list[_Segment]:
+    """Splits a segment without breaks that is over the limit at spaces."""
+    segments = []
+    while token_count > max_tokens:
+        cut = len(text) * max_tokens // token_count
+        while True:
+            space = text.rfind(" ", 0, cut)
+            end = space + 1 if space > 0 else max(cut, 1)
+            piece_tokens = len(tokenizer.encode(text[:end]))
+            if piece_tokens <= max_tokens or end == 1:
+                break
+            cut = end * max_tokens // piece_tokens
+        segments.append(_Segment(text[:end], piece_tokens, Boundary.WORD))
+        text = text[end:]
+        token_count = len(tokenizer.encode(text))
+    segments.append(_Segment(text, token_count, Boundary.WORD))
+    return segments
+
+
+def _segment(text: str, tokenizer: Tokenizer, max_tokens: int) -> list[_Segment]:
+    segments = []
+    for segment_text, boundary in _split_segments(text):
+        token_count = len(tokenizer.encode(segment_text))
+        if token_count <= max_tokens:
+            segments.append(_Segment(segment_text, token_count, boundary))
+            continue
+        *pieces, last = _split_oversized(
+            segment_text, token_count, max_tokens, tokenizer
+        )
+        segments += pieces + [_Segment(last.text, last.token_count, boundary)]
+    return segments
+
+
+def split_into_chunks(
+    text: str,
+    tokenizer: Tokenizer,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    min_fill: float = 0.5,
+) -> list[Chunk]:
+    """Splits a text in chunks of at most max_tokens at the best boundaries.
+
+    The text is encoded once, split after its sentences, lines, paragraphs,
+    pages and before its markdown headings. Once a chunk is at least min_fill
+    full, it ends at the strongest boundary that still fits. Consecutive
+    chunks share up to overlap_tokens tokens of whole segments. The chunks
+    keep the offsets of their text, so nothing is lost or repeated between
+    them besides the overlap.
+    """
+    if max_tokens <= 0:
+        raise ValueError("max_tokens must be positive")
+    if overlap_tokens >= max_tokens * min_fill:
+        raise ValueError("overlap_tokens must be less than min_fill * max_tokens")
+
+    segments = _segment(text, tokenizer, max_tokens)
+    tokens = list(accumulate((s.token_count for s in segments), initial=0))
+    offsets = list(accumulate((len(s.text) for s in segments), initial=0))
+
+    chunks = []
+    first = 0
+    while first < len(segments):
+        # Segments first to last - 1 fill the chunk as much as possible
+        last = max(bisect_right(tokens, tokens[first] + max_tokens) - 1, first + 1)
+        if last < len(segments):
+            min_last = bisect_left(tokens, tokens[first] + max_tokens * min_fill)
+            candidates = range(max(min_last, first + 1), last + 1) or [last]
+            last = max(reversed(candidates), key=lambda i: segments[i - 1].boundary)
+        chunks.append(
+            Chunk(
+                text=text[offsets[first] : offsets[last]],
+                start=offsets[first],
+                end=offsets[last],
+                token_count=tokens[last] - tokens[first],
+            )
+        )
+        if last == len(segments):
+            break
+        # Step back over the segments to repeat, as long as the next segment
+        # still fits after them
+        next_first = last
+        while (
+            next_first > first + 1
+            and tokens[last] - tokens[next_first - 1] <= overlap_tokens
+            and tokens[last + 1] - tokens[next_first - 1] <= max_tokens
+        ):
+            next_first -= 1
+        first = next_first
+    return chunks
@@ -1,40 +1,214 @@
+import asyncio
 import os
-import requests
-from bs4 import BeautifulSoup
-
-
-def download_page_content(url):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
-    content = soup.get_text()
-    return content
-
-
-def download_site_content(url, download_dir):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
-    for link in soup.find_all("a"):
-        href = link.get("href")
-        if href.startswith("http"):
-            continue
-        page_url = url + href
-
-        print(f"Downloading {page_url}...")
-        content = download_page_content(page_url)
-        filename = href.replace("/", "_") + ".txt"
-        filepath = os.path.join(download_dir, filename)
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+from urllib.parse import urldefrag, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+from bot.utilities.http_session import close_http_session
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger
+from bot.utilities.web_fetcher import FetchError, fetch_url, html_to_text, soup_to_text
+from bot.utilities.worker_pool import get_worker_pool, shutdown_worker_pool
+
+logger = get_logger(__name__)
+bs4 = lazy_import("bs4")
+
+USER_AGENT = "ai-telegram-bot"
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_url(url: str, base_url: Optional[str] = None) -> Optional[str]:
+    """Resolves a link and normalizes it, so the same page has a single URL.
+
+    Returns None for links that are not http(s) pages.
+    """
+    if base_url is not None:
+        url = urljoin(base_url, url)
+    url, _ = urldefrag(url)
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if parts.port and parts.port != DEFAULT_PORTS[scheme]:
+        netloc += f":{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+def parse_page(html: str, url: str) -> tuple[str, list[str]]:
+    """Returns the text of a page and the normalized URLs it links to."""
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    links = []
+    for link in soup.find_all("a", href=True):
+        if (link_url := normalize_url(link["href"], url)) is not None:
+            links.append(link_url)
+    return soup_to_text(soup), links
+
+
+@dataclass
+class CrawledPage:
+    url: str
+    text: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    links: list[str] = field(default_factory=list)
+
+
+@dataclass
+class CrawlCorpus:
+    pages: dict[str, CrawledPage] = field(default_factory=dict)
+    unchanged_urls: set[str] = field(default_factory=set)
+
+    def get_page_texts(self) -> list[str]:
+        """Returns the text of every page, headed by its URL and sorted by it."""
+        return [f"{url}\n{self.pages[url].text}" for url in sorted(self.pages)]
+
+    async def aiter_page_texts(self) -> AsyncIterator[str]:
+        """Yields the page texts in a form Summarizer.astream_summary accepts."""
+        for text in self.get_page_texts():
+            yield text
+
+
+class SiteCrawler:
+    """Crawls the pages under a start URL with a bounded pool of workers.
+
+    Pages are visited once, up to max_depth links away from the start URL. When
+    a previous corpus is given, pages are requested with their ETag and
+    Last-Modified values and unchanged ones are reused without downloading.
+    """
+
+    def __init__(
+        self,
+        max_pages: int = 500,
+        max_depth: int = 5,
+        concurrency: int = 16,
+        per_host_concurrency: int = 8,
+        respect_robots: bool = True,
+    ) -> None:
+        self._max_pages = max_pages
+        self._max_depth = max_depth
+        self._concurrency = concurrency
+        self._per_host_concurrency = per_host_concurrency
+        self._respect_robots = respect_robots
+
+    def _is_in_scope(self, url: str, start_url: str) -> bool:
+        start, candidate = urlsplit(start_url), urlsplit(url)
+        start_path = start.path.rsplit("/", 1)[0] + "/"
+        return candidate.netloc == start.netloc and candidate.path.startswith(
+            start_path
+        )
+
+    async def _get_robots(self, start_url: str) -> Optional[RobotFileParser]:
+        if not self._respect_robots:
+            return None
+        robots_url = urljoin(start_url, "/robots.txt")
+        try:
+            content = await fetch_url(robots_url)
+        except FetchError:
+            return None
+        robots = RobotFileParser(robots_url)
+        robots.parse(content.decode().splitlines())
+        return robots
+
+    async def _crawl_page(
+        self, url: str, previous: Optional[CrawledPage]
+    ) -> Optional[CrawledPage]:
+        headers = {"User-Agent": USER_AGENT}
+        if previous is not None and previous.etag:
+            headers["If-None-Match"] = previous.etag
+        if previous is not None and previous.last_modified:
+            headers["If-Modified-Since"] = previous.last_modified
+        content = await fetch_url(url, headers=headers)
+        if content.not_modified and previous is not None:
+            return previous
+        if not content.is_html:
+            return None
+        text, links = await get_worker_pool().run(parse_page, content.decode(), url)
+        return CrawledPage(url, text, content.etag, content.last_modified, links)
+
+    async def crawl(
+        self, start_url: str, previous_corpus: Optional[CrawlCorpus] = None
+    ) -> CrawlCorpus:
+        start_url = normalize_url(start_url)
+        if start_url is None:
+            raise ValueError("The start URL must be an http(s) URL")
+        previous_pages = previous_corpus.pages if previous_corpus else {}
+        robots = await self._get_robots(start_url)
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self._per_host_concurrency))
+
+        corpus = CrawlCorpus()
+        queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+        visited = {start_url}
+        queue.put_nowait((start_url, 0))
+
+        def should_visit(link: str) -> bool:
+            return (
+                link not in visited
+                and len(visited) < self._max_pages
+                and self._is_in_scope(link, start_url)
+                and (robots is None or robots.can_fetch(USER_AGENT, link))
+            )
+
+        async def worker() -> None:
+            while True:
+                url, depth = await queue.get()
+                previous = previous_pages.get(url)
+                try:
+                    async with host_limits[urlsplit(url).netloc]:
+                        page = await self._crawl_page(url, previous)
+                except Exception as e:
+                    logger.warning(f"Skipping {url}: {e}")
+                    page = None
+                if page is not None:
+                    corpus.pages[url] = page
+                    if page is previous:
+                        corpus.unchanged_urls.add(url)
+                    for link in page.links if depth < self._max_depth else []:
+                        if should_visit(link):
+                            visited.add(link)
+                            queue.put_nowait((link, depth + 1))
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self._concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+        logger.info(
+            f"Crawled {len(corpus.pages)} pages from {start_url}, "
+            f"{len(corpus.unchanged_urls)} unchanged"
+        )
+        return corpus
+
+
+async def download_page_content(url: str) -> str:
+    content = await fetch_url(url)
+    return await get_worker_pool().run(html_to_text, content.decode())
+
+
+async def download_site_content(url: str, download_dir: str) -> CrawlCorpus:
+    corpus = await SiteCrawler().crawl(url)
+    for page in corpus.pages.values():
+        filename = urlsplit(page.url).path.strip("/").replace("/", "_") or "index"
+        filepath = os.path.join(download_dir, filename + ".txt")
         with open(filepath, "w") as f:
-            f.write(content)
+            f.write(page.text)
+    return corpus
 
 
-def main():
+async def main():
     url = "https://docs.aave.com/hub/"
     download_dir = "aave"
     os.makedirs(download_dir, exist_ok=True)
-    content = download_page_content(url)
-    with open(download_dir + "test.txt", "w") as f:
-        f.write(content)
+    try:
+        await download_site_content(url, download_dir)
+    finally:
+        await close_http_session()
+        shutdown_worker_pool()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import asyncio
+
+from decouple import config
+
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger
+
+aiohttp = lazy_import("aiohttp")
+
+logger = get_logger(__name__)
+
+MAX_CONNECTIONS = config("HTTP_MAX_CONNECTIONS", default=100, cast=int)
+MAX_CONNECTIONS_PER_HOST = config("HTTP_MAX_CONNECTIONS_PER_HOST", default=20, cast=int)
+DNS_CACHE_SECONDS = 300
+
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Returns the process-wide pooled HTTP session, creating it if needed.
+
+    Must be called from inside a running event loop. A session is bound to the
+    loop that created it, so a new one is built if the loop has changed.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=MAX_CONNECTIONS,
+            limit_per_host=MAX_CONNECTIONS_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_SECONDS,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+        logger.info("Created pooled HTTP session")
+    return _session
+
+
+async def close_http_session() -> None:
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Closed pooled HTTP session")
+    _session = None
+    _session_loop = None
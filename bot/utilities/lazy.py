@@ -0,0 +1,74 @@
+import importlib
+import sys
+import time
+from types import ModuleType
+from typing import Any, Callable, Optional
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class LazyModule(ModuleType):
+    """Stand-in for a module that is only imported when first used.
+
+    Reading or setting any attribute imports the module, runs on_import on
+    it and forwards the access to it, so heavy dependencies such as
+    openai or tiktoken add nothing to the start up time until they are needed.
+    """
+
+    def __init__(
+        self, name: str, on_import: Optional[Callable[[ModuleType], None]] = None
+    ) -> None:
+        super().__init__(name)
+        object.__setattr__(self, "_on_import", on_import)
+        object.__setattr__(self, "_module", None)
+
+    def _load(self) -> ModuleType:
+        module = self.__dict__["_module"]
+        if module is None:
+            # No lock of its own, which a forked worker could inherit held:
+            # the import is already thread safe and on_import may run twice
+            start = time.perf_counter()
+            module = importlib.import_module(self.__name__)
+            if self.__dict__["_on_import"] is not None:
+                self.__dict__["_on_import"](module)
+            object.__setattr__(self, "_module", module)
+            logger.debug(
+                f"Imported {self.__name__} in {time.perf_counter() - start:.3f}s"
+            )
+        return module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._load(), name, value)
+
+    def __dir__(self) -> list[str]:
+        return dir(self._load())
+
+
+def lazy_import(
+    name: str, on_import: Optional[Callable[[ModuleType], None]] = None
+) -> ModuleType:
+    """Returns name without importing it until one of its attributes is used.
+
+    If the module was already imported, it is returned as it is.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        if on_import is not None:
+            on_import(module)
+        return module
+    return LazyModule(name, on_import)
+
+
+def import_object(path: str) -> Any:
+    """Imports an object from a "package.module:attribute" path."""
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
@@ -1,10 +1,190 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
+from decouple import config
+
+# "text" for lines meant to be read, "json" for one object per line
+LOG_FORMAT = config("LOG_FORMAT", default="text")
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+# Level of the span records, set it above LOG_LEVEL to leave them out
+SPAN_LOG_LEVEL = config("SPAN_LOG_LEVEL", default="INFO")
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s"
+
+# Trace ID of the update being handled, copied into every record logged for it
+trace_id: ContextVar[str] = ContextVar("trace_id", default="-")
+
+# Attributes every record has, anything else was passed in extra
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(8)
+
+
+@contextmanager
+def traced(value: Optional[str] = None) -> Iterator[str]:
+    """Logs the records of the block, and the tasks it starts, under a trace ID."""
+    token = trace_id.set(value or new_trace_id())
+    try:
+        yield trace_id.get()
+    finally:
+        trace_id.reset(token)
+
+
+def get_extra_fields(record: logging.LogRecord) -> dict[str, Any]:
+    return {
+        name: value
+        for name, value in vars(record).items()
+        if name not in _RECORD_ATTRIBUTES and name != "trace_id"
+    }
+
+
+class TextFormatter(logging.Formatter):
+    """Formats records as TEXT_FORMAT lines, ending with the fields passed in extra."""
+
+    def __init__(self) -> None:
+        super().__init__(TEXT_FORMAT)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = " ".join(
+            f"{name}={value}" for name, value in get_extra_fields(record).items()
+        )
+        return f"{line} {fields}" if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON objects, with the fields passed in extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage(),
+        }
+        entry.update(get_extra_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TraceQueueHandler(logging.handlers.QueueHandler):
+    """Puts records in a queue for a listener thread to write them.
+
+    Only what depends on the calling context is resolved before queueing:
+    the message arguments, the exception and the trace ID. Formatting and
+    writing happen in the listener thread, so logging never blocks on the
+    output.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if not hasattr(record, "trace_id"):
+            record.trace_id = trace_id.get()
+        return record
+
+
+def get_formatter(log_format: str = LOG_FORMAT) -> logging.Formatter:
+    if log_format == "json":
+        return JsonFormatter()
+    return TextFormatter()
+
+
+_queue_handler: Optional[TraceQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_listener() -> None:
+    global _listener
+    _queue_handler.queue = queue.SimpleQueue()
+    output = logging.StreamHandler()
+    output.setFormatter(get_formatter())
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Writes the queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging() -> None:
+    """Sends the records of the root logger through the queue, only once.
+
+    Forked processes, like the workers, get a listener of their own, as the
+    thread of the parent is not copied.
+    """
+    global _queue_handler
+    if _queue_handler is not None:
+        return
+    _queue_handler = TraceQueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_queue_handler)
+    _start_listener()
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_start_listener)
+
+
+configure_logging()
 
 
 def get_logger(name):
     return logging.getLogger(name)
+
+
+_span_logger = logging.getLogger("bot.spans")
+_span_level = logging.getLevelName(SPAN_LOG_LEVEL)
+
+
+@contextmanager
+def span(name: str, **fields: Any) -> Iterator[dict[str, Any]]:
+    """Logs how long the block took as a span record of the current trace.
+
+    fields are added to the record, and so are the ones set in the yielded
+    dict during the block. Nothing is measured if spans are not logged.
+    """
+    if not _span_logger.isEnabledFor(_span_level):
+        yield fields
+        return
+    start = time.perf_counter()
+    status = "error"
+    try:
+        yield fields
+        status = "ok"
+    finally:
+        milliseconds = (time.perf_counter() - start) * 1000
+        _span_logger.log(
+            _span_level,
+            "%s took %.1f ms",
+            name,
+            milliseconds,
+            extra={
+                "span": name,
+                "duration_ms": round(milliseconds, 3),
+                "status": status,
+                **fields,
+            },
+        )
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from typing import Callable, Iterator, Optional
+
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger, span, traced
+
+logger = get_logger(__name__)
+web = lazy_import("aiohttp.web")
+# Imported when a cost is first needed, as the router records its metrics here
+model_router = lazy_import("bot.modules.model_router")
+
+# USD per 1000 tokens, as (prompt, completion), of the models missing from the
+# model table, whose prices take precedence
+MODEL_PRICES = {
+    "gpt-4-32k": (0.06, 0.12),
+}
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# The user and command a request is made for, set by the measured decorator
+request_labels: ContextVar[tuple[str, str]] = ContextVar(
+    "request_labels", default=("unknown", "unknown")
+)
+
+
+@lru_cache(maxsize=None)
+def _get_model_prices(toml_file: str) -> dict[str, tuple[float, float]]:
+    specs = model_router.load_model_specs(toml_file)
+    return MODEL_PRICES | {
+        spec.model.value: (spec.prompt_price, spec.completion_price) for spec in specs
+    }
+
+
+def get_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost in USD of a request, using the price of the closest known model."""
+    model_prices = _get_model_prices(model_router.MODELS_FILE)
+    names = [name for name in model_prices if model.startswith(name)]
+    prices = model_prices[max(names, key=len)] if names else (0.0, 0.0)
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    counts: list[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = self.counts or [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def get_quantile(self, quantile: float) -> Optional[float]:
+        """Upper bound of the bucket holding the quantile, inf past the last one."""
+        if self.count == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= quantile * self.count:
+                return bound
+        return float("inf")
+
+
+@dataclass
+class UsageTotals:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    requests: int = 0
+    cost: float = 0.0
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(str(value))}"' for name, value in labels.items())
+
+
+class Metrics:
+    """Token usage, cost, latency and model routing metrics.
+
+    Recording only appends an event to a deque, which is atomic and needs no
+    lock. Events are aggregated in batches when the metrics are read.
+    """
+
+    def __init__(self) -> None:
+        self._events: deque[tuple] = deque()
+        # Keyed by (user, model, command)
+        self._usage: defaultdict[tuple[str, str, str], UsageTotals] = defaultdict(
+            UsageTotals
+        )
+        self._api_latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        self._handler_latency: defaultdict[str, Histogram] = defaultdict(Histogram)
+        # Keyed by (model, reason)
+        self._routes: defaultdict[tuple[str, str], int] = defaultdict(int)
+
+    def record_usage(
+        self, model: str, prompt_tokens: int, completion_tokens: int
+    ) -> None:
+        user, command = request_labels.get()
+        self._events.append(
+            ("usage", (user, model, command), prompt_tokens, completion_tokens)
+        )
+
+    def observe_api_latency(self, model: str, seconds: float) -> None:
+        self._events.append(("api", model, seconds))
+
+    def observe_handler_latency(self, command: str, seconds: float) -> None:
+        self._events.append(("handler", command, seconds))
+
+    def record_route(self, model: str, reason: str) -> None:
+        self._events.append(("route", (model, reason)))
+
+    def _aggregate(self) -> None:
+        events = self._events
+        while events:
+            kind, key, *values = events.popleft()
+            if kind == "usage":
+                prompt_tokens, completion_tokens = values
+                totals = self._usage[key]
+                totals.prompt_tokens += prompt_tokens
+                totals.completion_tokens += completion_tokens
+                totals.requests += 1
+                totals.cost += get_cost(key[1], prompt_tokens, completion_tokens)
+            elif kind == "api":
+                self._api_latency[key].observe(values[0])
+            elif kind == "route":
+                self._routes[key] += 1
+            else:
+                self._handler_latency[key].observe(values[0])
+
+    def get_usage(self, group_by: int) -> dict[str, UsageTotals]:
+        """Usage totals grouped by user (0), model (1) or command (2)."""
+        self._aggregate()
+        grouped: defaultdict[str, UsageTotals] = defaultdict(UsageTotals)
+        for key, totals in self._usage.items():
+            group = grouped[key[group_by]]
+            group.prompt_tokens += totals.prompt_tokens
+            group.completion_tokens += totals.completion_tokens
+            group.requests += totals.requests
+            group.cost += totals.cost
+        return dict(grouped)
+
+    def get_api_latency(self) -> dict[str, Histogram]:
+        self._aggregate()
+        return dict(self._api_latency)
+
+    def get_handler_latency(self) -> dict[str, Histogram]:
+        self._aggregate()
+        return dict(self._handler_latency)
+
+    def get_routes(self) -> dict[tuple[str, str], int]:
+        """Route decisions by (model, reason)."""
+        self._aggregate()
+        return dict(self._routes)
+
+    def _render_histograms(
+        self, name: str, label: str, histograms: dict[str, Histogram]
+    ) -> list[str]:
+        lines = [f"# TYPE {name} histogram"]
+        for value, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                labels = _format_labels({label: value, "le": bound})
+                lines.append(f"{name}_bucket{{{labels}}} {cumulative}")
+            labels = _format_labels({label: value, "le": "+Inf"})
+            lines.append(f"{name}_bucket{{{labels}}} {histogram.count}")
+            labels = _format_labels({label: value})
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        self._aggregate()
+        lines = [
+            "# TYPE bot_openai_tokens_total counter",
+            "# TYPE bot_openai_requests_total counter",
+            "# TYPE bot_openai_cost_usd_total counter",
+        ]
+        for (user, model, command), totals in sorted(self._usage.items()):
+            labels = {"user": user, "model": model, "command": command}
+            for kind in ("prompt", "completion"):
+                tokens = getattr(totals, f"{kind}_tokens")
+                type_labels = _format_labels({**labels, "type": kind})
+                lines.append(f"bot_openai_tokens_total{{{type_labels}}} {tokens}")
+            labels = _format_labels(labels)
+            lines.append(f"bot_openai_requests_total{{{labels}}} {totals.requests}")
+            lines.append(f"bot_openai_cost_usd_total{{{labels}}} {totals.cost:.6f}")
+        lines.append("# TYPE bot_model_routes_total counter")
+        for (model, reason), count in sorted(self._routes.items()):
+            labels = _format_labels({"model": model, "reason": reason})
+            lines.append(f"bot_model_routes_total{{{labels}}} {count}")
+        lines += self._render_histograms(
+            "bot_openai_request_seconds", "model", self._api_latency
+        )
+        lines += self._render_histograms(
+            "bot_handler_seconds", "command", self._handler_latency
+        )
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def time_api_call(self, model: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_api_latency(model, time.perf_counter() - start)
+
+
+metrics = Metrics()
+
+
+def measured(command: str):
+    """Labels the requests of a handler with its user and command and times it.
+
+    Each update is handled under a trace ID of its own, and the handler is
+    logged as a span of it.
+    """
+
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapped(update, context, *args, **kwargs):
+            token = request_labels.set((str(update.effective_user.id), command))
+            start = time.perf_counter()
+            try:
+                with traced(), span("handler", command=command):
+                    return await func(update, context, *args, **kwargs)
+            finally:
+                metrics.observe_handler_latency(command, time.perf_counter() - start)
+                request_labels.reset(token)
+
+        return wrapped
+
+    return decorator
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serves the metrics on http://host:port/metrics until the runner is cleaned up."""
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,11 +1,117 @@
-import PyPDF2
+import asyncio
+import io
+import secrets
+from collections import OrderedDict, deque
 from pathlib import Path
+from typing import AsyncIterator
 
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import span
+from bot.utilities.worker_pool import WorkerPool, get_worker_pool
 
-def extract_text_from_pdf(pdf_path: Path):
-    with pdf_path.open("rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        pages_text = []
-        for page in reader.pages:
-            pages_text.append(page.extract_text())
+PyPDF2 = lazy_import("PyPDF2")
+
+PAGES_PER_TASK = 8
+# Parsed documents each worker keeps, so the batches of a document are
+# extracted without sending or parsing it again
+MAX_OPEN_DOCUMENTS = 2
+
+_open_documents: OrderedDict[str, "PyPDF2.PdfReader"] = OrderedDict()
+
+
+class DocumentNotOpenError(Exception):
+    """The worker does not have the document open, it has to be sent to it."""
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def extract_pages_from_pdf(pdf_bytes: bytes, start: int, stop: int) -> list[str]:
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def _get_document(key: str, pdf_bytes: bytes | None) -> "PyPDF2.PdfReader":
+    reader = _open_documents.get(key)
+    if reader is not None:
+        _open_documents.move_to_end(key)
+        return reader
+    if pdf_bytes is None:
+        raise DocumentNotOpenError(key)
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    _open_documents[key] = reader
+    while len(_open_documents) > MAX_OPEN_DOCUMENTS:
+        _open_documents.popitem(last=False)
+    return reader
+
+
+def open_pdf(key: str, pdf_bytes: bytes) -> int:
+    """Keeps the document open under key and returns its page count."""
+    return len(_get_document(key, pdf_bytes).pages)
+
+
+def extract_pages_from_open_pdf(
+    key: str, start: int, stop: int, pdf_bytes: bytes | None = None
+) -> list[str]:
+    """Extracts pages of the document open under key, opening it if needed."""
+    reader = _get_document(key, pdf_bytes)
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+
+def extract_text_from_pdf(pdf: Path | bytes) -> str:
+    pdf_bytes = pdf.read_bytes() if isinstance(pdf, Path) else pdf
+    pages_text = extract_pages_from_pdf(pdf_bytes, 0, count_pdf_pages(pdf_bytes))
     return "\n\n".join(pages_text)
+
+
+async def aiter_pdf_pages(
+    pdf_bytes: bytes,
+    pool: WorkerPool | None = None,
+    pages_per_task: int = PAGES_PER_TASK,
+) -> AsyncIterator[str]:
+    """Yields the text of each page in order, extracted in the worker pool.
+
+    Batches of pages are extracted in parallel, at most one per worker ahead
+    of the consumer, so the first pages can be consumed while the rest of
+    the document is still being parsed. The workers keep the document open,
+    it is only sent to a worker that does not have it yet.
+    """
+    pool = pool or get_worker_pool()
+    key = secrets.token_hex(8)
+    with span("extract", bytes=len(pdf_bytes)) as fields:
+        page_count = await pool.run(open_pdf, key, pdf_bytes)
+        fields["pages"] = page_count
+    starts = iter(range(0, page_count, pages_per_task))
+
+    async def extract(start: int, stop: int) -> list[str]:
+        with span("extract", start=start, stop=stop) as fields:
+            try:
+                return await pool.run(extract_pages_from_open_pdf, key, start, stop)
+            except DocumentNotOpenError:
+                fields["sent"] = True
+                return await pool.run(
+                    extract_pages_from_open_pdf, key, start, stop, pdf_bytes
+                )
+
+    def submit_next() -> asyncio.Future | None:
+        start = next(starts, None)
+        if start is None:
+            return None
+        stop = min(start + pages_per_task, page_count)
+        return asyncio.ensure_future(extract(start, stop))
+
+    batches = deque()
+    for _ in range(pool.processes):
+        if (batch := submit_next()) is not None:
+            batches.append(batch)
+    try:
+        while batches:
+            pages_text = await batches.popleft()
+            if (batch := submit_next()) is not None:
+                batches.append(batch)
+            for page_text in pages_text:
+                yield page_text
+    finally:
+        for batch in batches:
+            batch.cancel()
@@ -0,0 +1,95 @@
+import asyncio
+import time
+from typing import Callable
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Telegram allows roughly one edit per second in a chat and 20 per minute in
+# groups, so edits are spaced out to stay below both limits
+EDIT_INTERVAL_SECONDS = 3.0
+MAX_MESSAGE_LENGTH = 4096
+# Times the final version is sent when Telegram asks to retry it later
+FINISH_ATTEMPTS = 3
+
+
+def split_message(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Splits a text in Telegram sized parts, preferably at line breaks."""
+    parts = []
+    while len(text) > max_length:
+        split_at = text.rfind("\n", 0, max_length)
+        if split_at <= 0:
+            split_at = max_length
+        parts.append(text[:split_at])
+        text = text[split_at:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+
+class ProgressiveMessage:
+    """A Telegram message that is edited as new versions of its text arrive.
+
+    Intermediate versions are rate limited and may be skipped, also when
+    Telegram fails to edit them. The text passed to finish is always delivered
+    in full, or raises the error. Every version starts with prefix.
+    """
+
+    def __init__(
+        self,
+        message: Message,
+        edit_interval: float = EDIT_INTERVAL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        prefix: str = "",
+    ) -> None:
+        self._message = message
+        self._prefix = prefix
+        self._edit_interval = edit_interval
+        self._clock = clock
+        self._text = message.text
+        self._last_edit = clock()
+
+    async def _edit(self, text: str) -> None:
+        if text == self._text or not text.strip():
+            return
+        try:
+            await self._message.edit_text(text)
+        except BadRequest as e:
+            logger.warning(f"Could not edit progressive message: {e}")
+        self._text = text
+        self._last_edit = self._clock()
+
+    async def _edit_intermediate(self, text: str) -> None:
+        try:
+            await self._edit(text)
+        except RetryAfter as e:
+            # Flood control, the next version waits for it to end
+            logger.warning(f"Progressive message edits delayed {e.retry_after}s")
+            self._last_edit = self._clock() + e.retry_after
+        except TelegramError as e:
+            logger.warning(f"Skipped a version of a progressive message: {e}")
+
+    async def update(self, text: str) -> None:
+        if self._clock() - self._last_edit < self._edit_interval:
+            return
+        await self._edit_intermediate(split_message(self._prefix + text)[0])
+
+    async def show(self, text: str) -> None:
+        """Shows a status text right away, skipping the rate limit."""
+        await self._edit_intermediate(split_message(self._prefix + text)[0])
+
+    async def finish(self, text: str) -> None:
+        first_part, *other_parts = split_message(self._prefix + text)
+        for attempt in range(1, FINISH_ATTEMPTS + 1):
+            try:
+                await self._edit(first_part)
+                break
+            except RetryAfter as e:
+                if attempt == FINISH_ATTEMPTS:
+                    raise
+                await asyncio.sleep(e.retry_after)
+        for part in other_parts:
+            await self._message.reply_text(part)
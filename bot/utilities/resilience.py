@@ -0,0 +1,206 @@
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def get_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Exponential backoff with full jitter, never shorter than retry_after."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """Fails fast after repeated errors, letting a single probe through later.
+
+    The circuit opens after failure_threshold consecutive failures. Once
+    reset_timeout seconds have passed, one call is allowed through and its
+    outcome closes or reopens the circuit.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        if self._opened_at is None:
+            return True
+        if self._probing or self._clock() - self._opened_at < self._reset_timeout:
+            return False
+        self._probing = True
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def cancel_probe(self) -> None:
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._probing or self._failures >= self._failure_threshold:
+            if self._opened_at is None:
+                logger.warning("Circuit breaker opened after repeated failures")
+            self._opened_at = self._clock()
+        self._probing = False
+
+
+class LatencyTracker:
+    """Keeps the latest latencies to estimate percentiles."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._min_samples = min_samples
+
+    def record(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def get_percentile(self, percentile: float) -> Optional[float]:
+        """Returns the latency at the percentile, None until there are enough samples."""
+        if len(self._latencies) < self._min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+
+class ResilientCaller:
+    """Runs calls with retries, a circuit breaker and optional hedging.
+
+    Retryable errors are retried with exponential backoff, honouring the delay
+    returned by get_retry_after. When hedge_percentile is set, a call slower
+    than that latency percentile gets a duplicate and the first result wins.
+    """
+
+    def __init__(
+        self,
+        is_retryable: Callable[[Exception], bool],
+        get_retry_after: Callable[[Exception], Optional[float]] = lambda e: None,
+        policy: RetryPolicy = RetryPolicy(),
+        breaker: Optional[CircuitBreaker] = None,
+        hedge_percentile: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        self._is_retryable = is_retryable
+        self._get_retry_after = get_retry_after
+        self._policy = policy
+        self._breaker = breaker or CircuitBreaker(clock=clock)
+        self._hedge_percentile = hedge_percentile
+        self._latencies = LatencyTracker()
+        self._clock = clock
+        self._sleep = sleep
+
+    async def _timed(self, call: Callable[[], Awaitable[T]]) -> T:
+        start = self._clock()
+        result = await call()
+        self._latencies.record(self._clock() - start)
+        return result
+
+    async def _hedged(self, call: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        hedge_after = None
+        if hedge and self._hedge_percentile is not None:
+            hedge_after = self._latencies.get_percentile(self._hedge_percentile)
+        if hedge_after is None:
+            return await self._timed(call)
+
+        tasks = [asyncio.ensure_future(self._timed(call))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                logger.info(f"Call slower than {hedge_after:.2f}s, sending a hedge")
+                tasks.append(asyncio.ensure_future(self._timed(call)))
+            errors = []
+            for task in asyncio.as_completed(tasks):
+                try:
+                    return await task
+                except Exception as e:
+                    errors.append(e)
+            raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, call: Callable[[], Awaitable[T]], hedge: bool = True) -> T:
+        """Awaits call, retrying it. hedge=False disables hedging for this call."""
+        for attempt in range(self._policy.max_attempts):
+            if not self._breaker.allow():
+                raise CircuitOpenError("Too many recent failures, not calling the API")
+            try:
+                result = await self._hedged(call, hedge)
+            except asyncio.CancelledError:
+                self._breaker.cancel_probe()
+                raise
+            except Exception as e:
+                retryable = self._is_retryable(e)
+                if retryable:
+                    self._breaker.record_failure()
+                else:
+                    # The API answered, so the circuit does not need to open
+                    self._breaker.record_success()
+                if not retryable or attempt == self._policy.max_attempts - 1:
+                    raise
+                delay = self._policy.get_delay(attempt, self._get_retry_after(e))
+                logger.warning(f"Call failed with {e!r}, retrying in {delay:.1f}s")
+                await self._sleep(delay)
+            else:
+                self._breaker.record_success()
+                return result
+
+    def call_sync(self, call: Callable[[], T]) -> T:
+        """Blocking version of call, without hedging."""
+        for attempt in range(self._policy.max_attempts):
+            if not self._breaker.allow():
+                raise CircuitOpenError("Too many recent failures, not calling the API")
+            try:
+                result = call()
+            except Exception as e:
+                retryable = self._is_retryable(e)
+                if retryable:
+                    self._breaker.record_failure()
+                else:
+                    # The API answered, so the circuit does not need to open
+                    self._breaker.record_success()
+                if not retryable or attempt == self._policy.max_attempts - 1:
+                    raise
+                delay = self._policy.get_delay(attempt, self._get_retry_after(e))
+                logger.warning(f"Call failed with {e!r}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+            else:
+                self._breaker.record_success()
+                return result
@@ -0,0 +1,356 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from typing import Awaitable, Callable, Iterator, Optional
+
+from decouple import config
+from telegram.ext import ConversationHandler
+
+from bot.utilities.logging import get_logger
+from bot.utilities.single_flight import SingleFlight
+
+logger = get_logger(__name__)
+
+SHARED_STATE_URL = config("SHARED_STATE_URL", default="memory://")
+
+
+class SharedState(ABC):
+    """String key-value state shared by the replicas of the bot.
+
+    Keys may expire after a ttl in seconds. add and the value checks of touch
+    and delete are atomic, so they can be used for locks and claims.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Sets the key only if it is missing or expired, returns if it was set."""
+
+    @abstractmethod
+    def touch(self, key: str, value: str, ttl: float) -> bool:
+        """Extends the ttl of the key if it still holds value."""
+
+    @abstractmethod
+    def delete(self, key: str, value: Optional[str] = None) -> bool:
+        """Deletes the key, only if it holds value when one is given."""
+
+    @abstractmethod
+    def keys(self, prefix: str) -> list[str]:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class MemorySharedState(SharedState):
+    """State of a single process, for running one replica and for tests."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        # Key to (value, expiration time or None)
+        self._entries: dict[str, tuple[str, Optional[float]]] = {}
+
+    def _get_entry(self, key: str) -> Optional[tuple[str, Optional[float]]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self._clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        return None if ttl is None else self._clock() + ttl
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._get_entry(key)
+        return None if entry is None else entry[0]
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (value, self._expires_at(ttl))
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        if self._get_entry(key) is not None:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def touch(self, key: str, value: str, ttl: float) -> bool:
+        if self.get(key) != value:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key: str, value: Optional[str] = None) -> bool:
+        entry = self._get_entry(key)
+        if entry is None or (value is not None and entry[0] != value):
+            return False
+        del self._entries[key]
+        return True
+
+    def keys(self, prefix: str) -> list[str]:
+        return [
+            key
+            for key in list(self._entries)
+            if key.startswith(prefix) and self._get_entry(key) is not None
+        ]
+
+
+class SqliteSharedState(SharedState):
+    """State in a sqlite file, shared by the replicas running on one host.
+
+    Every operation is a single statement, which sqlite runs atomically even
+    with several processes using the file. Expired keys are deleted on open
+    and whenever a key is set.
+    """
+
+    def __init__(self, db_path: str, clock: Callable[[], float] = time.time) -> None:
+        self._clock = clock
+        self._db = sqlite3.connect(
+            db_path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)"
+        )
+        self._delete_expired()
+
+    def _delete_expired(self) -> None:
+        self._db.execute("DELETE FROM state WHERE expires_at <= ?", (self._clock(),))
+
+    def _expires_at(self, ttl: Optional[float]) -> Optional[float]:
+        return None if ttl is None else self._clock() + ttl
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT value FROM state WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (key, self._clock()),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        self._delete_expired()
+        self._db.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+            (key, value, self._expires_at(ttl)),
+        )
+
+    def add(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        # Replaces the row only if it expired, otherwise nothing is changed
+        cursor = self._db.execute(
+            "INSERT INTO state VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+            "value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE state.expires_at <= ?",
+            (key, value, self._expires_at(ttl), self._clock()),
+        )
+        return cursor.rowcount == 1
+
+    def touch(self, key: str, value: str, ttl: float) -> bool:
+        now = self._clock()
+        cursor = self._db.execute(
+            "UPDATE state SET expires_at = ? WHERE key = ? AND value = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (now + ttl, key, value, now),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, key: str, value: Optional[str] = None) -> bool:
+        cursor = self._db.execute(
+            "DELETE FROM state WHERE key = ? AND (? IS NULL OR value = ?) "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (key, value, value, self._clock()),
+        )
+        return cursor.rowcount == 1
+
+    def keys(self, prefix: str) -> list[str]:
+        rows = self._db.execute(
+            "SELECT key FROM state WHERE substr(key, 1, ?) = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (len(prefix), prefix, self._clock()),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def get_shared_state(url: str = SHARED_STATE_URL) -> SharedState:
+    """Opens the state at memory:// or at a sqlite:///path/to/file.db."""
+    if url == "memory://":
+        return MemorySharedState()
+    if url.startswith("sqlite:///"):
+        return SqliteSharedState(url.removeprefix("sqlite:///"))
+    raise ValueError(f"Unsupported shared state URL: {url}")
+
+
+def get_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedConversations(MutableMapping):
+    """States of the conversations of a ConversationHandler in shared state.
+
+    The handler looks its conversations up on every update, so any replica
+    can handle the next message of a conversation started in another one.
+    Only plain states are supported, the handlers must block. Conversations
+    expire after ttl seconds without a new state.
+    """
+
+    def __init__(
+        self, state: SharedState, name: str, ttl: Optional[float] = None
+    ) -> None:
+        self._state = state
+        self._prefix = f"conversation:{name}:"
+        self._ttl = ttl
+
+    def _to_key(self, key: tuple) -> str:
+        return self._prefix + json.dumps(key)
+
+    def __getitem__(self, key: tuple) -> object:
+        value = self._state.get(self._to_key(key))
+        if value is None:
+            raise KeyError(key)
+        return json.loads(value)
+
+    def __setitem__(self, key: tuple, value: object) -> None:
+        self._state.set(self._to_key(key), json.dumps(value), self._ttl)
+
+    def __delitem__(self, key: tuple) -> None:
+        if not self._state.delete(self._to_key(key)):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[tuple]:
+        for key in self._state.keys(self._prefix):
+            yield tuple(json.loads(key.removeprefix(self._prefix)))
+
+    def __len__(self) -> int:
+        return len(self._state.keys(self._prefix))
+
+
+class SharedConversationHandler(ConversationHandler):
+    """ConversationHandler keeping its conversations in a shared state.
+
+    ConversationHandler has no public hook for where its conversations live,
+    so its internal dict is replaced. Conversations expire from the state
+    some time after conversation_timeout. The timeout callbacks only run if
+    the conversation was not ended by another replica in the meantime.
+    """
+
+    def __init__(self, *args, state: SharedState, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.name is None:
+            raise ValueError("Shared conversation handlers must have a name")
+        ttl = self.conversation_timeout
+        if hasattr(ttl, "total_seconds"):
+            ttl = ttl.total_seconds()
+        ttl = None if ttl is None else 2 * ttl
+        self._conversations = SharedConversations(state, self.name, ttl)
+
+    async def _trigger_timeout(self, context) -> None:
+        key = context.job.data.conversation_key
+        if key not in self._conversations:
+            async with self._timeout_jobs_lock:
+                if self.timeout_jobs.get(key) is context.job:
+                    del self.timeout_jobs[key]
+            return
+        await super()._trigger_timeout(context)
+
+
+class SharedTasks:
+    """Runs each keyed task once at a time across all the replicas.
+
+    The first caller of a key claims it for lease_seconds, renewing the lease
+    while the task runs, and publishes the result for result_ttl seconds.
+    Other callers, in this or other replicas, wait for that result instead of
+    running the task again. If the owner fails or dies, its claim is released
+    or expires and a waiting caller takes the task over.
+
+    Callers in the same replica as the owner wait for it directly, without
+    polling, and get its exception if it fails.
+    """
+
+    def __init__(
+        self,
+        state: SharedState,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = 60,
+        result_ttl: float = 600,
+        poll_seconds: float = 0.5,
+    ) -> None:
+        self._state = state
+        self._worker_id = worker_id or get_worker_id()
+        self._lease_seconds = lease_seconds
+        self._result_ttl = result_ttl
+        self._poll_seconds = poll_seconds
+        self._local = SingleFlight()
+
+    async def _renew_lease(self, claim_key: str) -> None:
+        while True:
+            await asyncio.sleep(self._lease_seconds / 3)
+            if not self._state.touch(claim_key, self._worker_id, self._lease_seconds):
+                logger.warning(f"Lost the claim of {claim_key}")
+                return
+
+    async def _run_claimed(self, key: str, task: Callable[[], Awaitable[str]]) -> str:
+        claim_key = f"claim:{key}"
+        renewal = asyncio.create_task(self._renew_lease(claim_key))
+        try:
+            result = await task()
+            self._state.set(f"result:{key}", result, self._result_ttl)
+            return result
+        finally:
+            renewal.cancel()
+            self._state.delete(claim_key, self._worker_id)
+
+    async def run(
+        self,
+        key: str,
+        task: Callable[[], Awaitable[str]],
+        on_wait: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> str:
+        """Returns the result of the task for the key, running it if needed.
+
+        on_wait is awaited once if the task is already running elsewhere.
+        """
+        return await self._local.run(
+            key, lambda: self._run_shared(key, task, on_wait), on_wait
+        )
+
+    async def _run_shared(
+        self,
+        key: str,
+        task: Callable[[], Awaitable[str]],
+        on_wait: Optional[Callable[[], Awaitable[None]]],
+    ) -> str:
+        waiting = False
+        while True:
+            if (result := self._state.get(f"result:{key}")) is not None:
+                return result
+            if self._state.add(f"claim:{key}", self._worker_id, self._lease_seconds):
+                # The owner may have published the result and released the
+                # claim right after it was checked
+                if (result := self._state.get(f"result:{key}")) is not None:
+                    self._state.delete(f"claim:{key}", self._worker_id)
+                    return result
+                return await self._run_claimed(key, task)
+            if not waiting:
+                waiting = True
+                logger.info(f"Waiting for task {key} claimed by another worker")
+                if on_wait is not None:
+                    await on_wait()
+            await asyncio.sleep(self._poll_seconds)
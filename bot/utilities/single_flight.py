@@ -0,0 +1,64 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, Optional, TypeVar
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs one call at a time per key within the process.
+
+    Callers of a key that is already running wait for that call and get its
+    result, or its exception, instead of running their own. A caller that is
+    cancelled only stops waiting. If the running call is cancelled, one of
+    its waiters runs the call again.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def run(
+        self,
+        key: Hashable,
+        function: Callable[[], Awaitable[T]],
+        on_wait: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> T:
+        """Returns the result of function, or of the call already running for key.
+
+        on_wait is awaited once if there is a call to wait for.
+        """
+        waiting = False
+        while (call := self._calls.get(key)) is not None:
+            if not waiting:
+                waiting = True
+                logger.info(f"Waiting for the running call of {key}")
+                if on_wait is not None:
+                    await on_wait()
+            try:
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if not call.cancelled() or asyncio.current_task().cancelling():
+                    raise
+        call = asyncio.get_running_loop().create_future()
+        self._calls[key] = call
+        try:
+            result = await function()
+        except Exception as e:
+            call.set_exception(e)
+            # Marks the exception as retrieved, there may be no waiters
+            call.exception()
+            raise
+        except BaseException:
+            call.cancel()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
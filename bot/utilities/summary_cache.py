@@ -0,0 +1,156 @@
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def make_cache_key(
+    text: str,
+    model: str,
+    prompt: str,
+    words_limit: Optional[int],
+    temperature: float,
+) -> str:
+    """Content-addressed key for a summary of text with the given parameters."""
+    digest = hashlib.sha256()
+    for part in (model, prompt, str(words_limit), repr(temperature)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    digest.update(normalize_text(text).encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    memory_hits: int = 0
+    disk_hits: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class SummaryCache:
+    """Two tier summary cache: an in-memory LRU and an optional sqlite file.
+
+    Entries expire after ttl_seconds in both tiers. Each tier keeps at most its
+    configured number of entries, evicting the least recently used ones.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 10000,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._max_disk_entries = max_disk_entries
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "key TEXT PRIMARY KEY, summary TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        self.stats = CacheStats()
+
+    def _get_from_memory(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, summary = entry
+        if now - created_at > self._ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return summary
+
+    def _set_in_memory(self, key: str, summary: str, created_at: float) -> None:
+        self._entries[key] = (created_at, summary)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_from_disk(self, key: str, now: float) -> Optional[tuple[float, str]]:
+        row = self._db.execute(
+            "SELECT created_at, summary FROM summaries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[0] > self._ttl_seconds:
+            self._db.execute("DELETE FROM summaries WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute(
+            "UPDATE summaries SET accessed_at = ? WHERE key = ?", (now, key)
+        )
+        self._db.commit()
+        return row[0], row[1]
+
+    def _set_on_disk(self, key: str, summary: str, now: float) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)",
+            (key, summary, now, now),
+        )
+        self._db.execute(
+            "DELETE FROM summaries WHERE created_at < ?", (now - self._ttl_seconds,)
+        )
+        self._db.execute(
+            "DELETE FROM summaries WHERE key NOT IN ("
+            "SELECT key FROM summaries ORDER BY accessed_at DESC LIMIT ?)",
+            (self._max_disk_entries,),
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = self._clock()
+        summary = self._get_from_memory(key, now)
+        if summary is not None:
+            self.stats.hits += 1
+            self.stats.memory_hits += 1
+            return summary
+
+        if self._db is not None:
+            entry = self._get_from_disk(key, now)
+            if entry is not None:
+                created_at, summary = entry
+                self._set_in_memory(key, summary, created_at)
+                self.stats.hits += 1
+                self.stats.disk_hits += 1
+                return summary
+
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, summary: str) -> None:
+        now = self._clock()
+        self._set_in_memory(key, summary, now)
+        if self._db is not None:
+            self._set_on_disk(key, summary, now)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import socket
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+from urllib.parse import urljoin, urlsplit
+
+from decouple import config
+
+from bot.utilities.http_session import get_http_session
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger
+from bot.utilities.worker_pool import get_worker_pool
+
+logger = get_logger(__name__)
+aiohttp = lazy_import("aiohttp")
+bs4 = lazy_import("bs4")
+
+MAX_DOWNLOAD_BYTES = config("URL_MAX_DOWNLOAD_BYTES", default=20_000_000, cast=int)
+FETCH_TIMEOUT_SECONDS = config("URL_FETCH_TIMEOUT_SECONDS", default=30, cast=int)
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Networks that may be fetched even if they are not public, comma separated,
+# like an intranet the bot is meant to read. Loopback, private, link-local and
+# reserved addresses are refused otherwise.
+ALLOWED_NETWORKS = config(
+    "URL_ALLOWED_NETWORKS",
+    default="",
+    cast=lambda value: tuple(
+        ipaddress.ip_network(network.strip())
+        for network in value.split(",")
+        if network.strip()
+    ),
+)
+IGNORED_HTML_TAGS = ["script", "style", "noscript", "nav", "header", "footer"]
+
+
+class FetchError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class FetchedContent:
+    url: str
+    content_type: str
+    charset: str | None
+    body: bytes
+    status: int = 200
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.content_type == "application/pdf" or self.body.startswith(b"%PDF")
+
+    @property
+    def is_html(self) -> bool:
+        return self.content_type in ("text/html", "application/xhtml+xml")
+
+    @property
+    def is_text(self) -> bool:
+        return self.content_type.startswith("text/")
+
+    def decode(self) -> str:
+        return self.body.decode(self.charset or "utf-8", errors="replace")
+
+
+def is_public_address(address: str, allowed_networks: Sequence[Network] = ()) -> bool:
+    """Whether an IP address is on the internet, or in one of allowed_networks."""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if any(ip in network for network in allowed_networks):
+        return True
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    # Also refuses loopback, private, link-local (cloud metadata) and reserved
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_url(url: str, allowed_networks: Sequence[Network]) -> None:
+    """Raises FetchError unless url is http(s) and all its host addresses are public."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise FetchError(f"Unsupported URL scheme: {url}")
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, parts.port, type=socket.SOCK_STREAM
+        )
+    except (socket.gaierror, UnicodeError, ValueError) as e:
+        raise FetchError(f"Could not resolve {parts.hostname}: {e}") from e
+    for *_, sockaddr in addresses:
+        if not is_public_address(sockaddr[0], allowed_networks):
+            raise FetchError(f"Refusing to fetch a private address: {url}")
+
+
+def _check_peer(
+    response: aiohttp.ClientResponse, allowed_networks: Sequence[Network]
+) -> None:
+    # The host may resolve to another address when it is connected to
+    transport = response.connection and response.connection.transport
+    peer = transport and transport.get_extra_info("peername")
+    if peer and not is_public_address(peer[0], allowed_networks):
+        raise FetchError(f"Refusing to fetch a private address: {response.url}")
+
+
+async def fetch_url(
+    url: str,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+    timeout: float = FETCH_TIMEOUT_SECONDS,
+    headers: dict[str, str] | None = None,
+    allowed_networks: Optional[Sequence[Network]] = None,
+) -> FetchedContent:
+    """Downloads a URL through the shared session, streaming it in chunks.
+
+    Raises FetchError if the download fails, takes longer than timeout seconds
+    or is larger than max_bytes. A 304 answer to conditional headers is
+    returned with an empty body.
+
+    URLs whose host is not public are refused, unless it is in
+    allowed_networks, ALLOWED_NETWORKS by default. Redirects are followed
+    one by one, checking each of them, and so is the address connected to.
+    """
+    if allowed_networks is None:
+        allowed_networks = ALLOWED_NETWORKS
+    try:
+        return await asyncio.wait_for(
+            _fetch_url(url, max_bytes, headers, allowed_networks), timeout
+        )
+    except asyncio.TimeoutError as e:
+        raise FetchError(f"Download took longer than {timeout} seconds") from e
+
+
+async def _fetch_url(
+    url: str,
+    max_bytes: int,
+    headers: dict[str, str] | None,
+    allowed_networks: Sequence[Network],
+) -> FetchedContent:
+    session = get_http_session()
+    for _ in range(MAX_REDIRECTS + 1):
+        await check_url(url, allowed_networks)
+        try:
+            async with session.get(
+                url, headers=headers, allow_redirects=False
+            ) as response:
+                _check_peer(response, allowed_networks)
+                location = response.headers.get("Location")
+                if response.status in REDIRECT_STATUSES and location:
+                    url = urljoin(str(response.url), location)
+                    continue
+                return await _read_response(response, url, max_bytes)
+        except aiohttp.ClientError as e:
+            raise FetchError(f"Error downloading {url}: {e}") from e
+    raise FetchError(f"Too many redirects, more than {MAX_REDIRECTS}")
+
+
+async def _read_response(
+    response: aiohttp.ClientResponse, url: str, max_bytes: int
+) -> FetchedContent:
+    if response.status >= 400:
+        raise FetchError(f"Server responded with status {response.status}")
+    if response.content_length and response.content_length > max_bytes:
+        raise FetchError(f"Content is larger than {max_bytes} bytes")
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            raise FetchError(f"Content is larger than {max_bytes} bytes")
+    logger.info(f"Downloaded {len(body)} bytes from {url}")
+    return FetchedContent(
+        url=str(response.url),
+        content_type=response.content_type,
+        charset=response.charset,
+        body=bytes(body),
+        status=response.status,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+
+
+def html_to_text(html: str) -> str:
+    return soup_to_text(bs4.BeautifulSoup(html, "html.parser"))
+
+
+def soup_to_text(soup: bs4.BeautifulSoup) -> str:
+    """Returns the visible text of a parsed page, removing its boilerplate tags."""
+    for tag in soup(IGNORED_HTML_TAGS):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+async def aextract_text(content: FetchedContent) -> str:
+    """Extracts the text of an HTML or plain text download in the worker pool."""
+    if content.is_html:
+        return await get_worker_pool().run(html_to_text, content.decode())
+    if content.is_text:
+        return content.decode()
+    raise FetchError(f"Unsupported content type: {content.content_type}")
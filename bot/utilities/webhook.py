@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import re
+import signal
+from dataclasses import dataclass
+
+from decouple import config
+from telegram import Update
+from telegram.ext import Application
+
+from bot.utilities.lazy import lazy_import
+from bot.utilities.logging import get_logger
+
+logger = get_logger(__name__)
+web = lazy_import("aiohttp.web")
+
+BOT_MODES = ("polling", "webhook")
+MODE_VAR = "BOT_MODE"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+SECRET_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,256}")
+
+
+@dataclass(frozen=True)
+class WebhookConfig:
+    url: str
+    secret_token: str
+    host: str = "0.0.0.0"
+    port: int = 8080
+    path: str = "/telegram"
+
+
+def get_bot_mode() -> str:
+    mode = config(MODE_VAR, default="polling")
+    if mode not in BOT_MODES:
+        raise ValueError(f"Invalid bot mode defined by {MODE_VAR}: {mode}")
+    return mode
+
+
+def get_webhook_config() -> WebhookConfig:
+    url = config("WEBHOOK_URL", default=None)
+    if not url:
+        raise ValueError("WEBHOOK_URL must be set to run the bot in webhook mode")
+    secret_token = config("WEBHOOK_SECRET_TOKEN", default="")
+    if not SECRET_PATTERN.fullmatch(secret_token):
+        raise ValueError(
+            "WEBHOOK_SECRET_TOKEN must be 1-256 letters, digits, _ or - characters"
+        )
+    return WebhookConfig(
+        url=url,
+        secret_token=secret_token,
+        host=config("WEBHOOK_HOST", default="0.0.0.0"),
+        port=config("WEBHOOK_PORT", default=8080, cast=int),
+        path=config("WEBHOOK_PATH", default="/telegram"),
+    )
+
+
+class WebhookServer:
+    """Receives updates from Telegram over HTTP and queues them in the app.
+
+    Besides the webhook path, it serves /healthz, which answers while the
+    process is up, and /readyz, which answers while updates are accepted.
+    Once draining, new updates are refused with a 503 so Telegram retries
+    them, possibly on another replica, while the queued ones finish.
+    """
+
+    def __init__(self, app: Application, webhook_config: WebhookConfig) -> None:
+        self._app = app
+        self._config = webhook_config
+        self._draining = False
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._app.running and not self._draining
+
+    def drain(self) -> None:
+        logger.info("Draining webhook, new updates will be refused")
+        self._draining = True
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        secret_token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret_token, self._config.secret_token):
+            logger.warning("Refused webhook request with an invalid secret token")
+            return web.Response(status=403)
+        if not self.is_ready:
+            return web.Response(status=503)
+        try:
+            update = Update.de_json(await request.json(), self._app.bot)
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        await self._app.update_queue.put(update)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def _handle_ready(self, request: web.Request) -> web.Response:
+        if self.is_ready:
+            return web.Response(text="ready")
+        return web.Response(status=503, text="not ready")
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self._config.path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+        app.router.add_get("/readyz", self._handle_ready)
+        return app
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._config.host, self._config.port)
+        await site.start()
+        logger.info(
+            f"Listening for updates on {self._config.host}:{self._config.port}"
+            f"{self._config.path}"
+        )
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def serve_webhook(app: Application, webhook_config: WebhookConfig) -> None:
+    """Runs the app with a webhook until SIGINT or SIGTERM, then drains it.
+
+    The webhook is registered on start but not deleted on exit, as other
+    replicas may still be serving it.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+
+    server = WebhookServer(app, webhook_config)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.bot.set_webhook(
+        url=webhook_config.url.rstrip("/") + webhook_config.path,
+        secret_token=webhook_config.secret_token,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    await app.start()
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        server.drain()
+        # Stopping the app waits for the updates being processed to finish
+        await app.stop()
+        await server.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
@@ -0,0 +1,286 @@
+import asyncio
+import multiprocessing
+import resource
+from collections import deque
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Optional
+
+from decouple import config
+
+from bot.utilities.logging import get_logger, stop_logging, trace_id
+
+logger = get_logger(__name__)
+
+WORKER_PROCESSES = config("WORKER_PROCESSES", default=2, cast=int)
+WORKER_MAX_QUEUED = config("WORKER_MAX_QUEUED", default=32, cast=int)
+WORKER_TASK_TIMEOUT = config("WORKER_TASK_TIMEOUT", default=60, cast=float)
+# Memory a task can map on top of what its worker already maps when it starts
+WORKER_MAX_MEMORY_MB = config("WORKER_MAX_MEMORY_MB", default=1024, cast=int)
+
+
+class WorkerError(Exception):
+    """A task could not be completed by a worker process."""
+
+
+class WorkerPoolFullError(WorkerError):
+    pass
+
+
+class WorkerTimeoutError(WorkerError):
+    pass
+
+
+class WorkerMemoryError(WorkerError):
+    pass
+
+
+class WorkerCrashedError(WorkerError):
+    pass
+
+
+def _get_address_space_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _limit_memory(max_memory_bytes: int) -> None:
+    """Lets the tasks map max_memory_bytes more than the worker maps now.
+
+    RLIMIT_AS counts the whole address space, and a forked worker starts
+    with everything the bot had mapped, so the limit is set from its size.
+    Without /proc the limit is not set, as in macOS, which ignores it.
+    """
+    used = _get_address_space_bytes()
+    if used is None:
+        logger.warning("Could not read the worker address space, memory not limited")
+        return
+    limit = used + max_memory_bytes
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _worker_main(connection: Connection, max_memory_bytes: Optional[int]) -> None:
+    """Runs the tasks received through the connection until told to stop."""
+    if max_memory_bytes:
+        _limit_memory(max_memory_bytes)
+    try:
+        _run_tasks(connection)
+    finally:
+        # The process exits without running atexit, so the queued records
+        # are written here
+        stop_logging()
+
+
+def _run_tasks(connection: Connection) -> None:
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        function, args, task_trace_id = task
+        trace_id.set(task_trace_id)
+        try:
+            connection.send((True, function(*args)))
+        except MemoryError:
+            # The process may be left in a bad state, so it is replaced
+            connection.send((False, WorkerMemoryError("Task ran out of memory")))
+            return
+        except Exception as e:
+            try:
+                connection.send((False, e))
+            except Exception:
+                connection.send((False, WorkerError(f"{type(e).__name__}: {e}")))
+
+
+class _Worker:
+    def __init__(self, context, max_memory_bytes: Optional[int]) -> None:
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_connection, max_memory_bytes), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    async def receive(self) -> tuple[bool, Any]:
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = self.connection.fileno()
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(fd)
+        return self.connection.recv()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def stop(self, timeout: float = 1) -> None:
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class WorkerPool:
+    """Pool of processes for CPU-bound tasks, isolated from the event loop.
+
+    Each worker runs one task at a time, so a task that takes longer than
+    its timeout, runs out of memory or crashes its process only affects
+    itself: its worker is killed and replaced. Past max_queued tasks waiting
+    for a worker, new tasks are refused with a WorkerPoolFullError.
+
+    Tasks and their arguments must be picklable, such as module functions.
+    """
+
+    def __init__(
+        self,
+        processes: int = WORKER_PROCESSES,
+        max_queued: int = WORKER_MAX_QUEUED,
+        timeout: float = WORKER_TASK_TIMEOUT,
+        max_memory_mb: Optional[int] = WORKER_MAX_MEMORY_MB,
+        start_method: Optional[str] = None,
+    ) -> None:
+        self.processes = processes
+        self._max_tasks = processes + max_queued
+        self._timeout = timeout
+        self._max_memory_bytes = max_memory_mb * 2**20 if max_memory_mb else None
+        self._context = multiprocessing.get_context(start_method)
+        self._tasks = 0
+        self._busy = 0
+        # Not an asyncio.Semaphore, which would tie the pool to one event loop
+        self._waiters: deque[asyncio.Future] = deque()
+        self._idle: list[_Worker] = []
+        self._workers: set[_Worker] = set()
+
+    async def _acquire(self) -> None:
+        while self._busy >= self.processes:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass the slot on if it was given to this waiter
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_next()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._busy += 1
+
+    def _release(self) -> None:
+        self._busy -= 1
+        self._wake_next()
+
+    def _wake_next(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _get_worker(self) -> _Worker:
+        if self._idle:
+            return self._idle.pop()
+        worker = _Worker(self._context, self._max_memory_bytes)
+        self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        worker.kill()
+
+    async def _run_in_worker(
+        self, function: Callable, args: tuple, timeout: float
+    ) -> tuple[bool, Any]:
+        worker = self._get_worker()
+        try:
+            worker.connection.send((function, args, trace_id.get()))
+        except Exception:
+            # Nothing was sent if the task could not be pickled
+            self._idle.append(worker)
+            raise
+        try:
+            ok, result = await asyncio.wait_for(worker.receive(), timeout)
+        except asyncio.TimeoutError:
+            self._discard(worker)
+            raise WorkerTimeoutError(
+                f"{function.__name__} took longer than {timeout} seconds"
+            ) from None
+        except (EOFError, OSError):
+            self._discard(worker)
+            exit_code = worker.process.exitcode
+            raise WorkerCrashedError(
+                f"Worker crashed running {function.__name__}, exit code {exit_code}"
+            ) from None
+        except BaseException:
+            # Cancelled while the worker is still busy with the task
+            self._discard(worker)
+            raise
+        if isinstance(result, WorkerMemoryError):
+            self._discard(worker)
+        else:
+            self._idle.append(worker)
+        return ok, result
+
+    async def run(
+        self, function: Callable, *args: Any, timeout: Optional[float] = None
+    ) -> Any:
+        """Runs function(*args) in a worker process and returns its result.
+
+        Exceptions raised by the function are raised again here.
+        """
+        if self._tasks >= self._max_tasks:
+            raise WorkerPoolFullError(f"Too many tasks waiting, {self._tasks}")
+        self._tasks += 1
+        try:
+            await self._acquire()
+            try:
+                ok, result = await self._run_in_worker(
+                    function, args, timeout or self._timeout
+                )
+            finally:
+                self._release()
+        finally:
+            self._tasks -= 1
+        if not ok:
+            raise result
+        return result
+
+    def shutdown(self) -> None:
+        for worker in self._workers:
+            worker.stop()
+        self._workers.clear()
+        self._idle.clear()
+
+
+_pool: WorkerPool | None = None
+
+
+def get_worker_pool() -> WorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+    return _pool
+
+
+def shutdown_worker_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -0,0 +1,192 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+from telegram import Update
+from telegram.ext import Application
+
+from benchmarks.fakes import (
+    FakeTelegramRequest,
+    build_pdf,
+    make_message_update,
+    make_pdf_document,
+)
+from bot.commands import batch
+from bot.utilities.access import get_access_manager
+
+
+def build_zip(files: dict[str, bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def run_updates(request: FakeTelegramRequest, updates: list[dict], server) -> None:
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .build()
+    )
+    app.add_handler(batch.batch_conversation_handler)
+
+    async def run() -> None:
+        async with server:
+            await app.initialize()
+            for update in updates:
+                await app.process_update(Update.de_json(update, app.bot))
+            await app.shutdown()
+
+    asyncio.run(run())
+
+
+def get_texts(request: FakeTelegramRequest, method: str) -> list[str]:
+    return [params["text"] for _, called, params in request.calls if called == method]
+
+
+def make_album_updates(request: FakeTelegramRequest, command: str) -> list[dict]:
+    request.files["album_1"] = build_pdf(["First PDF of the album"])
+    request.files["album_2"] = build_pdf(["Second PDF of the album"])
+    updates = [make_message_update(1, 7, "user", "/batch")]
+    for i in (1, 2):
+        document = make_pdf_document(f"album_{i}", len(request.files[f"album_{i}"]))
+        update = make_message_update(1 + i, 7, "user", document=document)
+        update["message"]["media_group_id"] = "album"
+        updates.append(update)
+    updates.append(make_message_update(4, 7, "user", command))
+    return updates
+
+
+def test_read_zip_documents_skips_unsupported_files_and_checks_sizes():
+    zip_bytes = build_zip(
+        {
+            "docs/b.txt": b"Second",
+            "a.pdf": b"%PDF",
+            "image.png": b"png",
+            "__MACOSX/a.pdf": b"metadata",
+        }
+    )
+    documents = batch.read_zip_documents(zip_bytes, max_documents=5, max_bytes=100)
+    assert documents == [("a.pdf", b"%PDF"), ("b.txt", b"Second")]
+
+    bomb = build_zip({"bomb.txt": b"0" * 10_000})
+    assert len(bomb) < 1000
+    with pytest.raises(ValueError):
+        batch.read_zip_documents(bomb, max_documents=5, max_bytes=1000)
+    with pytest.raises(ValueError):
+        batch.read_zip_documents(zip_bytes, max_documents=1, max_bytes=100)
+
+
+def test_batch_summarizes_every_document_and_a_digest(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    request = FakeTelegramRequest()
+    request.files["archive"] = build_zip(
+        {"notes.txt": b"Some notes to summarize.", "page.html": b"<p>A page</p>"}
+    )
+    *updates, digest = make_album_updates(request, "/digest")
+    archive = {
+        "file_id": "archive",
+        "file_unique_id": "archive",
+        "file_name": "archive.zip",
+        "mime_type": "application/zip",
+    }
+    updates.append(make_message_update(5, 7, "user", document=archive))
+    updates.append(digest)
+
+    run_updates(request, updates, fake_openai_server)
+    sent = get_texts(request, "sendMessage")
+    edited = get_texts(request, "editMessageText")
+    # Once for the whole album and once for the zip file
+    assert sent.count("Added to the batch, send more or /done to summarize it.") == 2
+    for name in ("album_1.pdf", "album_2.pdf", "notes.txt", "page.html"):
+        assert f"{name}\nWaiting..." in sent
+        assert any(text.startswith(f"{name}\n") for text in edited)
+    assert any(text.startswith("Digest\n") for text in edited)
+    # One summary per document and the digest
+    assert len(fake_openai_server.requests) == 5
+
+
+def test_batch_over_its_budget_is_refused_before_downloading(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    monkeypatch.setattr(batch, "BATCH_MAX_COST", 1e-6)
+    request = FakeTelegramRequest()
+    run_updates(request, make_album_updates(request, "/done"), fake_openai_server)
+
+    assert get_texts(request, "sendMessage")[-1].startswith(
+        "This batch is too large to summarize"
+    )
+    assert not any(method == "getFile" for _, method, _ in request.calls)
+
+
+def test_batch_summaries_take_their_cost_from_its_budget(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    monkeypatch.setattr(batch, "BATCH_MAX_COST", 1e-6)
+    # The size of a zip file is not known, its documents are checked one by one
+    request = FakeTelegramRequest()
+    request.files["archive"] = build_zip({"notes.txt": b"Some notes."})
+    archive = {
+        "file_id": "archive",
+        "file_unique_id": "archive",
+        "file_name": "archive.zip",
+        "mime_type": "application/zip",
+    }
+    updates = [
+        make_message_update(1, 7, "user", "/batch"),
+        make_message_update(2, 7, "user", document=archive),
+        make_message_update(3, 7, "user", "/done"),
+    ]
+    run_updates(request, updates, fake_openai_server)
+
+    edited = get_texts(request, "editMessageText")
+    assert any("left of the budget" in text for text in edited)
+    assert not fake_openai_server.requests
+
+
+def test_failed_digest_finishes_its_message(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("Broken")
+
+    # The PDFs are summarized without it, only the digest uses it
+    monkeypatch.setattr(batch, "summary_generator", fail)
+    request = FakeTelegramRequest()
+    run_updates(request, make_album_updates(request, "/digest"), fake_openai_server)
+
+    edited = get_texts(request, "editMessageText")
+    assert any(text.startswith("album_1.pdf\nSubject") for text in edited)
+    assert edited[-1] == "Digest\nCould not write the digest."
+
+
+def test_failed_url_does_not_stop_the_batch(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("Broken")
+
+    monkeypatch.setattr(batch, "summarize_url", fail)
+    request = FakeTelegramRequest()
+    *updates, digest = make_album_updates(request, "/digest")
+    updates.append(make_message_update(5, 7, "user", "https://example.com/page"))
+    updates.append(digest)
+    run_updates(request, updates, fake_openai_server)
+
+    edited = get_texts(request, "editMessageText")
+    assert "https://example.com/page\nCould not summarize this URL." in edited
+    assert any(text.startswith("album_2.pdf\nSubject") for text in edited)
+    assert any(text.startswith("Digest\nSubject") for text in edited)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from telegram import Update
+from telegram.ext import Application
+
+from benchmarks.fakes import FakeTelegramRequest, make_message_update
+from bot.commands import chat
+from bot.modules.conversation_store import MemoryConversationStore
+from bot.utilities.access import get_access_manager
+
+
+def test_chat_remembers_the_conversation_until_reset(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    monkeypatch.setattr(chat, "chat_store", MemoryConversationStore())
+    request = FakeTelegramRequest()
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .build()
+    )
+    app.add_handler(chat.chat_conversation_handler)
+    texts = ["/chat", "Hello", "Do you remember me?", "/reset", "Hello again"]
+    updates = [
+        make_message_update(i, 8, "user", text) for i, text in enumerate(texts, 1)
+    ]
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await app.initialize()
+            for update in updates:
+                await app.process_update(Update.de_json(update, app.bot))
+            await app.shutdown()
+
+    asyncio.run(run())
+    prompts = [
+        [message["content"] for message in request["messages"][1:]]
+        for request in fake_openai_server.requests
+    ]
+    assert prompts[0] == ["Hello"]
+    assert prompts[1][0] == "Hello" and prompts[1][-1] == "Do you remember me?"
+    assert prompts[2] == ["Hello again"]
+    edited = [
+        params["text"]
+        for _, method, params in request.calls
+        if method == "editMessageText"
+    ]
+    assert len(edited) == 3
+    assert all(text.startswith("Subject: Fake") for text in edited)
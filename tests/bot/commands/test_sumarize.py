@@ -0,0 +1,222 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import Application
+
+from benchmarks.fakes import (
+    FakeTelegramRequest,
+    build_pdf,
+    make_message_update,
+    make_pdf_document,
+)
+from bot.commands import sumarize
+from bot.modules.model_router import ModelRouter, load_model_specs
+from bot.modules.summarizer import Summarizer
+from bot.utilities.access import get_access_manager
+
+
+def build_app(request: FakeTelegramRequest) -> Application:
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .build()
+    )
+    app.add_handler(sumarize.summarize_conversation_handler)
+    return app
+
+
+def get_texts(request: FakeTelegramRequest) -> list[str]:
+    return [
+        params["text"]
+        for _, method, params in request.calls
+        if method in ("sendMessage", "editMessageText")
+    ]
+
+
+def test_users_sending_the_same_file_share_its_download_and_summary(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    request = FakeTelegramRequest()
+    request.files["forwarded"] = build_pdf(["A PDF forwarded to the group"])
+    document = make_pdf_document("forwarded", len(request.files["forwarded"]))
+    app = build_app(request)
+
+    def updates(users: range) -> list[Update]:
+        return [
+            Update.de_json(update, app.bot)
+            for user in users
+            for update in (
+                make_message_update(user * 10, user, f"user{user}", "/summarize"),
+                make_message_update(
+                    user * 10 + 1, user, f"user{user}", document=document
+                ),
+            )
+        ]
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await app.initialize()
+            commands, documents = updates(range(1, 4))[::2], updates(range(1, 4))[1::2]
+            for update in commands:
+                await app.process_update(update)
+            await asyncio.gather(*[app.process_update(update) for update in documents])
+            # Later requests use the cached summary, without a download
+            for update in updates(range(4, 5)):
+                await app.process_update(update)
+            await app.shutdown()
+
+    asyncio.run(run())
+    methods = [method for _, method, _ in request.calls]
+    assert methods.count("getFile") == 1
+    assert len(fake_openai_server.requests) == 1
+    summaries = {
+        params["chat_id"]
+        for _, method, params in request.calls
+        if method == "editMessageText" and params["text"].startswith("Subject: Fake")
+    }
+    assert summaries == {1, 2, 3, 4}
+
+
+def test_failed_text_summary_finishes_its_message(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    # A bad request is not retried
+    fake_openai_server.failures = [400]
+    request = FakeTelegramRequest()
+    app = build_app(request)
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await app.initialize()
+            for update_id, text in enumerate(["/summarize", "A text that fails"]):
+                update = make_message_update(update_id, 7, "user7", text)
+                await app.process_update(Update.de_json(update, app.bot))
+            await app.shutdown()
+
+    asyncio.run(run())
+    assert get_texts(request)[-1] == "Could not summarize this text, please try again."
+
+
+def test_failed_pdf_and_url_summaries_finish_their_message(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+
+    async def fetch_url_text(url: str):
+        return SimpleNamespace(is_pdf=False), f"The text of {url}"
+
+    monkeypatch.setattr(sumarize, "fetch_url_text", fetch_url_text)
+    # Bad requests are not retried
+    fake_openai_server.failures = [400, 400]
+    request = FakeTelegramRequest()
+    request.files["failing"] = build_pdf(["A PDF whose summary fails"])
+    document = make_pdf_document("failing", len(request.files["failing"]))
+    app = build_app(request)
+    updates = [
+        make_message_update(1, 7, "user7", "/summarize"),
+        make_message_update(2, 7, "user7", document=document),
+        make_message_update(3, 8, "user8", "/summarize"),
+        make_message_update(4, 8, "user8", "https://example.com/failing"),
+    ]
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await app.initialize()
+            for update in updates:
+                await app.process_update(Update.de_json(update, app.bot))
+            await app.shutdown()
+
+    asyncio.run(run())
+    texts = get_texts(request)
+    assert "Could not summarize this PDF, please try again." in texts
+    assert texts[-1] == "Could not summarize this URL, please try again."
+
+
+def test_summary_cost_is_limited_with_the_most_expensive_model(
+    fake_openai_server, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_access_manager(), "is_allowed", lambda *users: True)
+    # The models table includes GPT-4, which the router may pick
+    router = ModelRouter(load_model_specs())
+    monkeypatch.setattr(sumarize, "get_model_router", lambda: router)
+    text = "A long text to summarize. " * 200
+    cheapest = Summarizer().estimate_summary(text, mode=sumarize.SUMMARY_MODE)
+    monkeypatch.setattr(sumarize, "SUMMARY_MAX_COST", cheapest.cost * 2)
+    request = FakeTelegramRequest()
+    app = build_app(request)
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await app.initialize()
+            for update_id, text_sent in enumerate(["/summarize", text]):
+                update = make_message_update(update_id, 7, "user7", text_sent)
+                await app.process_update(Update.de_json(update, app.bot))
+            await app.shutdown()
+
+    asyncio.run(run())
+    assert get_texts(request)[-1].startswith("This content is too large to summarize")
+    assert not fake_openai_server.requests
+
+
+class FakeProgress:
+    def __init__(self, fail_updates: bool = False) -> None:
+        self.fail_updates = fail_updates
+        self.finished: list[str] = []
+
+    async def show(self, text: str) -> None:
+        pass
+
+    async def update(self, text: str) -> None:
+        if self.fail_updates:
+            raise TelegramError("Message can't be edited")
+
+    async def finish(self, text: str) -> None:
+        self.finished.append(text)
+
+
+class FakeBot:
+    def __init__(self, content: bytes | None) -> None:
+        self.content = content
+
+    async def get_file(self, file_id: str) -> SimpleNamespace:
+        if self.content is None:
+            raise TelegramError("File is too big")
+
+        async def download_as_bytearray() -> bytearray:
+            return bytearray(self.content)
+
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+
+def make_document(file_id: str) -> SimpleNamespace:
+    return SimpleNamespace(file_id=file_id, file_unique_id=file_id, file_size=1000)
+
+
+def test_only_download_errors_are_shown_as_such(fake_openai_server):
+    # A file whose content is known is downloaded while it is summarized
+    sumarize.shared_state.set("file:lost", "pdf:lost")
+    failed_download = FakeProgress()
+    failed_edit = FakeProgress(fail_updates=True)
+    pdf = build_pdf(["A PDF whose progress message cannot be edited"])
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await sumarize.summary_document_generator(
+                FakeBot(None), make_document("lost"), failed_download, "1"
+            )
+            with pytest.raises(TelegramError):
+                await sumarize.summary_document_generator(
+                    FakeBot(pdf), make_document("uneditable"), failed_edit, "1"
+                )
+
+    asyncio.run(run())
+    assert failed_download.finished == ["Error downloading PDF, it might be too large!"]
+    assert failed_edit.finished == []
@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from bot.commands import usage
+from bot.utilities.access import get_access_manager
+from bot.utilities.metrics import Metrics, request_labels
+from bot.utilities.progressive_message import MAX_MESSAGE_LENGTH
+
+
+def test_long_usage_report_is_sent_in_parts(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(get_access_manager(), "is_admin", lambda *users: True)
+    recorder = Metrics()
+    for user in range(200):
+        token = request_labels.set((f"user-{user}", "summarize"))
+        try:
+            recorder.record_usage("gpt-3.5-turbo", 1000, 100)
+        finally:
+            request_labels.reset(token)
+    monkeypatch.setattr(usage, "metrics", recorder)
+    reply_text = AsyncMock()
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=1, username="admin"),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+    asyncio.run(usage.usage_command(update, None))
+
+    parts = [call.args[0] for call in reply_text.call_args_list]
+    assert len(parts) > 1
+    assert all(len(part) <= MAX_MESSAGE_LENGTH for part in parts)
+    assert "\n".join(parts) == usage.get_usage_report()
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from bot.modules.conversation_store import (
+    HistoryView,
+    MemoryConversationStore,
+    Message,
+    Role,
+    SqliteConversationStore,
+)
+from bot.modules.openai_conversation import OpenAIConversation
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def messages(*contents: str) -> list[Message]:
+    return [Message(role=Role.USER, content=content) for content in contents]
+
+
+def test_messages_use_slots():
+    assert not hasattr(Message(role=Role.USER, content="Hi"), "__dict__")
+
+
+def test_history_views_are_read_only_snapshots():
+    store = MemoryConversationStore()
+    store.append("chat", messages("a", "b"))
+
+    view = store.get_history("chat")
+    store.append("chat", messages("c"))
+
+    assert isinstance(view, HistoryView)
+    assert [m.content for m in view] == ["a", "b"]
+    assert view[-1].content == "b"
+    assert [m.content for m in store.get_history("chat")] == ["a", "b", "c"]
+    with pytest.raises(TypeError):
+        view[0] = Message(role=Role.USER, content="x")
+
+
+def test_histories_keep_their_last_messages():
+    store = MemoryConversationStore(max_messages=3)
+    store.append("chat", messages("a", "b"))
+    view = store.get_history("chat")
+    store.append("chat", messages("c", "d"))
+
+    assert [m.content for m in store.get_history("chat")] == ["b", "c", "d"]
+    assert [m.content for m in view] == ["a", "b"]
+
+
+def test_idle_and_least_recently_used_chats_are_evicted():
+    clock = FakeClock()
+    store = MemoryConversationStore(max_chats=2, idle_seconds=60, clock=clock)
+    store.append("old", messages("a"))
+    clock.now += 30
+    store.append("recent", messages("b"))
+    store.get_history("old")
+    store.append("new", messages("c"))
+
+    assert "recent" not in store
+    assert len(store) == 2
+
+    clock.now += 61
+    store.append("newest", messages("d"))
+    assert "old" not in store and "new" not in store
+    assert len(store) == 1
+
+
+def test_sqlite_store_persists_histories_and_token_counts(tmp_path):
+    db_path = str(tmp_path / "conversations.sqlite")
+    store = SqliteConversationStore(db_path, max_messages=3)
+    counted = Message(role=Role.USER, content="counted")
+    counted._token_length = 2
+    store.append("chat", messages("a", "b") + [counted])
+    store.append("chat", [Message(role=Role.ASSISTANT, content="answer")])
+    store.close()
+
+    reopened = SqliteConversationStore(db_path, max_messages=3)
+    history = reopened.get_history("chat")
+
+    assert [m.content for m in history] == ["b", "counted", "answer"]
+    assert history[1]._token_length == 2
+    assert history[2].role == Role.ASSISTANT
+    reopened.clear("chat")
+    assert len(reopened.get_history("chat")) == 0
+
+
+def test_sqlite_store_deletes_idle_chats_on_open(tmp_path):
+    db_path = str(tmp_path / "conversations.sqlite")
+    clock = FakeClock()
+    store = SqliteConversationStore(db_path, disk_idle_seconds=100, clock=clock)
+    store.append("chat", messages("a"))
+    store.close()
+
+    clock.now += 101
+    reopened = SqliteConversationStore(db_path, disk_idle_seconds=100, clock=clock)
+
+    assert len(reopened.get_history("chat")) == 0
+
+
+def test_oldest_messages_are_replaced_in_memory_and_on_disk(tmp_path):
+    db_path = str(tmp_path / "conversations.sqlite")
+    store = SqliteConversationStore(db_path, max_messages=4)
+    store.append("chat", messages("a", "b", "c"))
+    summary = Message(role=Role.SYSTEM, content="summary")
+    store.replace_oldest("chat", 2, [summary])
+    store.append("chat", messages("d", "e", "f"))
+    assert [m.content for m in store.get_history("chat")] == ["c", "d", "e", "f"]
+    store.replace_oldest("chat", 3, [summary])
+    store.close()
+
+    reopened = SqliteConversationStore(db_path, max_messages=4)
+    history = reopened.get_history("chat")
+
+    assert [m.content for m in history] == ["summary", "f"]
+    assert history[0].role == Role.SYSTEM
+    reopened.append("chat", messages("g"))
+    assert [m.content for m in reopened.get_history("chat")] == ["summary", "f", "g"]
+
+
+def test_conversations_share_a_store_by_chat(fake_openai_server):
+    store = MemoryConversationStore()
+
+    async def run():
+        async with fake_openai_server:
+            first = OpenAIConversation(store=store, chat_id="1")
+            await first.aget_completion("Hello")
+            response = await first.aget_completion("Again")
+            await OpenAIConversation(store=store, chat_id="2").aget_completion("Hi")
+            return response
+
+    response = asyncio.run(run())
+
+    assert len(response.history) == 2
+    assert len(store.get_history("1")) == 4
+    assert len(store.get_history("2")) == 2
+    # The user message reuses the token count computed for its prompt
+    assert store.get_history("1")[0]._token_length is not None
@@ -0,0 +1,180 @@
+import asyncio
+
+from bot.modules.model_router import (
+    ModelRouter,
+    ModelSpec,
+    RoutePolicy,
+    load_model_specs,
+)
+from bot.modules.openai_conversation import (
+    OpenAIChatModel,
+    OpenAIConversation,
+    is_retryable_error,
+)
+from bot.utilities.metrics import metrics
+from bot.utilities.resilience import CircuitBreaker, ResilientCaller, RetryPolicy
+
+SMALL = ModelSpec(OpenAIChatModel.GPT_3_5, 4000, 0.0015, 0.002, 90000, 3500)
+LARGE = ModelSpec(OpenAIChatModel.GPT_3_5_16K, 16000, 0.003, 0.004, 180000, 3500)
+SMART = ModelSpec(OpenAIChatModel.GPT_4, 8000, 0.03, 0.06, 10000, 200)
+
+
+def make_router(policy: RoutePolicy = RoutePolicy()) -> ModelRouter:
+    return ModelRouter([SMART, LARGE, SMALL], policy=policy, clock=lambda: 0.0)
+
+
+def get_models(route: list[ModelSpec]) -> list[OpenAIChatModel]:
+    return [spec.model for spec in route]
+
+
+def test_model_table_is_loaded():
+    specs = load_model_specs()
+    assert OpenAIChatModel.GPT_3_5 in [spec.model for spec in specs]
+    assert all(spec.token_limit > 0 for spec in specs)
+
+
+def test_route_picks_the_cheapest_model_that_fits():
+    router = make_router()
+    before = metrics.get_routes().get(("gpt-3.5-turbo", "policy"), 0)
+
+    assert get_models(router.route(1000, 1000)) == [
+        OpenAIChatModel.GPT_3_5,
+        OpenAIChatModel.GPT_3_5_16K,
+        OpenAIChatModel.GPT_4,
+    ]
+    assert get_models(router.route(5000, 1000)) == [
+        OpenAIChatModel.GPT_3_5_16K,
+        OpenAIChatModel.GPT_4,
+    ]
+    # Prompts that fit no model get the largest one, to be cut
+    assert get_models(router.route(20000, 1000)) == [OpenAIChatModel.GPT_3_5_16K]
+    assert metrics.get_routes()[("gpt-3.5-turbo", "policy")] == before + 1
+    assert metrics.get_routes()[("gpt-3.5-turbo-16k", "too_long")] >= 1
+
+
+def test_route_prefers_models_with_headroom():
+    router = make_router()
+    router.throttle(OpenAIChatModel.GPT_3_5)
+
+    route = get_models(router.route(1000, 1000))
+
+    assert route[0] == OpenAIChatModel.GPT_3_5_16K
+    assert route[-1] == OpenAIChatModel.GPT_3_5
+
+
+def test_route_keeps_the_cost_budget_and_latency_slo():
+    router = make_router(RoutePolicy(max_cost=0.01, latency_slo=1.0))
+    for _ in range(20):
+        router.record_latency(OpenAIChatModel.GPT_3_5, 5.0)
+
+    # GPT-4 breaks the budget and GPT-3.5 the latency, both are kept last
+    route = get_models(router.route(1000, 1000))
+    assert route == [
+        OpenAIChatModel.GPT_3_5_16K,
+        OpenAIChatModel.GPT_3_5,
+        OpenAIChatModel.GPT_4,
+    ]
+
+    # When no model keeps the policy the cheapest is used anyway
+    expensive = make_router(RoutePolicy(max_cost=0.0001))
+    assert get_models(expensive.route(1000, 1000))[0] == OpenAIChatModel.GPT_3_5
+
+
+def test_routed_conversation_falls_back_on_errors(fake_openai_server):
+    fake_openai_server.failures = [500]
+    caller = ResilientCaller(
+        is_retryable=is_retryable_error,
+        policy=RetryPolicy(max_attempts=1),
+        breaker=CircuitBreaker(),
+    )
+    router = make_router()
+
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(caller=caller, router=router)
+            return await conversation.aget_completion("Hello", token_margin=100)
+
+    response = asyncio.run(run())
+
+    assert response.content.startswith("Subject: Fake")
+    assert [request["model"] for request in fake_openai_server.requests] == [
+        "gpt-3.5-turbo",
+        "gpt-3.5-turbo-16k",
+    ]
+    assert response.model == "gpt-3.5-turbo-16k"
+    assert metrics.get_routes()[("gpt-3.5-turbo-16k", "fallback")] >= 1
+
+
+class LatencyRecorder(ModelRouter):
+    def __init__(self) -> None:
+        super().__init__([SMART, LARGE, SMALL], clock=lambda: 0.0)
+        self.recorded: list[OpenAIChatModel] = []
+
+    def record_latency(self, model: OpenAIChatModel, seconds: float) -> None:
+        self.recorded.append(model)
+
+
+def test_concurrent_requests_keep_their_own_route(fake_openai_server):
+    router = LatencyRecorder()
+
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(router=router)
+            # Too long for the 4k model once the completion is added
+            await asyncio.gather(
+                conversation.aget_completion("Hello", token_margin=1000),
+                conversation.aget_completion("x" * 16000, token_margin=1000),
+            )
+            return conversation
+
+    conversation = asyncio.run(run())
+
+    assert sorted(request["model"] for request in fake_openai_server.requests) == [
+        "gpt-3.5-turbo",
+        "gpt-3.5-turbo-16k",
+    ]
+    assert sorted(model.value for model in router.recorded) == [
+        "gpt-3.5-turbo",
+        "gpt-3.5-turbo-16k",
+    ]
+    # The routes are not kept in the conversation
+    assert conversation.model == OpenAIChatModel.GPT_3_5
+
+
+def test_routed_message_is_encoded_once(
+    fake_openai_server, fake_tokenizer, monkeypatch
+):
+    encoded = []
+    encode = fake_tokenizer.encode
+    monkeypatch.setattr(
+        fake_tokenizer, "encode", lambda text: encoded.append(text) or encode(text)
+    )
+
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(router=make_router())
+            await conversation.aget_completion("Routed message", token_margin=100)
+
+    asyncio.run(run())
+
+    # Counted for the route and reused to fit the prompt in the routed model
+    assert encoded.count("Routed message") == 1
+
+
+def test_failed_calls_count_in_the_latency(fake_openai_server):
+    fake_openai_server.failures = [500]
+    caller = ResilientCaller(
+        is_retryable=is_retryable_error,
+        policy=RetryPolicy(max_attempts=1),
+        breaker=CircuitBreaker(),
+    )
+    router = LatencyRecorder()
+
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(caller=caller, router=router)
+            await conversation.aget_completion("Hello", token_margin=100)
+
+    asyncio.run(run())
+
+    assert router.recorded == [OpenAIChatModel.GPT_3_5, OpenAIChatModel.GPT_3_5_16K]
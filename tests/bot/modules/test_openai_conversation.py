@@ -0,0 +1,153 @@
+import asyncio
+
+from bot.modules.openai_conversation import (
+    Message,
+    OpenAIConversation,
+    Role,
+    is_retryable_error,
+)
+from bot.utilities.resilience import CircuitBreaker, ResilientCaller, RetryPolicy
+from bot.utilities.summary_cache import SummaryCache
+
+
+def test_aget_completion_updates_history(fake_openai_server):
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(system_prompt="You are a test.")
+            return conversation, await conversation.aget_completion("Hello")
+
+    conversation, response = asyncio.run(run())
+
+    assert response.content.startswith("Subject: Fake")
+    assert response.cut_prompt == ""
+    request = fake_openai_server.requests[0]
+    assert request["messages"] == [
+        {"role": "system", "content": "You are a test."},
+        {"role": "user", "content": "Hello"},
+    ]
+    history = conversation.get_chat_history()
+    assert [message.role for message in history] == [
+        Role.SYSTEM,
+        Role.USER,
+        Role.ASSISTANT,
+    ]
+
+
+def _build_prompt(*contents: str) -> list[Message]:
+    roles = [Role.USER, Role.ASSISTANT]
+    prompt = [Message(role=Role.SYSTEM, content="system")]
+    for i, content in enumerate(contents):
+        prompt.append(Message(role=roles[i % 2], content=content))
+    return prompt
+
+
+def test_preprocess_prompt_removes_oldest_messages(fake_tokenizer):
+    conversation = OpenAIConversation()
+    # Limit of 10 tokens, every message below is 2 tokens long (8 chars)
+    prompt = _build_prompt("aaaaaaaa", "bbbbbbbb", "cccccccc", "dddddddd", "eeeeeeee")
+
+    result, cut_prompt = conversation.preprocess_prompt(prompt, token_margin=3990)
+
+    assert cut_prompt == ""
+    assert [message.content for message in result] == [
+        "system",
+        "cccccccc",
+        "dddddddd",
+        "eeeeeeee",
+    ]
+
+
+def test_preprocess_prompt_truncates_user_message(fake_tokenizer):
+    conversation = OpenAIConversation()
+    prompt = _build_prompt("a" * 20, "b" * 60)
+
+    result, cut_prompt = conversation.preprocess_prompt(prompt, token_margin=3990)
+
+    # The system prompt takes 2 tokens, leaving 8 tokens (32 chars) to the user
+    assert [message.content for message in result] == ["system", "b" * 32]
+    assert cut_prompt == "b" * 28
+
+
+def test_preprocess_prompt_encodes_each_message_once(fake_tokenizer, monkeypatch):
+    conversation = OpenAIConversation()
+    encoded = []
+    encode = fake_tokenizer.encode
+    monkeypatch.setattr(
+        fake_tokenizer, "encode", lambda text: encoded.append(text) or encode(text)
+    )
+    prompt = _build_prompt(*["x" * 40 for _ in range(10)])
+
+    conversation.preprocess_prompt(prompt, token_margin=3970)
+    conversation.preprocess_prompt(prompt, token_margin=3970)
+
+    # The history is memoized, only the newest message is encoded on every call
+    assert len(encoded) == len(prompt) + 1
+
+
+def test_aget_completion_retries_transient_errors(fake_openai_server):
+    fake_openai_server.failures = [429, 500]
+    caller = ResilientCaller(
+        is_retryable=is_retryable_error,
+        policy=RetryPolicy(base_delay=0.01),
+        breaker=CircuitBreaker(),
+    )
+
+    async def run():
+        async with fake_openai_server:
+            conversation = OpenAIConversation(caller=caller)
+            return await conversation.aget_completion("Hello")
+
+    response = asyncio.run(run())
+
+    assert response.content.startswith("Subject: Fake")
+    assert len(fake_openai_server.requests) == 3
+
+
+def test_checkpointed_completions_are_reused(fake_openai_server):
+    checkpoints = SummaryCache()
+
+    async def run():
+        async with fake_openai_server:
+            first = await OpenAIConversation(checkpoints=checkpoints).aget_completion(
+                "Hello", temperature=0.2
+            )
+            second = await OpenAIConversation(checkpoints=checkpoints).aget_completion(
+                "Hello", temperature=0.2
+            )
+            stream = await OpenAIConversation(
+                checkpoints=checkpoints
+            ).astream_completion("Hello", temperature=0.2)
+            deltas = [delta async for delta in stream]
+            return first, second, deltas
+
+    first, second, deltas = asyncio.run(run())
+
+    assert len(fake_openai_server.requests) == 1
+    assert second.content == first.content
+    assert deltas == [first.content]
+
+
+def test_preprocess_prompt_truncates_at_sentence_boundary(fake_tokenizer):
+    conversation = OpenAIConversation()
+    content = "First sentence is here. Second sentence is longer than that."
+    prompt = _build_prompt(content)
+
+    result, cut_prompt = conversation.preprocess_prompt(prompt, token_margin=3988)
+
+    assert result[1].content == "First sentence is here. "
+    assert cut_prompt == "Second sentence is longer than that."
+
+
+def test_estimate_text_token_length_samples_long_texts(fake_tokenizer, monkeypatch):
+    conversation = OpenAIConversation()
+    encoded = []
+    encode = fake_tokenizer.encode
+    monkeypatch.setattr(
+        fake_tokenizer, "encode", lambda text: encoded.append(text) or encode(text)
+    )
+    text = "abcd" * 250_000
+
+    estimate = conversation.estimate_text_token_length(text)
+
+    assert estimate == 250_000
+    assert sum(len(sample) for sample in encoded) == 8 * 2000
@@ -0,0 +1,51 @@
+import asyncio
+
+from bot.modules.conversation_store import MemoryConversationStore, Role
+from bot.modules.rolling_summary import RollingSummaryConversation, SUMMARY_PREFIX
+
+SYSTEM_PROMPT = "You are chatting."
+
+
+def get_prompt_length(request: dict) -> int:
+    # The fake tokenizer counts a token every 4 characters
+    return sum(len(message["content"]) // 4 for message in request["messages"])
+
+
+def test_older_turns_are_folded_into_a_rolling_summary(fake_openai_server):
+    store = MemoryConversationStore()
+
+    async def chat() -> None:
+        async with fake_openai_server:
+            for i in range(20):
+                conversation = RollingSummaryConversation(
+                    system_prompt=SYSTEM_PROMPT,
+                    store=store,
+                    chat_id="chat",
+                    summary_threshold=80,
+                    recent_tokens=40,
+                )
+                await conversation.aget_completion(f"This is message number {i}")
+                await conversation.wait_for_summary()
+
+    asyncio.run(chat())
+
+    history = store.get_history("chat")
+    assert history[0].role == Role.SYSTEM
+    assert history[0].content.startswith(SUMMARY_PREFIX)
+    assert all(message.role != Role.SYSTEM for message in history[1:])
+    assert history[-2].content == "This is message number 19"
+
+    chat_requests = [
+        request
+        for request in fake_openai_server.requests
+        if request["messages"][0]["content"] == SYSTEM_PROMPT
+    ]
+    summary_requests = len(fake_openai_server.requests) - len(chat_requests)
+    assert len(chat_requests) == 20
+    assert 3 <= summary_requests < 20
+    # Without the summary the last prompt would have all the 20 turns, about
+    # 14 tokens each
+    lengths = [get_prompt_length(request) for request in chat_requests]
+    assert max(lengths) <= 80 + 20
+    # Each summary starts from the previous one
+    assert "Point" in fake_openai_server.requests[-1]["messages"][-1]["content"]
@@ -0,0 +1,129 @@
+import asyncio
+
+from bot.modules.scheduler import SummaryScheduler
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeBackend:
+    """Summary jobs that only finish when the test releases them."""
+
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.releases: dict[str, asyncio.Event] = {}
+
+    def job(self, name: str):
+        self.releases[name] = asyncio.Event()
+
+        async def run() -> str:
+            self.started.append(name)
+            await self.releases[name].wait()
+            return f"summary {name}"
+
+        return run
+
+    def release(self, name: str) -> None:
+        self.releases[name].set()
+
+
+async def settle() -> None:
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_global_concurrency_limit():
+    async def run():
+        clock = FakeClock()
+        scheduler = SummaryScheduler(max_concurrent_jobs=2, clock=clock)
+        backend = FakeBackend()
+        jobs = [
+            asyncio.create_task(scheduler.submit(f"user{i}", backend.job(f"job{i}")))
+            for i in range(3)
+        ]
+        await settle()
+        assert backend.started == ["job0", "job1"]
+        assert scheduler.queued_jobs == 1
+
+        backend.release("job0")
+        await settle()
+        assert backend.started == ["job0", "job1", "job2"]
+
+        backend.release("job1")
+        backend.release("job2")
+        return await asyncio.gather(*jobs)
+
+    assert asyncio.run(run()) == ["summary job0", "summary job1", "summary job2"]
+
+
+def test_users_are_served_round_robin_with_positions():
+    async def run():
+        scheduler = SummaryScheduler(max_concurrent_jobs=1, clock=FakeClock())
+        backend = FakeBackend()
+        positions: dict[str, list[int]] = {}
+
+        def submit(user_id: str, name: str) -> asyncio.Task:
+            async def on_position(position: int) -> None:
+                positions.setdefault(name, []).append(position)
+
+            job = backend.job(name)
+            return asyncio.create_task(
+                scheduler.submit(user_id, job, on_position=on_position)
+            )
+
+        tasks = [submit("alice", "a1"), submit("alice", "a2"), submit("alice", "a3")]
+        await settle()
+        tasks.append(submit("bob", "b1"))
+        await settle()
+
+        for name in ["a1", "a2", "b1", "a3"]:
+            backend.release(name)
+            await settle()
+        await asyncio.gather(*tasks)
+        return backend.started, positions
+
+    started, positions = asyncio.run(run())
+
+    assert started == ["a1", "a2", "b1", "a3"]
+    assert positions["b1"] == [2, 1]
+    assert positions["a3"] == [2, 3, 2, 1]
+
+
+def test_rate_limits_delay_jobs_until_budget_refills():
+    async def run():
+        clock = FakeClock()
+        scheduler = SummaryScheduler(
+            max_concurrent_jobs=10,
+            tokens_per_minute=6000,
+            requests_per_minute=100,
+            clock=clock,
+            sleep=clock.sleep,
+        )
+        backend = FakeBackend()
+        tasks = [
+            asyncio.create_task(
+                scheduler.submit(f"user{i}", backend.job(f"job{i}"), tokens=4000)
+            )
+            for i in range(2)
+        ]
+        await settle()
+        for name in backend.releases:
+            backend.release(name)
+        await asyncio.gather(*tasks)
+        return backend.started, clock.sleeps
+
+    started, sleeps = asyncio.run(run())
+
+    assert started == ["job0", "job1"]
+    # The second job needs 2000 more tokens at a refill rate of 100 per second
+    assert sleeps == [20.0]
@@ -1,7 +1,10 @@
+import asyncio
+import time
+
 import pytest
 from unittest.mock import Mock, MagicMock
 from bot.modules.openai_conversation import OpenAIConversation
-from bot.modules.summarizer import Summarizer
+from bot.modules.summarizer import Summarizer, SummaryMode
 
 
 @pytest.fixture
@@ -79,3 +82,157 @@ def test_generate_summary(
     expected_summary = "Subject: Sample\nKey points:\n- Point 1"
 
     assert summary == expected_summary
+
+
+def test_agenerate_summary_runs_concurrently(fake_openai_server):
+    concurrent_summaries = 8
+    fake_openai_server.latency = 0.5
+
+    async def run() -> tuple[list[str], float]:
+        async with fake_openai_server:
+            summarizer = Summarizer()
+            start = time.perf_counter()
+            summaries = await asyncio.gather(
+                *[
+                    summarizer.agenerate_summary(f"Sample text {i}.")
+                    for i in range(concurrent_summaries)
+                ]
+            )
+            return summaries, time.perf_counter() - start
+
+    summaries, elapsed = asyncio.run(run())
+
+    assert len(fake_openai_server.requests) == concurrent_summaries
+    assert all(summary.startswith("Subject: Fake") for summary in summaries)
+    # Serial execution would take latency * concurrent_summaries
+    assert elapsed < fake_openai_server.latency * 2
+
+
+def test_agenerate_summary_map_reduce(fake_openai_server):
+    fake_openai_server.latency = 0.05
+    text = " ".join(f"Sentence number {i}." for i in range(400))
+
+    async def run() -> str:
+        async with fake_openai_server:
+            summarizer = Summarizer(max_concurrency=3, chunk_token_limit=200)
+            return await summarizer.agenerate_summary(
+                text, words_limit=100, mode=SummaryMode.MAP_REDUCE
+            )
+
+    summary = asyncio.run(run())
+
+    requests = fake_openai_server.requests
+    map_requests = [
+        r for r in requests if "The text is:" in r["messages"][1]["content"]
+    ]
+    reduce_requests = [
+        r for r in requests if "partial summaries" in r["messages"][1]["content"]
+    ]
+    assert len(map_requests) > 3
+    assert len(reduce_requests) >= 1
+    assert "less than 100 words" in reduce_requests[-1]["messages"][1]["content"]
+    assert fake_openai_server.max_in_flight <= 3
+    assert summary.startswith("Subject: Fake")
+
+
+def test_astream_summary_yields_progressive_snapshots(fake_openai_server):
+    fake_openai_server.latency = 0.2
+    fake_openai_server.stream_chunk_delay = 0.05
+
+    async def run() -> tuple[list[str], float]:
+        async with fake_openai_server:
+            summarizer = Summarizer(allow_recursion=True)
+            start = time.perf_counter()
+            snapshots = []
+            async for snapshot in summarizer.astream_summary("Sample text."):
+                if not snapshots:
+                    time_to_first = time.perf_counter() - start
+                snapshots.append(snapshot)
+            return snapshots, time_to_first
+
+    snapshots, time_to_first = asyncio.run(run())
+
+    assert len(snapshots) > 1
+    assert snapshots[0] == "Subject:"
+    assert snapshots[-1] == "Subject: Fake\nKey points:\n- Point 1"
+    assert time_to_first < fake_openai_server.latency + 0.1
+
+
+def test_astream_summary_map_reduce_reports_progress(fake_openai_server):
+    text = " ".join(f"Sentence number {i}." for i in range(100))
+
+    async def run() -> list[str]:
+        async with fake_openai_server:
+            summarizer = Summarizer(chunk_token_limit=200)
+            stream = summarizer.astream_summary(text, mode=SummaryMode.MAP_REDUCE)
+            return [snapshot async for snapshot in stream]
+
+    snapshots = asyncio.run(run())
+
+    map_count = sum(
+        "The text is:" in r["messages"][1]["content"]
+        for r in fake_openai_server.requests
+    )
+    assert snapshots[0].startswith("Summarizing...")
+    assert f"Summarizing... {map_count}/{map_count} parts done" in snapshots
+    assert snapshots[-1].startswith("Subject: Fake")
+    assert fake_openai_server.requests[-1]["stream"] is True
+
+
+def test_astream_summary_map_reduce_starts_before_last_page(fake_openai_server):
+    pages_requested_before_last_page = []
+
+    async def pages():
+        for i in range(6):
+            yield f"Page {i}. " * 40
+        await asyncio.sleep(0.2)
+        pages_requested_before_last_page.append(len(fake_openai_server.requests))
+        yield "Last page."
+
+    async def run() -> list[str]:
+        async with fake_openai_server:
+            summarizer = Summarizer(chunk_token_limit=200)
+            stream = summarizer.astream_summary(pages(), mode=SummaryMode.MAP_REDUCE)
+            return [snapshot async for snapshot in stream]
+
+    snapshots = asyncio.run(run())
+
+    assert pages_requested_before_last_page[0] > 0
+    assert snapshots[-1].startswith("Subject: Fake")
+
+
+def test_estimate_summary_map_reduce_matches_run(fake_openai_server):
+    text = " ".join(f"Sentence number {i}." for i in range(400))
+    summarizer = Summarizer(chunk_token_limit=200)
+    # The fake server answers with summaries of about 10 tokens
+    summarizer.PART_SUMMARY_TOKENS = 10
+
+    estimate = summarizer.estimate_summary(
+        text, words_limit=100, mode=SummaryMode.MAP_REDUCE
+    )
+
+    async def run() -> None:
+        async with fake_openai_server:
+            await summarizer.agenerate_summary(
+                text, words_limit=100, mode=SummaryMode.MAP_REDUCE
+            )
+
+    asyncio.run(run())
+
+    assert abs(estimate.api_calls - len(fake_openai_server.requests)) <= 1
+    assert estimate.prompt_tokens >= len(text) // 4
+    assert estimate.cost > 0
+    assert estimate.seconds > 0
+
+
+def test_estimate_summary_recursive_calls(fake_tokenizer):
+    summarizer = Summarizer()
+    # About 3 prompts worth of tokens, recursion adds one call per prompt
+    text = "word " * 8000
+
+    estimate = summarizer.estimate_summary(text)
+    single = Summarizer(allow_recursion=False).estimate_summary(text)
+
+    assert estimate.api_calls == 4
+    assert single.api_calls == 1
+    assert estimate.seconds > single.seconds
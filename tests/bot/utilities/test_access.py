@@ -0,0 +1,73 @@
+import asyncio
+import os
+from pathlib import Path
+
+import toml
+
+from bot.utilities.access import AccessManager
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def write_access_file(path: Path, admins: list[str], whitelist: list[str]) -> None:
+    path.write_text(toml.dumps({"admins": admins, "whitelist": whitelist}))
+    # Make the change visible even within the resolution of the file times
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_users_are_found_by_id_or_username():
+    manager = AccessManager(admins=["Admin"], whitelist=["@Friend", 1234])
+    whitelist = [f"user_{i}" for i in range(20_000)]
+    for user in whitelist:
+        manager.add_whitelisted_user(user)
+
+    assert manager.is_admin("admin")
+    assert manager.is_allowed(None, "FRIEND")
+    assert manager.is_whitelisted(1234, None)
+    assert manager.is_allowed(5678, "user_19999")
+    assert not manager.is_admin(1234, "friend")
+    assert not manager.is_allowed(5678, None)
+
+
+def test_changes_are_written_in_batches(tmp_path: Path):
+    access_file = tmp_path / "access.toml"
+    write_access_file(access_file, ["admin"], [])
+    manager = AccessManager.from_toml(str(access_file), write_delay=0.05)
+    writes = []
+    to_toml = manager.to_toml
+    manager.to_toml = lambda path: writes.append(path) or to_toml(path)
+
+    async def change() -> None:
+        manager.add_whitelisted_user("first")
+        manager.add_whitelisted_user("second")
+        manager.remove_admin("admin")
+        assert writes == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(change())
+    assert writes == [str(access_file)]
+    assert toml.load(access_file) == {"admins": [], "whitelist": ["first", "second"]}
+
+
+def test_file_changes_are_reloaded(tmp_path: Path):
+    access_file = tmp_path / "access.toml"
+    write_access_file(access_file, ["admin"], ["first"])
+    clock = FakeClock()
+    manager = AccessManager.from_toml(str(access_file), clock=clock)
+
+    write_access_file(access_file, ["admin"], ["second"])
+    assert manager.is_whitelisted("first")
+    clock.now += 5
+    assert manager.is_whitelisted("second")
+    assert not manager.is_whitelisted("first")
+
+    access_file.write_text("not valid toml [")
+    clock.now += 5
+    assert manager.is_whitelisted("second")
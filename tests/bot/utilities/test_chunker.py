@@ -0,0 +1,63 @@
+import pytest
+
+from bot.utilities.chunker import split_into_chunks
+
+DOCUMENT = (
+    "# Title\n\n"
+    "First paragraph. It has two sentences.\n\n"
+    "Second one is here.\n"
+    "| a | b |\n"
+    "| c | d |\n"
+    "\f# Page two\n"
+    "More text here. And more.\n"
+)
+
+
+def test_chunks_cover_the_text_without_gaps(fake_tokenizer):
+    chunks = split_into_chunks(DOCUMENT, fake_tokenizer, max_tokens=10)
+
+    assert "".join(chunk.text for chunk in chunks) == DOCUMENT
+    assert all(chunk.token_count <= 10 for chunk in chunks)
+    assert [chunk.start for chunk in chunks[1:]] == [c.end for c in chunks[:-1]]
+
+
+def test_chunks_end_at_the_strongest_boundary(fake_tokenizer):
+    chunks = split_into_chunks(DOCUMENT, fake_tokenizer, max_tokens=30)
+
+    # The first page fits and ends right before the heading of the second one
+    assert chunks[0].text.endswith("| c | d |\n\f")
+    assert chunks[1].text.startswith("# Page two")
+
+
+def test_chunks_do_not_split_words_or_table_rows(fake_tokenizer):
+    chunks = split_into_chunks(DOCUMENT, fake_tokenizer, max_tokens=10)
+
+    for chunk in chunks:
+        assert chunk.text[-1] in " \n\f"
+    assert not any(chunk.text.endswith("| a ") for chunk in chunks)
+
+
+def test_long_words_are_split_at_spaces(fake_tokenizer):
+    text = " ".join(["word"] * 50)
+
+    chunks = split_into_chunks(text, fake_tokenizer, max_tokens=8)
+
+    assert "".join(chunk.text for chunk in chunks) == text
+    assert all(chunk.text.endswith(" ") for chunk in chunks[:-1])
+    assert all(chunk.token_count <= 8 for chunk in chunks)
+
+
+def test_chunks_overlap(fake_tokenizer):
+    text = " ".join(f"Sentence {i}." for i in range(40))
+
+    chunks = split_into_chunks(text, fake_tokenizer, max_tokens=20, overlap_tokens=5)
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk.start < previous.end
+        assert previous.end - chunk.start <= 5 * fake_tokenizer.CHARS_PER_TOKEN
+    assert chunks[-1].end == len(text)
+
+
+def test_overlap_must_leave_room_for_new_text(fake_tokenizer):
+    with pytest.raises(ValueError):
+        split_into_chunks(DOCUMENT, fake_tokenizer, max_tokens=10, overlap_tokens=5)
@@ -0,0 +1,127 @@
+import asyncio
+import ipaddress
+import socket
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.utilities.gitbook_crawler import CrawlCorpus, SiteCrawler, normalize_url
+from bot.utilities import web_fetcher
+from bot.utilities.http_session import close_http_session
+
+PAGE_COUNT = 200
+PAGE_LATENCY = 0.05
+
+
+class DocsSite:
+    """Local docs site where every page links to the index and the next pages."""
+
+    def __init__(self) -> None:
+        self.requested: list[str] = []
+        self.not_modified = 0
+        # Keep the same port between crawls so page URLs stay the same
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+
+    def _page_html(self, index: int | None) -> str:
+        if index is None:
+            steps, index = range(PAGE_COUNT), 0
+        else:
+            steps = (1, 2, 3)
+        links = [
+            f'<a href="/docs/page/{(index + step) % PAGE_COUNT}#section">Page</a>'
+            for step in steps
+        ]
+        links.append('<a href="/docs/">Index</a>')
+        links.append('<a href="https://example.com/external">External</a>')
+        links.append('<a href="/docs/private/secret">Secret</a>')
+        return (
+            f"<html><body><p>Content of page {index}</p>{''.join(links)}</body></html>"
+        )
+
+    async def robots(self, request: web.Request) -> web.Response:
+        return web.Response(text="User-agent: *\nDisallow: /docs/private/\n")
+
+    async def page(self, request: web.Request) -> web.Response:
+        self.requested.append(request.path)
+        await asyncio.sleep(PAGE_LATENCY)
+        if request.headers.get("If-None-Match") == '"v1"':
+            self.not_modified += 1
+            return web.Response(status=304)
+        index = request.match_info.get("index")
+        index = None if index is None else int(index)
+        return web.Response(
+            text=self._page_html(index),
+            content_type="text/html",
+            headers={"ETag": '"v1"'},
+        )
+
+    def crawl(
+        self, crawler: SiteCrawler, previous_corpus: CrawlCorpus | None = None
+    ) -> CrawlCorpus:
+        async def run() -> CrawlCorpus:
+            app = web.Application()
+            app.router.add_get("/robots.txt", self.robots)
+            app.router.add_get("/docs/", self.page)
+            app.router.add_get("/docs/page/{index}", self.page)
+            app.router.add_get("/docs/private/secret", self.page)
+            async with TestServer(app, port=self.port) as server:
+                try:
+                    url = str(server.make_url("/docs/"))
+                    return await crawler.crawl(url, previous_corpus)
+                finally:
+                    await close_http_session()
+
+        return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def allow_local_site(monkeypatch: pytest.MonkeyPatch) -> None:
+    networks = (ipaddress.ip_network("127.0.0.1/32"),)
+    monkeypatch.setattr(web_fetcher, "ALLOWED_NETWORKS", networks)
+
+
+def test_normalize_url():
+    base = "HTTPS://Docs.Example.com:443/hub/intro"
+    assert normalize_url("guide#part", base) == "https://docs.example.com/hub/guide"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("mailto:someone@example.com") is None
+
+
+def test_crawl_visits_every_page_once_concurrently():
+    site = DocsSite()
+
+    start = time.perf_counter()
+    corpus = site.crawl(SiteCrawler(concurrency=16))
+    elapsed = time.perf_counter() - start
+
+    assert len(corpus.pages) == PAGE_COUNT + 1
+    assert len(site.requested) == len(set(site.requested)) == PAGE_COUNT + 1
+    assert "/docs/private/secret" not in site.requested
+    assert elapsed < PAGE_COUNT * PAGE_LATENCY / 4
+    page_7 = next(page for url, page in corpus.pages.items() if url.endswith("/7"))
+    assert page_7.text.startswith("Content of page 7")
+
+
+def test_crawl_respects_depth_and_page_limits():
+    site = DocsSite()
+
+    corpus = site.crawl(SiteCrawler(max_depth=0))
+    assert len(corpus.pages) == 1
+
+    corpus = site.crawl(SiteCrawler(max_pages=10))
+    assert len(corpus.pages) == 10
+
+
+def test_recrawl_skips_unchanged_pages():
+    site = DocsSite()
+    corpus = site.crawl(SiteCrawler(max_pages=20))
+
+    recrawled = site.crawl(SiteCrawler(max_pages=20), previous_corpus=corpus)
+
+    assert site.not_modified == 20
+    assert recrawled.unchanged_urls == set(corpus.pages)
+    assert recrawled.get_page_texts() == corpus.get_page_texts()
@@ -0,0 +1,40 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from bot.utilities.lazy import LazyModule, import_object, lazy_import
+
+
+def test_module_is_imported_on_first_use(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    imported = []
+    colorsys = lazy_import("colorsys", on_import=imported.append)
+    assert isinstance(colorsys, LazyModule)
+    assert "colorsys" not in sys.modules and imported == []
+
+    assert colorsys.rgb_to_hsv(1, 0, 0) == (0, 1, 1)
+    assert imported == [sys.modules["colorsys"]]
+    colorsys.ONE_THIRD = 0.5
+    assert sys.modules["colorsys"].ONE_THIRD == 0.5
+    assert imported == [sys.modules["colorsys"]]
+
+    # Modules already imported are returned as they are
+    assert lazy_import("colorsys") is sys.modules["colorsys"]
+    assert import_object("colorsys:rgb_to_hsv") is sys.modules["colorsys"].rgb_to_hsv
+
+
+def test_building_the_app_does_not_import_heavy_modules():
+    script = (
+        "import json, sys\n"
+        "from bot.main import build_application\n"
+        "build_application('123:fake')\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    modules = json.loads(process.stdout.splitlines()[-1])
+    for heavy in ("openai", "tiktoken", "PyPDF2", "bs4", "aiohttp"):
+        assert heavy not in modules
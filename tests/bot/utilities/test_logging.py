@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import queue
+
+from bot.utilities.logging import (
+    JsonFormatter,
+    TextFormatter,
+    TraceQueueHandler,
+    span,
+    trace_id,
+    traced,
+)
+from bot.utilities.worker_pool import WorkerPool
+
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def get_trace_id() -> str:
+    return trace_id.get()
+
+
+def test_queued_records_keep_their_trace_and_format_as_json():
+    records = queue.SimpleQueue()
+    handler = TraceQueueHandler(records)
+    logger = logging.getLogger("tests.logging.json")
+    logger.addHandler(handler)
+    try:
+        with traced("abc123"):
+            logger.warning("Prompt length: %d tokens", 42, extra={"model": "gpt-4"})
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                logger.exception("Failed")
+        logger.warning("Outside")
+    finally:
+        logger.removeHandler(handler)
+
+    queued = [records.get_nowait() for _ in range(records.qsize())]
+    entries = [json.loads(JsonFormatter().format(record)) for record in queued]
+    assert entries[0]["message"] == "Prompt length: 42 tokens"
+    assert entries[0]["trace_id"] == "abc123"
+    assert entries[0]["model"] == "gpt-4"
+    assert "ZeroDivisionError" in entries[1]["exception"]
+    assert entries[2]["trace_id"] == "-"
+    text = TextFormatter().format(queued[0])
+    assert "[abc123] Prompt length: 42 tokens model=gpt-4" in text
+
+
+def test_spans_are_logged_with_their_fields():
+    handler = ListHandler()
+    logger = logging.getLogger("bot.spans")
+    logger.addHandler(handler)
+
+    async def run() -> list[str]:
+        with traced("trace"):
+            with span("api_call", model="gpt-4") as fields:
+                fields["tokens"] = 10
+            # Tasks started under a trace keep it
+            return await asyncio.gather(asyncio.to_thread(get_trace_id))
+
+    try:
+        assert asyncio.run(run()) == ["trace"]
+        try:
+            with span("download"):
+                raise ValueError("Broken")
+        except ValueError:
+            pass
+    finally:
+        logger.removeHandler(handler)
+
+    first, second = handler.records
+    assert first.span == "api_call" and first.model == "gpt-4"
+    assert first.tokens == 10 and first.status == "ok"
+    assert first.duration_ms >= 0
+    assert second.span == "download" and second.status == "error"
+
+
+def test_worker_tasks_run_under_the_trace_of_the_caller():
+    pool = WorkerPool(processes=1)
+
+    async def run() -> str:
+        with traced("from-parent"):
+            return await pool.run(get_trace_id)
+
+    try:
+        assert asyncio.run(run()) == "from-parent"
+    finally:
+        pool.shutdown()
@@ -0,0 +1,121 @@
+import asyncio
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from bot.modules import model_router
+from bot.modules.openai_conversation import OpenAIConversation
+from bot.utilities.http_session import close_http_session, get_http_session
+from bot.utilities.metrics import (
+    Histogram,
+    Metrics,
+    get_cost,
+    measured,
+    metrics,
+    request_labels,
+    start_metrics_server,
+)
+
+
+def test_usage_is_grouped_and_priced():
+    recorder = Metrics()
+    token = request_labels.set(("42", "summarize"))
+    try:
+        recorder.record_usage("gpt-4-0613", 1000, 500)
+        recorder.record_usage("gpt-3.5-turbo", 2000, 1000)
+    finally:
+        request_labels.reset(token)
+    recorder.record_usage("gpt-3.5-turbo", 10, 10)
+
+    by_user = recorder.get_usage(group_by=0)
+    by_model = recorder.get_usage(group_by=1)
+
+    assert by_user["42"].requests == 2
+    assert by_user["42"].prompt_tokens == 3000
+    assert by_user["unknown"].completion_tokens == 10
+    assert by_model["gpt-4-0613"].cost == get_cost("gpt-4", 1000, 500) == 0.06
+
+
+def test_costs_use_the_prices_of_the_model_table(tmp_path, monkeypatch):
+    models_file = tmp_path / "models.toml"
+    models_file.write_text(
+        """
+["gpt-4"]
+token_limit = 8000
+prompt_price = 0.1
+completion_price = 0.2
+tokens_per_minute = 10000
+requests_per_minute = 200
+"""
+    )
+    monkeypatch.setattr(model_router, "MODELS_FILE", str(models_file))
+
+    assert get_cost("gpt-4-0613", 1000, 1000) == pytest.approx(0.3)
+    # Models missing from the table keep their own prices
+    assert get_cost("gpt-4-32k", 1000, 1000) == pytest.approx(0.18)
+    assert get_cost("unknown-model", 1000, 1000) == 0
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 5))
+    for value in [0.5] * 6 + [1.5] * 3 + [10]:
+        histogram.observe(value)
+
+    assert histogram.get_quantile(0.5) == 1
+    assert histogram.get_quantile(0.9) == 2
+    assert histogram.get_quantile(1.0) == float("inf")
+
+
+def test_render_prometheus_text():
+    recorder = Metrics()
+    recorder.record_usage("gpt-4", 3, 2)
+    recorder.observe_api_latency("gpt-4", 0.3)
+
+    text = recorder.render()
+
+    labels = 'user="unknown",model="gpt-4",command="unknown"'
+    assert f'bot_openai_tokens_total{{{labels},type="prompt"}} 3' in text
+    assert f"bot_openai_requests_total{{{labels}}} 1" in text
+    assert 'bot_openai_request_seconds_bucket{model="gpt-4",le="0.25"} 0' in text
+    assert 'bot_openai_request_seconds_bucket{model="gpt-4",le="0.5"} 1' in text
+    assert 'bot_openai_request_seconds_count{model="gpt-4"} 1' in text
+
+
+def test_measured_handler_labels_completions(fake_openai_server):
+    @measured("summarize")
+    async def handler(update, context):
+        return await OpenAIConversation().aget_completion("Hello")
+
+    async def run():
+        async with fake_openai_server:
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=1234))
+            await handler(update, None)
+
+    asyncio.run(run())
+
+    usage = metrics.get_usage(group_by=0)["1234"]
+    assert usage.requests == 1
+    assert usage.prompt_tokens == 1
+    assert metrics.get_handler_latency()["summarize"].count >= 1
+
+
+def test_metrics_endpoint():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    async def run():
+        runner = await start_metrics_server("127.0.0.1", port)
+        try:
+            url = f"http://127.0.0.1:{port}/metrics"
+            async with get_http_session().get(url) as response:
+                return response.status, await response.text()
+        finally:
+            await close_http_session()
+            await runner.cleanup()
+
+    status, text = asyncio.run(run())
+
+    assert status == 200
+    assert "# TYPE bot_openai_tokens_total counter" in text
@@ -0,0 +1,58 @@
+import asyncio
+from pathlib import Path
+
+from benchmarks.fakes import build_pdf
+from bot.utilities.pdf_reader import aiter_pdf_pages, extract_text_from_pdf
+from bot.utilities.worker_pool import WorkerPool
+
+
+PAGES = [f"Page number {i}" for i in range(20)]
+
+
+def test_extract_text_from_pdf_accepts_path_and_bytes(tmp_path: Path):
+    pdf_bytes = build_pdf(PAGES[:3])
+    pdf_path = tmp_path / "document.pdf"
+    pdf_path.write_bytes(pdf_bytes)
+
+    expected = "Page number 0\n\nPage number 1\n\nPage number 2"
+    assert extract_text_from_pdf(pdf_path) == expected
+    assert extract_text_from_pdf(pdf_bytes) == expected
+
+
+def test_aiter_pdf_pages_yields_pages_in_order():
+    pdf_bytes = build_pdf(PAGES)
+
+    async def run() -> list[str]:
+        pool = WorkerPool(processes=2)
+        try:
+            pages = aiter_pdf_pages(pdf_bytes, pool, pages_per_task=3)
+            return [page async for page in pages]
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(run()) == PAGES
+
+
+def test_aiter_pdf_pages_sends_the_document_once_per_worker(monkeypatch):
+    pdf_bytes = build_pdf(PAGES)
+    sent = []
+
+    async def run() -> list[str]:
+        pool = WorkerPool(processes=2)
+        run_task = pool.run
+
+        async def run_and_count(function, *args):
+            sent.append(pdf_bytes in args)
+            return await run_task(function, *args)
+
+        monkeypatch.setattr(pool, "run", run_and_count)
+        try:
+            pages = aiter_pdf_pages(pdf_bytes, pool, pages_per_task=2)
+            return [page async for page in pages]
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(run()) == PAGES
+    # Opened by one worker and sent again at most to the other one
+    assert len(sent) >= 11
+    assert 1 <= sent.count(True) <= 2
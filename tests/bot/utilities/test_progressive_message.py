@@ -0,0 +1,76 @@
+import asyncio
+from unittest.mock import AsyncMock, Mock
+
+from telegram.error import RetryAfter, TimedOut
+
+from bot.utilities.progressive_message import ProgressiveMessage, split_message
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_split_message_prefers_line_breaks():
+    text = "a" * 6 + "\n" + "b" * 6
+    assert split_message(text, max_length=10) == ["a" * 6, "b" * 6]
+    assert split_message("c" * 25, max_length=10) == ["c" * 10, "c" * 10, "c" * 5]
+
+
+def test_updates_are_rate_limited():
+    clock = FakeClock()
+    message = Mock(text="Generating summary...", edit_text=AsyncMock())
+    progress = ProgressiveMessage(message, edit_interval=1.0, clock=clock)
+
+    async def run():
+        await progress.update("Subject:")
+        clock.now = 1.5
+        await progress.update("Subject: Test")
+        await progress.update("Subject: Test\nKey")
+        await progress.finish("Subject: Test\nKey points:")
+
+    asyncio.run(run())
+
+    edits = [call.args[0] for call in message.edit_text.call_args_list]
+    assert edits == ["Subject: Test", "Subject: Test\nKey points:"]
+
+
+def test_failed_intermediate_edits_are_skipped_and_finish_retries():
+    clock = FakeClock()
+    message = Mock(text="Generating summary...")
+    message.edit_text = AsyncMock(
+        side_effect=[
+            RetryAfter(10),
+            TimedOut(),
+            None,
+            RetryAfter(0),
+            None,
+        ]
+    )
+    progress = ProgressiveMessage(message, edit_interval=1.0, clock=clock)
+
+    async def run():
+        clock.now = 1.5
+        await progress.update("Subject:")
+        # Flood control is waited for, failed versions are skipped
+        clock.now = 5.0
+        await progress.update("Subject: Test")
+        clock.now = 12.5
+        await progress.update("Subject: Test\nKey")
+        clock.now = 13.5
+        await progress.update("Subject: Test\nKey points")
+        await progress.finish("Subject: Test\nKey points: all")
+
+    asyncio.run(run())
+
+    edits = [call.args[0] for call in message.edit_text.call_args_list]
+    assert edits == [
+        "Subject:",
+        "Subject: Test\nKey",
+        "Subject: Test\nKey points",
+        "Subject: Test\nKey points: all",
+        "Subject: Test\nKey points: all",
+    ]
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from bot.utilities.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientCaller,
+    RetryPolicy,
+)
+
+
+class TransientError(Exception):
+    pass
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_caller(clock: FakeClock, **kwargs) -> tuple[ResilientCaller, list[float]]:
+    delays = []
+
+    async def sleep(seconds: float) -> None:
+        delays.append(seconds)
+        clock.now += seconds
+
+    caller = ResilientCaller(
+        is_retryable=lambda e: isinstance(e, TransientError),
+        clock=clock,
+        sleep=sleep,
+        **kwargs,
+    )
+    return caller, delays
+
+
+def failing(times: int, result: str = "ok"):
+    calls = []
+
+    async def call() -> str:
+        calls.append(None)
+        if len(calls) <= times:
+            raise TransientError()
+        return result
+
+    return call, calls
+
+
+def test_retries_transient_errors_with_backoff():
+    caller, delays = make_caller(FakeClock(), policy=RetryPolicy(base_delay=1.0))
+    call, calls = failing(times=3)
+
+    assert asyncio.run(caller.call(call)) == "ok"
+    assert len(calls) == 4
+    # Full jitter keeps every delay below its exponential cap
+    assert [delay <= 2**attempt for attempt, delay in enumerate(delays)] == [True] * 3
+
+
+def test_honours_retry_after_and_gives_up():
+    caller, delays = make_caller(
+        FakeClock(),
+        get_retry_after=lambda e: 7.0,
+        policy=RetryPolicy(max_attempts=3, base_delay=0.1, max_delay=0.1),
+        breaker=CircuitBreaker(failure_threshold=10),
+    )
+    call, calls = failing(times=5)
+
+    with pytest.raises(TransientError):
+        asyncio.run(caller.call(call))
+    assert len(calls) == 3
+    assert delays == [7.0, 7.0]
+
+
+def test_does_not_retry_other_errors():
+    caller, delays = make_caller(FakeClock())
+
+    async def call() -> None:
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(call))
+    assert delays == []
+
+
+def test_circuit_opens_and_lets_a_probe_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    caller, _ = make_caller(clock, policy=RetryPolicy(max_attempts=1), breaker=breaker)
+    call, calls = failing(times=2)
+
+    for _ in range(2):
+        with pytest.raises(TransientError):
+            asyncio.run(caller.call(call))
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(caller.call(call))
+    assert len(calls) == 2
+
+    clock.now += 30
+    assert asyncio.run(caller.call(call)) == "ok"
+    assert not breaker.is_open
+
+
+def test_slow_calls_are_hedged():
+    async def run() -> tuple[str, int]:
+        caller = ResilientCaller(is_retryable=lambda e: False, hedge_percentile=90)
+        calls = 0
+
+        async def call() -> str:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01 if calls <= 20 else 10 if calls == 21 else 0)
+            return f"call {calls}"
+
+        for _ in range(20):
+            await caller.call(call)
+        return await asyncio.wait_for(caller.call(call), timeout=1), calls
+
+    result, calls = asyncio.run(run())
+
+    assert result == "call 22"
+    assert calls == 22
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
+
+from benchmarks.fakes import FakeTelegramRequest, make_message_update
+from bot.utilities.shared_state import (
+    MemorySharedState,
+    SharedConversationHandler,
+    SharedTasks,
+    SqliteSharedState,
+    get_shared_state,
+)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def clock_and_state(request, tmp_path):
+    clock = FakeClock()
+    if request.param == "memory":
+        return clock, MemorySharedState(clock=clock)
+    return clock, SqliteSharedState(str(tmp_path / "state.db"), clock=clock)
+
+
+def test_add_touch_and_delete(clock_and_state):
+    clock, state = clock_and_state
+    assert state.add("claim", "worker-1", ttl=10)
+    assert not state.add("claim", "worker-2", ttl=10)
+    assert not state.touch("claim", "worker-2", ttl=10)
+    assert not state.delete("claim", "worker-2")
+
+    clock.now += 9
+    assert state.touch("claim", "worker-1", ttl=10)
+    clock.now += 9
+    assert state.get("claim") == "worker-1"
+    assert state.delete("claim", "worker-1")
+    assert state.get("claim") is None
+
+
+def test_expired_keys_can_be_added_again(clock_and_state):
+    clock, state = clock_and_state
+    state.set("a:1", "one", ttl=5)
+    state.set("a:2", "two")
+    state.set("b:1", "other")
+    assert sorted(state.keys("a:")) == ["a:1", "a:2"]
+
+    clock.now += 5
+    assert state.get("a:1") is None
+    assert state.keys("a:") == ["a:2"]
+    assert state.add("a:1", "new")
+    assert not state.add("a:2", "new")
+
+
+def test_sqlite_state_is_shared_between_connections(tmp_path):
+    first = get_shared_state(f"sqlite:///{tmp_path / 'state.db'}")
+    second = get_shared_state(f"sqlite:///{tmp_path / 'state.db'}")
+    assert first.add("claim", "first", ttl=60)
+    assert not second.add("claim", "second", ttl=60)
+    assert second.get("claim") == "first"
+    with pytest.raises(ValueError):
+        get_shared_state("redis://localhost")
+
+
+def test_shared_tasks_run_identical_tasks_once(tmp_path):
+    replicas = [
+        SharedTasks(
+            SqliteSharedState(str(tmp_path / "state.db")),
+            worker_id=f"worker-{i}",
+            poll_seconds=0.01,
+        )
+        for i in range(3)
+    ]
+    calls = []
+    waits = []
+
+    async def summarize() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "summary"
+
+    async def wait() -> None:
+        waits.append(1)
+
+    async def run_all() -> list[str]:
+        return await asyncio.gather(
+            *[tasks.run("key", summarize, on_wait=wait) for tasks in replicas]
+        )
+
+    assert asyncio.run(run_all()) == ["summary"] * 3
+    assert len(calls) == 1
+    assert len(waits) == 2
+
+
+def test_shared_tasks_are_taken_over_after_a_failure():
+    state = MemorySharedState()
+    owner = SharedTasks(state, worker_id="owner", poll_seconds=0.01)
+    waiter = SharedTasks(state, worker_id="waiter", poll_seconds=0.01)
+
+    async def fail() -> str:
+        await asyncio.sleep(0.02)
+        raise RuntimeError("API down")
+
+    async def succeed() -> str:
+        return "summary"
+
+    async def run_both():
+        return await asyncio.gather(
+            owner.run("key", fail), waiter.run("key", succeed), return_exceptions=True
+        )
+
+    failed, result = asyncio.run(run_both())
+    assert isinstance(failed, RuntimeError)
+    assert result == "summary"
+    assert state.get("claim:key") is None
+
+
+def build_replica(state, replies: list[str]) -> Application:
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(FakeTelegramRequest())
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .build()
+    )
+
+    async def start(update, context) -> int:
+        return 0
+
+    async def reply(update, context) -> int:
+        replies.append(update.message.text)
+        return SharedConversationHandler.END
+
+    app.add_handler(
+        SharedConversationHandler(
+            entry_points=[CommandHandler("start", start)],
+            states={0: [MessageHandler(filters.TEXT, reply)]},
+            fallbacks=[],
+            name="conversation",
+            state=state,
+        )
+    )
+    return app
+
+
+def test_conversations_continue_in_another_replica(tmp_path):
+    replies = []
+    db_path = str(tmp_path / "state.db")
+    first = build_replica(SqliteSharedState(db_path), replies)
+    second = build_replica(SqliteSharedState(db_path), replies)
+
+    async def converse() -> None:
+        for app in (first, second):
+            await app.initialize()
+        start = make_message_update(1, 7, "user", "/start")
+        await first.process_update(Update.de_json(start, first.bot))
+        text = make_message_update(2, 7, "user", "Hello")
+        await second.process_update(Update.de_json(text, second.bot))
+        # The conversation ended, so the next text is not handled
+        text = make_message_update(3, 7, "user", "Again")
+        await first.process_update(Update.de_json(text, first.bot))
+        for app in (first, second):
+            await app.shutdown()
+
+    asyncio.run(converse())
+    assert replies == ["Hello"]
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from bot.utilities.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_result_or_error():
+    flight = SingleFlight()
+    calls, waits = [], []
+
+    async def download() -> bytes:
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return b"pdf"
+
+    async def fail() -> bytes:
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        raise RuntimeError("Download failed")
+
+    async def wait() -> None:
+        waits.append(1)
+
+    async def run() -> tuple[list, list]:
+        results = await asyncio.gather(
+            *[flight.run("file", download, on_wait=wait) for _ in range(3)]
+        )
+        errors = await asyncio.gather(
+            *[flight.run("file", fail) for _ in range(3)], return_exceptions=True
+        )
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert results == [b"pdf"] * 3
+    assert [type(error) for error in errors] == [RuntimeError] * 3
+    assert len(calls) == 2 and len(waits) == 2
+    assert "file" not in flight
+
+
+def test_cancelled_callers_do_not_stop_the_others():
+    flight = SingleFlight()
+    calls = []
+
+    async def download() -> bytes:
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"pdf"
+
+    async def run() -> list:
+        owner = asyncio.create_task(flight.run("file", download))
+        waiter = asyncio.create_task(flight.run("file", download))
+        other_waiter = asyncio.create_task(flight.run("file", download))
+        await asyncio.sleep(0.01)
+        # The waiter only stops waiting, the owner is cancelled and the other
+        # waiter downloads the file again
+        waiter.cancel()
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await other_waiter
+
+    assert asyncio.run(run()) == b"pdf"
+    assert len(calls) == 2
@@ -0,0 +1,68 @@
+from bot.utilities.summary_cache import SummaryCache, make_cache_key
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_make_cache_key_normalizes_whitespace():
+    key = make_cache_key("Some  text\n here ", "gpt-3.5-turbo", "prompt", 100, 0.2)
+    same_key = make_cache_key("Some text here", "gpt-3.5-turbo", "prompt", 100, 0.2)
+    other_key = make_cache_key("Some text here", "gpt-3.5-turbo", "prompt", 50, 0.2)
+    assert key == same_key
+    assert key != other_key
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = SummaryCache(max_entries=2)
+    cache.set("a", "summary a")
+    cache.set("b", "summary b")
+    assert cache.get("a") == "summary a"
+    cache.set("c", "summary c")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "summary a"
+    assert cache.get("c") == "summary c"
+    assert (cache.stats.hits, cache.stats.misses) == (3, 1)
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    clock = FakeClock()
+    cache = SummaryCache(ttl_seconds=60, db_path=str(tmp_path / "c.db"), clock=clock)
+    cache.set("a", "summary a")
+    clock.now += 61
+
+    assert cache.get("a") is None
+    assert cache.stats.misses == 1
+
+
+def test_disk_tier_persists_between_instances(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = SummaryCache(db_path=db_path)
+    cache.set("a", "summary a")
+    cache.close()
+
+    cache = SummaryCache(db_path=db_path)
+    assert cache.get("a") == "summary a"
+    assert cache.get("a") == "summary a"
+    assert cache.stats.disk_hits == 1
+    assert cache.stats.memory_hits == 1
+
+
+def test_disk_tier_keeps_size_limit(tmp_path):
+    clock = FakeClock()
+    db_path = str(tmp_path / "cache.db")
+    cache = SummaryCache(
+        max_entries=1, db_path=db_path, max_disk_entries=2, clock=clock
+    )
+    for key in ["a", "b", "c"]:
+        clock.now += 1
+        cache.set(key, "summary " + key)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "summary b"
+    assert cache.get("c") == "summary c"
@@ -0,0 +1,163 @@
+import asyncio
+import ipaddress
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.utilities.http_session import close_http_session
+from bot.utilities.web_fetcher import (
+    FetchError,
+    FetchedContent,
+    aextract_text,
+    fetch_url,
+    html_to_text,
+    is_public_address,
+)
+
+# The test server listens on its own loopback address, which is allowed, to
+# check that the rest of loopback is refused
+SERVER_HOST = "127.0.0.2"
+SERVER_NETWORKS = [ipaddress.ip_network("127.0.0.2/32")]
+
+HTML = """<html><head><style>p {color: red}</style></head><body>
+<nav>Home | About</nav>
+<h1>Title</h1>
+<p>First paragraph.</p>
+<script>alert("hi")</script>
+<p>Second paragraph.</p>
+</body></html>"""
+
+
+async def html_page(request: web.Request) -> web.Response:
+    return web.Response(text=HTML, content_type="text/html")
+
+
+async def pdf_file(request: web.Request) -> web.Response:
+    return web.Response(body=b"%PDF-1.4 fake", content_type="application/pdf")
+
+
+async def large_file(request: web.Request) -> web.StreamResponse:
+    response = web.StreamResponse()
+    await response.prepare(request)
+    for _ in range(10):
+        await response.write(b"x" * 1000)
+    return response
+
+
+async def slow_page(request: web.Request) -> web.Response:
+    await asyncio.sleep(1)
+    return web.Response(text="Too late")
+
+
+async def missing_page(request: web.Request) -> web.Response:
+    return web.Response(status=404)
+
+
+async def moved_page(request: web.Request) -> web.Response:
+    raise web.HTTPFound("/page")
+
+
+async def loopback_redirect(request: web.Request) -> web.Response:
+    raise web.HTTPFound(f"http://127.0.0.1:{request.url.port}/page")
+
+
+async def metadata_redirect(request: web.Request) -> web.Response:
+    raise web.HTTPFound("http://169.254.169.254/latest/meta-data/")
+
+
+def fetch(path: str, **kwargs) -> FetchedContent:
+    async def run() -> FetchedContent:
+        app = web.Application()
+        app.router.add_get("/page", html_page)
+        app.router.add_get("/file.pdf", pdf_file)
+        app.router.add_get("/large", large_file)
+        app.router.add_get("/slow", slow_page)
+        app.router.add_get("/missing", missing_page)
+        app.router.add_get("/moved", moved_page)
+        app.router.add_get("/loopback", loopback_redirect)
+        app.router.add_get("/metadata", metadata_redirect)
+        kwargs.setdefault("allowed_networks", SERVER_NETWORKS)
+        async with TestServer(app, host=SERVER_HOST) as server:
+            try:
+                return await fetch_url(str(server.make_url(path)), **kwargs)
+            finally:
+                await close_http_session()
+
+    return asyncio.run(run())
+
+
+def test_fetch_html_and_extract_text():
+    content = fetch("/page")
+
+    assert content.is_html and not content.is_pdf
+    text = asyncio.run(aextract_text(content))
+    assert text == "Title\nFirst paragraph.\nSecond paragraph."
+
+
+def test_fetch_routes_pdf_by_content_type():
+    content = fetch("/file.pdf")
+
+    assert content.is_pdf
+    assert content.body == b"%PDF-1.4 fake"
+
+
+def test_fetch_enforces_size_limit():
+    with pytest.raises(FetchError, match="larger than"):
+        fetch("/large", max_bytes=5000)
+
+
+def test_fetch_enforces_time_limit():
+    with pytest.raises(FetchError, match="longer than"):
+        fetch("/slow", timeout=0.2)
+
+
+def test_fetch_reports_http_errors():
+    with pytest.raises(FetchError, match="404"):
+        fetch("/missing")
+
+
+def test_fetch_rejects_other_schemes():
+    with pytest.raises(FetchError, match="scheme"):
+        asyncio.run(fetch_url("ftp://example.com/file"))
+
+
+def test_fetch_follows_redirects():
+    content = fetch("/moved")
+
+    assert content.is_html
+    assert content.url.endswith("/page")
+
+
+def test_fetch_refuses_private_addresses():
+    with pytest.raises(FetchError, match="private address"):
+        fetch("/page", allowed_networks=[])
+    with pytest.raises(FetchError, match="private address"):
+        fetch("/loopback")
+    with pytest.raises(FetchError, match="private address"):
+        fetch("/metadata")
+
+
+def test_is_public_address():
+    assert is_public_address("93.184.216.34")
+    assert is_public_address("2606:2800:220:1:248:1893:25c7:1946")
+    for address in (
+        "127.0.0.1",
+        "10.0.0.1",
+        "192.168.1.1",
+        "172.16.0.1",
+        "169.254.169.254",
+        "100.64.0.1",
+        "0.0.0.0",
+        "::1",
+        "fd00:ec2::254",
+        "::ffff:127.0.0.1",
+        "240.0.0.1",
+    ):
+        assert not is_public_address(address), address
+    assert is_public_address("10.0.0.1", [ipaddress.ip_network("10.0.0.0/8")])
+
+
+def test_html_to_text_skips_scripts_and_navigation():
+    assert "alert" not in html_to_text(HTML)
+    assert "Home" not in html_to_text(HTML)
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram.ext import Application, MessageHandler, filters
+
+from benchmarks.fakes import FakeTelegramRequest, make_message_update
+from bot.utilities.webhook import (
+    SECRET_HEADER,
+    WebhookConfig,
+    WebhookServer,
+    get_bot_mode,
+    get_webhook_config,
+)
+
+CONFIG = WebhookConfig(url="https://bot.example.com", secret_token="s3cret")
+
+
+def build_app(handled: list[str], handler_delay: float = 0.0) -> Application:
+    app = (
+        Application.builder()
+        .token("123:fake")
+        .request(FakeTelegramRequest())
+        .get_updates_request(FakeTelegramRequest())
+        .updater(None)
+        .concurrent_updates(True)
+        .build()
+    )
+
+    async def handle(update, context) -> None:
+        await asyncio.sleep(handler_delay)
+        handled.append(update.message.text)
+
+    app.add_handler(MessageHandler(filters.TEXT, handle))
+    return app
+
+
+def test_webhook_validates_secret_and_queues_updates():
+    handled = []
+
+    async def run() -> list[int]:
+        app = build_app(handled)
+        server = WebhookServer(app, CONFIG)
+        await app.initialize()
+        await app.start()
+        statuses = []
+        async with TestClient(TestServer(server.build_app())) as client:
+            update = make_message_update(1, 42, "user", "Hello")
+            for secret in ["wrong", "s3cret"]:
+                response = await client.post(
+                    "/telegram", json=update, headers={SECRET_HEADER: secret}
+                )
+                statuses.append(response.status)
+            response = await client.post("/telegram", json=update)
+            statuses.append(response.status)
+            await app.stop()
+            await app.shutdown()
+        return statuses
+
+    statuses = asyncio.run(run())
+
+    assert statuses == [403, 200, 403]
+    assert handled == ["Hello"]
+
+
+def test_draining_refuses_updates_and_finishes_in_flight_ones():
+    handled = []
+
+    async def run() -> dict[str, int]:
+        app = build_app(handled, handler_delay=0.2)
+        server = WebhookServer(app, CONFIG)
+        await app.initialize()
+        await app.start()
+        async with TestClient(TestServer(server.build_app())) as client:
+            headers = {SECRET_HEADER: "s3cret"}
+            update = make_message_update(1, 42, "user", "In flight")
+            await client.post("/telegram", json=update, headers=headers)
+            ready = (await client.get("/readyz")).status
+            await asyncio.sleep(0.05)
+
+            server.drain()
+            update = make_message_update(2, 42, "user", "Too late")
+            refused = await client.post("/telegram", json=update, headers=headers)
+            await app.stop()
+            statuses = {
+                "ready": ready,
+                "refused": refused.status,
+                "draining_ready": (await client.get("/readyz")).status,
+                "health": (await client.get("/healthz")).status,
+            }
+            await app.shutdown()
+        return statuses
+
+    statuses = asyncio.run(run())
+
+    assert statuses == {
+        "ready": 200,
+        "refused": 503,
+        "draining_ready": 503,
+        "health": 200,
+    }
+    assert handled == ["In flight"]
+
+
+def test_webhook_config_from_environment(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("BOT_MODE", "webhook")
+    monkeypatch.setenv("WEBHOOK_URL", "https://bot.example.com")
+    monkeypatch.setenv("WEBHOOK_SECRET_TOKEN", "s3cret")
+    monkeypatch.setenv("WEBHOOK_PORT", "8443")
+
+    assert get_bot_mode() == "webhook"
+    assert get_webhook_config() == WebhookConfig(
+        url="https://bot.example.com", secret_token="s3cret", port=8443
+    )
+
+    monkeypatch.setenv("WEBHOOK_SECRET_TOKEN", "not valid!")
+    with pytest.raises(ValueError):
+        get_webhook_config()
+    monkeypatch.setenv("BOT_MODE", "carrier-pigeon")
+    with pytest.raises(ValueError):
+        get_bot_mode()
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from bot.utilities.worker_pool import (
+    WorkerCrashedError,
+    WorkerMemoryError,
+    WorkerPool,
+    WorkerPoolFullError,
+    WorkerTimeoutError,
+)
+
+
+def square(value: int) -> int:
+    return value * value
+
+
+def fail(message: str) -> None:
+    raise ValueError(message)
+
+
+def crash() -> None:
+    os._exit(3)
+
+
+def allocate(megabytes: int) -> int:
+    return len(bytearray(megabytes * 2**20))
+
+
+def run_with_pool(coroutine_function, **pool_kwargs):
+    pool = WorkerPool(**pool_kwargs)
+
+    async def run():
+        return await coroutine_function(pool)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+
+def test_results_and_exceptions_are_returned():
+    async def run(pool):
+        results = await asyncio.gather(*[pool.run(square, i) for i in range(6)])
+        with pytest.raises(ValueError, match="malformed"):
+            await pool.run(fail, "malformed")
+        return results
+
+    assert run_with_pool(run, processes=2) == [0, 1, 4, 9, 16, 25]
+
+
+def test_failing_workers_are_replaced():
+    async def run(pool):
+        with pytest.raises(WorkerCrashedError):
+            await pool.run(crash)
+        with pytest.raises(WorkerTimeoutError):
+            await pool.run(time.sleep, 10, timeout=0.2)
+        with pytest.raises(WorkerMemoryError):
+            await pool.run(allocate, 1024)
+        return await pool.run(square, 3)
+
+    assert run_with_pool(run, processes=1, max_memory_mb=256) == 9
+
+
+def test_tasks_past_the_queue_are_refused():
+    async def run(pool):
+        tasks = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(3)]
+        await asyncio.sleep(0)
+        with pytest.raises(WorkerPoolFullError):
+            await pool.run(square, 2)
+        await asyncio.gather(*tasks)
+        return await pool.run(square, 2)
+
+    assert run_with_pool(run, processes=1, max_queued=2) == 4
+
+
+def test_memory_limit_is_on_top_of_the_inherited_address_space():
+    async def run(pool):
+        # The worker starts with the whole address space of the test process
+        assert await pool.run(allocate, 32) == 32 * 2**20
+        with pytest.raises(WorkerMemoryError):
+            await pool.run(allocate, 256)
+        return await pool.run(allocate, 32)
+
+    assert run_with_pool(run, processes=1, max_memory_mb=64) == 32 * 2**20
@@ -0,0 +1,22 @@
+import openai
+import pytest
+
+from benchmarks.fakes import FakeOpenAIServer, FakeTokenizer
+from bot.modules.openai_conversation import OpenAIConversation
+
+
+@pytest.fixture
+def fake_tokenizer(monkeypatch: pytest.MonkeyPatch) -> FakeTokenizer:
+    tokenizer = FakeTokenizer()
+    monkeypatch.setattr(OpenAIConversation, "_get_tokenizer", lambda self: tokenizer)
+    return tokenizer
+
+
+@pytest.fixture
+def fake_openai_server(
+    monkeypatch: pytest.MonkeyPatch, fake_tokenizer: FakeTokenizer
+) -> FakeOpenAIServer:
+    server = FakeOpenAIServer()
+    monkeypatch.setattr(openai, "api_base", server.api_base)
+    monkeypatch.setattr(openai, "api_key", "sk-fake")
+    return server